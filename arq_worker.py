@@ -1,13 +1,24 @@
 # pylama:ignore=E731
 import aioredis
 import logging.config
+import uuid
 
-from arq import Worker, func
+from arq import Worker, cron, func
 from arq.worker import get_kwargs
 from pydest.pydest import Pydest
-from seraphsix.constants import ARQ_JOB_TIMEOUT, ARQ_MAX_JOBS
+from seraphsix.constants import (
+    ARQ_JOB_TIMEOUT,
+    ARQ_MAX_JOBS,
+    ARQ_MAX_TRIES,
+    METRICS_PORTS,
+    UPDATE_MEMBERS_SECONDS,
+)
 from seraphsix.database import Database
+from seraphsix.jobs import collect_queue_metrics, dead_letter, instrument
+from seraphsix.manifest import Manifest
+from seraphsix.metrics import add_collector, start_metrics_server
 from seraphsix.models import deserializer, serializer
+from seraphsix.sharding import ShardedWorker, shard_queues
 from seraphsix.tasks.activity import (
     get_characters,
     process_activity,
@@ -16,7 +27,10 @@ from seraphsix.tasks.activity import (
     store_all_games,
     save_last_active,
 )
-from seraphsix.tasks.core import set_cached_members
+from seraphsix.tasks.clan import refresh_clan_info, set_clan_info
+from seraphsix.tasks.core import scheduler, set_cached_members
+from seraphsix.tasks.partitions import maintain_game_partitions
+from seraphsix.tasks.schedule import schedule_member_caches, schedule_member_updates
 from seraphsix.tasks.config import Config, log_config
 
 config = Config()
@@ -29,37 +43,79 @@ async def startup(ctx):
         client_secret=config.destiny.client_secret,
     )
 
-    database = Database(config.database_url, config.database_conns)
+    database = Database(
+        config.database_url,
+        config.database_conns,
+        config.database_ingest_conns,
+        config.game_retention_months,
+    )
     await database.initialize()
     ctx["database"] = database
     ctx["redis_cache"] = await aioredis.create_redis_pool(config.redis_url)
     ctx["redis_jobs"] = ctx["redis"]
+    ctx["instance_id"] = uuid.uuid4().hex
+    # Loaded on first use by decode_activity
+    ctx["manifest"] = Manifest(ctx["destiny"], config.manifest_path)
+    if config.metrics_port:
+        add_collector(lambda: collect_queue_metrics(ctx["redis_jobs"], shard_queues()))
+        ctx["metrics"] = await start_metrics_server(
+            config.metrics_port, ports=METRICS_PORTS
+        )
 
 
 async def shutdown(ctx):
     await ctx["destiny"].close()
+    if "manifest" in ctx:
+        ctx["manifest"].close()
     if "database" in ctx:
         await ctx["database"].close()
     if "redis_cache" in ctx:
         ctx["redis_cache"].close()
         await ctx["redis_cache"].wait_closed()
+    if "metrics" in ctx:
+        await ctx["metrics"].cleanup()
+
+
+def worker_function(coroutine, **kwargs):
+    return func(instrument(dead_letter(scheduler.job(coroutine))), **kwargs)
 
 
 class WorkerSettings:
     functions = [
-        set_cached_members,
-        get_characters,
-        process_activity,
-        store_member_history,
-        store_all_games,
-        func(save_last_active, keep_result=240),
-        func(store_last_active, keep_result=240),
+        worker_function(set_cached_members),
+        worker_function(set_clan_info),
+        worker_function(get_characters),
+        worker_function(process_activity),
+        worker_function(store_member_history),
+        worker_function(store_all_games),
+        worker_function(save_last_active, keep_result=240),
+        worker_function(store_last_active, keep_result=240),
+    ]
+    cron_jobs = [
+        cron(
+            instrument(maintain_game_partitions),
+            hour={4},
+            minute={0},
+            run_at_startup=True,
+        ),
+        cron(
+            instrument(refresh_clan_info), minute={0, 15, 30, 45}, run_at_startup=True
+        ),
+        cron(instrument(schedule_member_caches), minute={0}, run_at_startup=True),
     ]
+    if config.enable_activity_tracking:
+        cron_jobs.append(
+            cron(
+                instrument(schedule_member_updates),
+                minute=set(range(0, 60, UPDATE_MEMBERS_SECONDS // 60)),
+            )
+        )
     on_startup = startup
     on_shutdown = shutdown
     redis_settings = config.arq_redis
     max_jobs = ARQ_MAX_JOBS
     job_timeout = ARQ_JOB_TIMEOUT
+    max_tries = ARQ_MAX_TRIES
 
     def job_serializer(b):
         return serializer(b)
@@ -70,5 +126,8 @@ class WorkerSettings:
 
 if __name__ == "__main__":
     logging.config.dictConfig(log_config())
-    worker = Worker(**get_kwargs(WorkerSettings))
+    if config.worker_shards:
+        worker = ShardedWorker(WorkerSettings)
+    else:
+        worker = Worker(**get_kwargs(WorkerSettings))
     worker.run()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Compare the asyncpg fast path in Database with the equivalent ORM queries.
+
+Usage: python -m benchmarks.fast_path <guild_id> <discord_id> [-n ITERATIONS]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from seraphsix.database import Database
+from seraphsix.models.database import Clan, ClanMember, Guild, Member
+from seraphsix.tasks.config import Config
+
+
+def orm_queries(guild_id, discord_id):
+    return {
+        "clan_members_by_guild": lambda: ClanMember.filter(
+            clan__guild__guild_id=guild_id
+        ).prefetch_related("member", "clan", "clan__guild"),
+        "clans_by_guild": lambda: Clan.filter(
+            guild__guild_id=guild_id
+        ).prefetch_related("guild"),
+        "guild_prefix": lambda: Guild.get_or_create(guild_id=guild_id),
+        "check_registered": lambda: Member.get_or_none(discord_id=discord_id),
+        "check_clan_member": lambda: ClanMember.get_or_none(
+            clan__guild__guild_id=guild_id, member__discord_id=discord_id
+        ),
+    }
+
+
+def fast_queries(database, guild_id, discord_id):
+    return {
+        "clan_members_by_guild": lambda: database.get_clan_members_by_guild_id(
+            guild_id
+        ),
+        "clans_by_guild": lambda: database.get_clans_by_guild(guild_id),
+        "guild_prefix": lambda: database.get_guild_prefix(guild_id),
+        "check_registered": lambda: database.member_is_registered(discord_id),
+        "check_clan_member": lambda: database.member_is_clan_member(
+            guild_id, discord_id
+        ),
+    }
+
+
+async def time_query(query, iterations):
+    # Warm up connections and prepared statements before measuring
+    await query()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await query()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    return statistics.mean(timings), statistics.median(timings), p95
+
+
+async def main(guild_id, discord_id, iterations):
+    config = Config()
+    database = Database(
+        config.database_url, config.database_conns, config.database_ingest_conns
+    )
+    await database.initialize()
+
+    orm = orm_queries(guild_id, discord_id)
+    fast = fast_queries(database, guild_id, discord_id)
+
+    print(
+        f"{'query':<24}{'orm mean':>10}{'fast mean':>11}{'orm p95':>10}{'fast p95':>10}"
+    )
+    try:
+        for name in orm.keys():
+            orm_mean, _, orm_p95 = summarize(await time_query(orm[name], iterations))
+            fast_mean, _, fast_p95 = summarize(await time_query(fast[name], iterations))
+            print(
+                f"{name:<24}{orm_mean:>9.2f}ms{fast_mean:>10.2f}ms"
+                f"{orm_p95:>9.2f}ms{fast_p95:>9.2f}ms"
+            )
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("guild_id", type=int)
+    parser.add_argument("discord_id", type=int)
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.guild_id, args.discord_id, args.iterations))
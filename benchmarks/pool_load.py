@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Load test the database pools with many concurrent jobs.
+
+Each simulated job mirrors an activity job: it gathers a batch of fast path and
+ORM reads on the read pool, then holds an ingest transaction for a short write.
+The pool is considered a bottleneck if waiting for a connection takes longer
+than using it.
+
+Usage: python -m benchmarks.pool_load <guild_id> [-j JOBS] [-q QUERIES]
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from prometheus_client import REGISTRY
+
+from seraphsix import constants
+from seraphsix.database import Database
+from seraphsix.models.database import Clan
+from seraphsix.pool import (
+    POOL_ACQUIRE_SECONDS,
+    POOL_HOLD_SECONDS,
+    QUERY_SECONDS,
+)
+from seraphsix.tasks.config import Config
+
+POOLS = [constants.DB_CONN_READ, constants.DB_CONN_INGEST]
+
+
+async def job(database, guild_id, queries, write_seconds):
+    reads = []
+    for i in range(queries):
+        if i % 2:
+            reads.append(database.guild_has_clans(guild_id))
+        else:
+            reads.append(Clan.filter(guild__guild_id=guild_id).count())
+    await asyncio.gather(*reads)
+
+    async with database.transaction() as conn:
+        await conn.execute_query("SELECT pg_sleep($1)", [write_seconds])
+
+
+def quantile(histogram, quantile, **labels):
+    """Estimate a quantile from the bucket counts, as the matching bucket's upper bound"""
+    buckets = [
+        (float(sample.labels["le"]), sample.value)
+        for sample in histogram.collect()[0].samples
+        if sample.name.endswith("_bucket")
+        and all(sample.labels.get(key) == value for key, value in labels.items())
+    ]
+    if not buckets or not buckets[-1][1]:
+        return 0.0
+    for bound, cumulative in buckets:
+        if cumulative >= quantile * buckets[-1][1]:
+            return bound
+    return float("inf")
+
+
+async def sample_waiters(peaks, interval=0.01):
+    while True:
+        for pool in POOLS:
+            waiters = REGISTRY.get_sample_value(
+                "seraphsix_db_pool_waiters", {"pool": pool}
+            )
+            peaks[pool] = max(peaks[pool], int(waiters or 0))
+        await asyncio.sleep(interval)
+
+
+async def main(guild_id, jobs, queries, write_seconds):
+    config = Config()
+    database = Database(
+        config.database_url, config.database_conns, config.database_ingest_conns
+    )
+    await database.initialize()
+
+    peaks = {pool: 0 for pool in POOLS}
+    sampler = asyncio.create_task(sample_waiters(peaks))
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[job(database, guild_id, queries, write_seconds) for _ in range(jobs)]
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        sampler.cancel()
+        await database.close()
+
+    print(f"{jobs} jobs x {queries} reads + 1 write in {elapsed:.2f}s")
+    print(
+        f"{'pool':<10}{'size':>6}{'peak wait':>11}"
+        f"{'acquire p95':>13}{'hold p95':>10}{'query p95':>11}"
+    )
+    bottleneck = False
+    for pool, size in zip(POOLS, [config.database_conns, config.database_ingest_conns]):
+        acquire_p95 = quantile(POOL_ACQUIRE_SECONDS, 0.95, pool=pool)
+        hold_p95 = quantile(POOL_HOLD_SECONDS, 0.95, pool=pool)
+        query_p95 = quantile(QUERY_SECONDS, 0.95, pool=pool, query="orm")
+        print(
+            f"{pool:<10}{size:>6}{peaks[pool]:>11}"
+            f"{acquire_p95 * 1000:>11.0f}ms{hold_p95 * 1000:>8.0f}ms"
+            f"{query_p95 * 1000:>9.0f}ms"
+        )
+        if acquire_p95 > hold_p95:
+            bottleneck = True
+            print(f"  {pool} pool is the bottleneck, consider raising its size")
+    return 1 if bottleneck else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("guild_id", type=int)
+    parser.add_argument("-j", "--jobs", type=int, default=constants.ARQ_MAX_JOBS)
+    parser.add_argument("-q", "--queries", type=int, default=10)
+    parser.add_argument("-w", "--write-seconds", type=float, default=0.01)
+    args = parser.parse_args()
+    sys.exit(
+        asyncio.run(main(args.guild_id, args.jobs, args.queries, args.write_seconds))
+    )
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Time Database queries against a seeded Postgres and check their query plans.
+
+Every statement a benchmark issues is captured from the query log and run
+through EXPLAIN with sequential scans disabled, so a sequential scan in the
+plan means no index can serve the query. Plans are snapshotted to
+benchmarks/plans and differences from the last snapshot are reported.
+
+Exits non-zero if a plan contains a sequential scan or a query's p95 latency
+is over its budget.
+
+Usage: python -m benchmarks.query_plans <database_url> [--seed] [-n ITERATIONS]
+
+--seed expects an empty scratch database. It creates the schema, applies the
+migrations and loads a synthetic dataset sized by --guilds, --clans,
+--members and --games.
+"""
+import argparse
+import asyncio
+import difflib
+import json
+import logging
+import random
+import sys
+import time
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from tortoise import Tortoise
+
+from seraphsix import constants
+from seraphsix.database import Database, add_months, month_start
+from seraphsix.models.database import ClanMember
+from seraphsix.tasks.activity import get_game_counts, get_sherpa_time_played
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = ROOT_DIR / "migrations"
+SNAPSHOT_DIR = Path(__file__).resolve().parent / "plans"
+
+# Tables small enough that a sequential scan is the right plan
+ALLOWED_SEQ_SCANS = {"gamepartition"}
+
+PLATFORMS = [
+    ("xbox", constants.PLATFORM_XBOX),
+    ("psn", constants.PLATFORM_PSN),
+    ("steam", constants.PLATFORM_STEAM),
+    ("stadia", constants.PLATFORM_STADIA),
+]
+GAME_MODES = sorted(set(sum(constants.SUPPORTED_GAME_MODES.values(), [])))
+HISTORY_MONTHS = 13
+
+
+class QueryCapture(logging.Handler):
+    """Collects (query, values) from Tortoise's and Database's debug query logs"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.queries = []
+
+    def emit(self, record):
+        if record.msg == "%s: %s" and len(record.args) == 2:
+            query, values = record.args
+            self.queries.append((query, values or []))
+
+
+async def create_schema(database):
+    await Tortoise.generate_schemas()
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        print(f"Applying {path.name}")
+        await database.ingest.execute_script(path.read_text())
+
+    start = add_months(month_start(datetime.now(timezone.utc)), -HISTORY_MONTHS)
+    await database.create_game_partitions(start, HISTORY_MONTHS + 1)
+
+
+def generate_data(rng, guilds, clans, members, games):
+    now = datetime.now(timezone.utc)
+    data = {
+        "guild": [],
+        "clan": [],
+        "member": [],
+        "clanmember": [],
+        "game": [],
+        "gamemember": [],
+        "clangame": [],
+    }
+
+    for guild_index in range(guilds):
+        guild_pk = guild_index + 1
+        data["guild"].append((guild_pk, 1000 + guild_pk, "?", False, True, False))
+
+        for _ in range(clans):
+            clan_pk = len(data["clan"]) + 1
+            data["clan"].append(
+                (
+                    clan_pk,
+                    5000 + clan_pk,
+                    f"Clan {clan_pk}",
+                    f"C{clan_pk}",
+                    True,
+                    guild_pk,
+                )
+            )
+
+            clan_member_pks = []
+            for _ in range(members):
+                member_pk = len(data["member"]) + 1
+                platform, platform_id = rng.choice(PLATFORMS)
+                membership_id = 4611686018400000000 + member_pk
+                data["member"].append(
+                    (
+                        member_pk,
+                        200000000000000000 + member_pk,
+                        platform,
+                        membership_id,
+                        f"{platform}user{member_pk}",
+                    )
+                )
+                data["clanmember"].append(
+                    (
+                        member_pk,
+                        platform_id,
+                        now - timedelta(days=rng.randint(30, 720)),
+                        True,
+                        now - timedelta(hours=rng.randint(0, 24 * 90)),
+                        rng.random() < 0.1,
+                        rng.choice([2, 2, 2, 3, 5]),
+                        clan_pk,
+                        member_pk,
+                    )
+                )
+                clan_member_pks.append(member_pk)
+
+            # Games are shared between clan members, so each one gets roughly
+            # `games` games with an average of three clan members in them
+            for _ in range(members * games // 3):
+                game_pk = len(data["game"]) + 1
+                game_date = now - timedelta(minutes=rng.randint(0, 60 * 24 * 395))
+                data["game"].append(
+                    (game_pk, rng.choice(GAME_MODES), 9000000000 + game_pk, game_date)
+                )
+                data["clangame"].append((clan_pk, game_pk))
+                for member_pk in rng.sample(clan_member_pks, rng.randint(1, 6)):
+                    data["gamemember"].append(
+                        (
+                            game_pk,
+                            game_date,
+                            member_pk,
+                            rng.uniform(60, 3600),
+                            rng.random() < 0.8,
+                        )
+                    )
+    return data
+
+
+async def seed(database, guilds, clans, members, games):
+    data = generate_data(random.Random(0), guilds, clans, members, games)
+    async with database.ingest.acquire_connection() as conn:
+        await conn.copy_records_to_table(
+            "guild",
+            records=data["guild"],
+            columns=[
+                "id",
+                "guild_id",
+                "prefix",
+                "clear_spam",
+                "aggregate_clans",
+                "track_sherpas",
+            ],
+        )
+        await conn.copy_records_to_table(
+            "clan",
+            records=data["clan"],
+            columns=[
+                "id",
+                "clan_id",
+                "name",
+                "callsign",
+                "activity_tracking",
+                "guild_id",
+            ],
+        )
+
+        # Members only have one platform each, so they're loaded per platform
+        for platform, _ in PLATFORMS:
+            records = []
+            for pk, discord_id, member_platform, membership_id, username in data[
+                "member"
+            ]:
+                if member_platform == platform:
+                    records.append(
+                        (pk, discord_id, membership_id, username, membership_id, False)
+                    )
+            await conn.copy_records_to_table(
+                "member",
+                records=records,
+                columns=[
+                    "id",
+                    "discord_id",
+                    f"{platform}_id",
+                    f"{platform}_username",
+                    "primary_membership_id",
+                    "is_cross_save",
+                ],
+            )
+
+        await conn.copy_records_to_table(
+            "clanmember",
+            records=data["clanmember"],
+            columns=[
+                "id",
+                "platform_id",
+                "join_date",
+                "is_active",
+                "last_active",
+                "is_sherpa",
+                "member_type",
+                "clan_id",
+                "member_id",
+            ],
+        )
+        await conn.copy_records_to_table(
+            "game",
+            records=data["game"],
+            columns=["id", "mode_id", "instance_id", "date"],
+        )
+        await conn.copy_records_to_table(
+            "gamemember",
+            records=data["gamemember"],
+            columns=["game_id", "date", "member_id", "time_played", "completed"],
+        )
+        await conn.copy_records_to_table(
+            "clangame", records=data["clangame"], columns=["clan_id", "game_id"]
+        )
+
+        for table in ["guild", "clan", "member", "clanmember", "game"]:
+            await conn.execute(
+                f"SELECT setval('{table}_id_seq', (SELECT max(id) FROM {table}))"
+            )
+        await conn.execute("ANALYZE")
+
+    print(
+        f"Seeded {len(data['guild'])} guilds, {len(data['clan'])} clans, "
+        f"{len(data['member'])} members, {len(data['game'])} games and "
+        f"{len(data['gamemember'])} game members"
+    )
+
+
+async def benchmarks(database):
+    """Return name -> (query factory, p95 budget in ms) for the busiest guild"""
+    clan_db = (await database.get_clans_by_guild(1001))[0]
+    member_db = (
+        await ClanMember.filter(clan_id=clan_db.id, is_sherpa=False)
+        .order_by("id")
+        .first()
+        .prefetch_related("member", "clan")
+    )
+    username = member_db.member.xbox_username or member_db.member.psn_username
+    username = username or member_db.member.steam_username
+    username = username or member_db.member.stadia_username
+
+    return {
+        "get_clan_members_active": (
+            lambda: database.get_clan_members_active(clan_db, days=7),
+            50,
+        ),
+        "get_clan_members_inactive": (
+            lambda: database.get_clan_members_inactive(clan_db),
+            50,
+        ),
+        "get_inactive_report": (lambda: database.get_inactive_report(clan_db.id), 25),
+        "get_clan_members_by_guild_id": (
+            lambda: database.get_clan_members_by_guild_id(1001),
+            50,
+        ),
+        "get_member_by_naive_username": (
+            lambda: database.get_member_by_naive_username(username.upper()),
+            25,
+        ),
+        "get_member_by_naive_username_no_clan": (
+            lambda: database.get_member_by_naive_username(
+                username.upper(), include_clan=False
+            ),
+            10,
+        ),
+        "get_member_by_discord_id": (
+            lambda: database.get_member_by_discord_id(member_db.member.discord_id),
+            25,
+        ),
+        "get_game_counts": (lambda: get_game_counts(database, "all"), 500),
+        "get_game_counts_member": (
+            lambda: get_game_counts(database, "all", member_db),
+            100,
+        ),
+        "get_sherpa_time_played": (
+            lambda: get_sherpa_time_played(database, member_db),
+            250,
+        ),
+    }
+
+
+def plan_nodes(node, depth=0):
+    yield depth, node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child, depth + 1)
+
+
+def render_plan(plan):
+    lines = []
+    for depth, node in plan_nodes(plan):
+        line = node["Node Type"]
+        if "Relation Name" in node:
+            line += f" on {node['Relation Name']}"
+        if "Index Name" in node:
+            line += f" using {node['Index Name']}"
+        lines.append(f"{'  ' * depth}{line}")
+    return lines
+
+
+async def explain(database, queries):
+    """EXPLAIN each captured query, returning rendered plans and any seq scans"""
+    rendered = []
+    seq_scans = set()
+    async with database.ingest.acquire_connection() as conn:
+        for query, values in queries:
+            async with conn.transaction():
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                result = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *values)
+            plan = json.loads(result)[0]["Plan"]
+            rendered.append(query)
+            rendered.extend(render_plan(plan))
+            rendered.append("")
+            for _, node in plan_nodes(plan):
+                relation = node.get("Relation Name")
+                if (
+                    node["Node Type"] == "Seq Scan"
+                    and relation not in ALLOWED_SEQ_SCANS
+                ):
+                    seq_scans.add(relation)
+    return rendered, seq_scans
+
+
+def compare_snapshot(name, rendered, update):
+    path = SNAPSHOT_DIR / f"{name}.txt"
+    if update or not path.exists():
+        SNAPSHOT_DIR.mkdir(exist_ok=True)
+        path.write_text("\n".join(rendered))
+        return
+    previous = path.read_text().splitlines()
+    if previous != rendered:
+        print(f"  plan changed since last snapshot of {name}:")
+        for line in difflib.unified_diff(previous, rendered, lineterm="", n=1):
+            print(f"    {line}")
+
+
+async def run(database, iterations, budget_scale, update):
+    capture = QueryCapture()
+    for logger_name in ["db_client", "seraphsix.database"]:
+        logger = logging.getLogger(logger_name)
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(capture)
+
+    failures = []
+    print(f"{'query':<40}{'mean':>9}{'p95':>9}{'budget':>9}  plan")
+    for name, (query, budget) in (await benchmarks(database)).items():
+        capture.queries = []
+        await query()
+        queries = capture.queries
+
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await query()
+            timings.append((time.perf_counter() - start) * 1000)
+        capture.queries = []
+
+        timings.sort()
+        mean = sum(timings) / len(timings)
+        p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+        budget = budget * budget_scale
+
+        rendered, seq_scans = await explain(database, queries)
+        status = "ok"
+        if seq_scans:
+            status = f"seq scan on {', '.join(sorted(seq_scans))}"
+            failures.append(f"{name}: {status}")
+        if p95 > budget:
+            failures.append(f"{name}: p95 {p95:.1f}ms over budget {budget:.0f}ms")
+        print(f"{name:<40}{mean:>7.1f}ms{p95:>7.1f}ms{budget:>7.0f}ms  {status}")
+        compare_snapshot(name, rendered, update)
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+async def main(args):
+    database = Database(args.database_url)
+    await database.initialize()
+    try:
+        if args.seed:
+            await create_schema(database)
+            await seed(database, args.guilds, args.clans, args.members, args.games)
+        return await run(database, args.iterations, args.budget_scale, args.update)
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database_url")
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--clans", type=int, default=2, help="clans per guild")
+    parser.add_argument("--members", type=int, default=100, help="members per clan")
+    parser.add_argument("--games", type=int, default=250, help="games per member")
+    parser.add_argument("-n", "--iterations", type=int, default=50)
+    parser.add_argument("--budget-scale", type=float, default=1.0)
+    parser.add_argument(
+        "--update", action="store_true", help="overwrite the plan snapshots"
+    )
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,110 @@
+-- Convert the game and gamemember tables to monthly range partitions on game.date
+-- and add the rollup tables used once old partitions pass the retention horizon.
+--
+-- Partitioned tables cannot be the target of a single column foreign key, so the
+-- foreign keys pointing at game are dropped. Ingestion is the only writer for
+-- these tables and always creates the game row first.
+--
+-- Usage: psql "$DATABASE_URL" -f migrations/0001_partition_game_tables.sql
+
+BEGIN;
+
+ALTER TABLE clangame DROP CONSTRAINT IF EXISTS clangame_game_id_fkey;
+ALTER TABLE gamemember DROP CONSTRAINT IF EXISTS gamemember_game_id_fkey;
+
+ALTER TABLE game RENAME TO game_unpartitioned;
+ALTER TABLE gamemember RENAME TO gamemember_unpartitioned;
+ALTER SEQUENCE game_id_seq OWNED BY NONE;
+ALTER SEQUENCE gamemember_id_seq OWNED BY NONE;
+
+CREATE TABLE game (
+    id INT NOT NULL DEFAULT nextval('game_id_seq'),
+    mode_id INT NOT NULL,
+    instance_id BIGINT NOT NULL,
+    date TIMESTAMPTZ NOT NULL,
+    reference_id BIGINT,
+    PRIMARY KEY (id, date),
+    CONSTRAINT game_instance_id_date_key UNIQUE (instance_id, date)
+) PARTITION BY RANGE (date);
+CREATE INDEX game_mode_id_idx ON game (mode_id);
+CREATE INDEX game_reference_id_idx ON game (reference_id);
+CREATE INDEX game_instance_id_idx ON game (instance_id);
+
+CREATE TABLE gamemember (
+    id INT NOT NULL DEFAULT nextval('gamemember_id_seq'),
+    time_played DOUBLE PRECISION,
+    completed BOOL,
+    member_id INT NOT NULL REFERENCES member (id) ON DELETE CASCADE,
+    game_id INT NOT NULL,
+    date TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+CREATE INDEX gamemember_member_id_idx ON gamemember (member_id);
+CREATE INDEX gamemember_game_id_idx ON gamemember (game_id);
+
+ALTER SEQUENCE game_id_seq OWNED BY game.id;
+ALTER SEQUENCE gamemember_id_seq OWNED BY gamemember.id;
+
+-- Anything outside of a monthly partition lands here, see Database.create_game_partitions
+CREATE TABLE game_default PARTITION OF game DEFAULT;
+CREATE TABLE gamemember_default PARTITION OF gamemember DEFAULT;
+
+DO $$
+DECLARE
+    month DATE;
+    last_month DATE;
+BEGIN
+    SELECT date_trunc('month', coalesce(min(date), now()))::date INTO month FROM game_unpartitioned;
+    last_month := (date_trunc('month', now()) + interval '3 months')::date;
+    WHILE month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF game FOR VALUES FROM (%L) TO (%L)',
+            'game_' || to_char(month, '"y"YYYY"m"MM'), month, month + interval '1 month'
+        );
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF gamemember FOR VALUES FROM (%L) TO (%L)',
+            'gamemember_' || to_char(month, '"y"YYYY"m"MM'), month, month + interval '1 month'
+        );
+        month := (month + interval '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO game (id, mode_id, instance_id, date, reference_id)
+SELECT id, mode_id, instance_id, date, reference_id FROM game_unpartitioned;
+
+INSERT INTO gamemember (id, time_played, completed, member_id, game_id, date)
+SELECT gm.id, gm.time_played, gm.completed, gm.member_id, gm.game_id, g.date
+FROM gamemember_unpartitioned gm
+JOIN game_unpartitioned g ON g.id = gm.game_id;
+
+DROP TABLE gamemember_unpartitioned;
+DROP TABLE game_unpartitioned;
+
+CREATE TABLE IF NOT EXISTS gamepartition (
+    id SERIAL PRIMARY KEY,
+    month DATE NOT NULL UNIQUE,
+    rolled_up TIMESTAMPTZ,
+    detached TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS gamerollup (
+    id SERIAL PRIMARY KEY,
+    month DATE NOT NULL,
+    mode_id INT NOT NULL,
+    count INT NOT NULL,
+    member_id INT REFERENCES member (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS gamerollup_month_idx ON gamerollup (month);
+CREATE INDEX IF NOT EXISTS gamerollup_member_id_idx ON gamerollup (member_id);
+
+CREATE TABLE IF NOT EXISTS sherpatimerollup (
+    id SERIAL PRIMARY KEY,
+    month DATE NOT NULL,
+    sherpa_time DOUBLE PRECISION NOT NULL,
+    member_id INT NOT NULL REFERENCES member (id) ON DELETE CASCADE,
+    sherpa_id INT NOT NULL REFERENCES member (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS sherpatimerollup_month_idx ON sherpatimerollup (month);
+CREATE INDEX IF NOT EXISTS sherpatimerollup_member_id_idx ON sherpatimerollup (member_id);
+
+COMMIT;
@@ -0,0 +1,48 @@
+-- Collapse duplicate clangame and gamemember rows left behind by racing
+-- process_activity jobs, then add the unique constraints that ingestion
+-- upserts rely on (ON CONFLICT needs a matching unique index).
+--
+-- Duplicate game members are merged into the lowest id: time played is summed
+-- and the game counts as completed if any of the rows was.
+--
+-- Usage: psql "$DATABASE_URL" -f migrations/0002_unique_game_members.sql
+
+BEGIN;
+
+LOCK TABLE clangame, gamemember IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM clangame a
+USING clangame b
+WHERE a.clan_id = b.clan_id AND a.game_id = b.game_id AND a.id > b.id;
+
+ALTER TABLE clangame
+    ADD CONSTRAINT clangame_clan_id_game_id_key UNIQUE (clan_id, game_id);
+
+CREATE TEMPORARY TABLE gamemember_merged ON COMMIT DROP AS
+SELECT
+    min(id) AS id,
+    date,
+    sum(coalesce(time_played, 0)) AS time_played,
+    bool_or(coalesce(completed, false)) AS completed
+FROM gamemember
+GROUP BY game_id, member_id, date
+HAVING count(*) > 1;
+
+UPDATE gamemember gm
+SET time_played = m.time_played, completed = m.completed
+FROM gamemember_merged m
+WHERE gm.id = m.id AND gm.date = m.date;
+
+DELETE FROM gamemember a
+USING gamemember b
+WHERE a.game_id = b.game_id
+    AND a.member_id = b.member_id
+    AND a.date = b.date
+    AND a.id > b.id;
+
+ALTER TABLE gamemember
+    ADD CONSTRAINT gamemember_game_id_member_id_date_key UNIQUE (game_id, member_id, date);
+-- The unique index leads with game_id, so the old single column index is redundant
+DROP INDEX IF EXISTS gamemember_game_id_idx;
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Indexes backing the lookups checked by benchmarks/query_plans.py.
+--
+-- get_member_by_naive_username and get_member_by_platform_username compare
+-- lower(username), which can't use the plain unique indexes on the columns.
+-- Active/inactive member lookups and the inactive report filter clan members
+-- by clan and last active date, and most member queries join on member_id.
+--
+-- Usage: psql "$DATABASE_URL" -f migrations/0003_query_plan_indexes.sql
+
+CREATE INDEX IF NOT EXISTS member_bungie_username_lower_idx ON member (lower(bungie_username));
+CREATE INDEX IF NOT EXISTS member_xbox_username_lower_idx ON member (lower(xbox_username));
+CREATE INDEX IF NOT EXISTS member_psn_username_lower_idx ON member (lower(psn_username));
+CREATE INDEX IF NOT EXISTS member_blizzard_username_lower_idx ON member (lower(blizzard_username));
+CREATE INDEX IF NOT EXISTS member_steam_username_lower_idx ON member (lower(steam_username));
+CREATE INDEX IF NOT EXISTS member_stadia_username_lower_idx ON member (lower(stadia_username));
+
+CREATE INDEX IF NOT EXISTS clanmember_clan_id_last_active_idx ON clanmember (clan_id, last_active);
+CREATE INDEX IF NOT EXISTS clanmember_member_id_idx ON clanmember (member_id);
+CREATE INDEX IF NOT EXISTS clanmember_is_sherpa_idx ON clanmember (member_id) WHERE is_sherpa;
+
+CREATE INDEX IF NOT EXISTS gamemember_member_id_date_idx ON gamemember (member_id, date);
+DROP INDEX IF EXISTS gamemember_member_id_idx;
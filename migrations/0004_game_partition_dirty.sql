@@ -0,0 +1,14 @@
+-- Track months that received games after being rolled up, so
+-- maintain_game_partitions rolls them up again. Games for a detached month land
+-- in the default partitions and are folded into that month's rollups.
+--
+-- Usage: psql "$DATABASE_URL" -f migrations/0004_game_partition_dirty.sql
+
+ALTER TABLE gamepartition ADD COLUMN IF NOT EXISTS dirty BOOL NOT NULL DEFAULT false;
+
+-- Rows already sitting in the default partitions for rolled up months
+UPDATE gamepartition p SET dirty = true
+WHERE p.rolled_up IS NOT NULL AND EXISTS (
+    SELECT 1 FROM game_default g
+    WHERE g.date >= p.month AND g.date < p.month + interval '1 month'
+);
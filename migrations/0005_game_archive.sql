@@ -0,0 +1,35 @@
+-- Remember the games of detached months. Their partitions no longer back the
+-- unique constraint on game, so without this a game synced again (e.g. by a new
+-- member's full history) would be ingested into the default partition and
+-- counted in the month's rollups twice. Detached partitions can be dropped once
+-- this has run.
+--
+-- Usage: psql "$DATABASE_URL" -f migrations/0005_game_archive.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS gamearchive (
+    instance_id BIGINT NOT NULL,
+    date TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (instance_id, date)
+);
+
+DO $$
+DECLARE
+    partition TEXT;
+BEGIN
+    FOR partition IN
+        SELECT 'game_' || to_char(month, '"y"YYYY"m"MM') FROM gamepartition
+        WHERE detached IS NOT NULL
+    LOOP
+        IF to_regclass(quote_ident(partition)) IS NOT NULL THEN
+            EXECUTE format(
+                'INSERT INTO gamearchive (instance_id, date) '
+                'SELECT instance_id, date FROM %I ON CONFLICT DO NOTHING',
+                partition
+            );
+        END IF;
+    END LOOP;
+END $$;
+
+COMMIT;
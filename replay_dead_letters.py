@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""List, replay or purge jobs in the dead letter store.
+
+Usage: python replay_dead_letters.py [--function NAME] [--error NAME] [--replay | --purge]
+"""
+import argparse
+import asyncio
+
+from arq.constants import result_key_prefix
+
+from seraphsix.constants import DEAD_LETTER_KEY
+from seraphsix.models import deserializer, serializer
+from seraphsix.models.records import DeadLetterRecord
+from seraphsix.sharding import shard_queue
+from seraphsix.tasks.core import create_redis_jobs_pool, enqueue_jobs
+
+
+async def get_dead_letters(redis_jobs, function=None, error=None):
+    entries = await redis_jobs.hgetall(DEAD_LETTER_KEY)
+    dead_letters = {}
+    for job_id, entry in entries.items():
+        record = DeadLetterRecord(*deserializer(entry))
+        if function and record.function != function:
+            continue
+        if error and record.error != error:
+            continue
+        dead_letters[job_id.decode("utf-8")] = record
+    return dead_letters
+
+
+async def replay(redis_jobs, dead_letters):
+    # Failed jobs keep their result around, which would stop the same job id
+    # from being queued again
+    tr = redis_jobs.multi_exec()
+    for job_id in dead_letters.keys():
+        tr.delete(result_key_prefix + job_id)
+    await tr.execute()
+
+    # Guild jobs go back to their guild's shard queue
+    groups = {}
+    for job_id, record in dead_letters.items():
+        key = (record.function, serializer(record.kwargs), shard_queue(record.guild_id))
+        groups.setdefault(key, []).append((job_id, record.args))
+
+    replayed = []
+    ctx = {"redis_jobs": redis_jobs}
+    for (function, kwargs, queue_name), jobs in groups.items():
+        enqueued = await enqueue_jobs(
+            ctx, function, jobs, _queue_name=queue_name, **deserializer(kwargs)
+        )
+        replayed.extend([job_id for (job_id, _), job in zip(jobs, enqueued) if job])
+
+    if replayed:
+        await redis_jobs.hdel(DEAD_LETTER_KEY, *replayed)
+    return replayed
+
+
+async def main(function, error, replay_jobs, purge):
+    redis_jobs = await create_redis_jobs_pool()
+    try:
+        dead_letters = await get_dead_letters(redis_jobs, function, error)
+        for job_id, record in sorted(
+            dead_letters.items(), key=lambda item: item[1].failed_at
+        ):
+            print(
+                f"{record.failed_at} {job_id} {record.function} {record.error} "
+                f"x{record.attempts}: {record.reason}"
+            )
+
+        if not dead_letters:
+            print("No dead lettered jobs found")
+        elif replay_jobs:
+            replayed = await replay(redis_jobs, dead_letters)
+            print(f"Replayed {len(replayed)} of {len(dead_letters)} jobs")
+        elif purge:
+            await redis_jobs.hdel(DEAD_LETTER_KEY, *dead_letters.keys())
+            print(f"Purged {len(dead_letters)} jobs")
+    finally:
+        redis_jobs.close()
+        await redis_jobs.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--function", help="only jobs for this worker function")
+    parser.add_argument("--error", help="only jobs that failed with this error")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--replay", action="store_true", help="queue the jobs again")
+    action.add_argument("--purge", action="store_true", help="drop the jobs")
+    args = parser.parse_args()
+    asyncio.run(main(args.function, args.error, args.replay, args.purge))
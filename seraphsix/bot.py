@@ -7,12 +7,13 @@ import logging
 import peony
 import traceback
 
-from discord.ext import commands, tasks
+from discord.ext import commands
 from peony import PeonyClient
 from pydest.pydest import Pydest
 from the100 import The100
 
 from seraphsix import constants, Database
+from seraphsix.cache import GuildConfigCache, SherpaIndex, UserCache, set_guild_names
 from seraphsix.cogs.utils.message_manager import MessageManager
 from seraphsix.errors import (
     InvalidCommandError,
@@ -24,7 +25,8 @@ from seraphsix.errors import (
     MissingTimezoneError,
     MaintenanceError,
 )
-from seraphsix.models.database import Guild, TwitterChannel
+from seraphsix.models.database import ClanMemberApplication, Guild, TwitterChannel
+from seraphsix.reactions import CLAN_APPLICATION, ReactionDispatcher
 from seraphsix.tasks.clan import ack_clan_application
 from seraphsix.tasks.core import create_redis_jobs_pool
 from seraphsix.tasks.discord import store_sherpas, update_sherpa
@@ -47,10 +49,9 @@ async def _prefix_callable(bot, message):
     """Get current command prefix"""
     base = [f"<@{bot.user.id}> "]
     if isinstance(message.channel, discord.abc.PrivateChannel):
-        base.append("?")
+        base.append(constants.DEFAULT_PREFIX)
     else:
-        guild_db, _ = await Guild.get_or_create(guild_id=message.guild.id)
-        base.append(guild_db.prefix)
+        base.append(await bot.guild_cache.get_prefix(message.guild.id))
     return base
 
 
@@ -66,7 +67,19 @@ class SeraphSix(commands.Bot):
         )
 
         self.config = config
-        self.database = Database(config.database_url, config.database_conns)
+        self.database = Database(
+            config.database_url, config.database_conns, config.database_ingest_conns
+        )
+        self.guild_cache = GuildConfigCache(self.database)
+        self.guild_map = self.guild_cache.guilds
+        self.user_cache = UserCache(self)
+        self.sherpa_index = SherpaIndex()
+        self.reactions = ReactionDispatcher()
+        self.reactions.register(
+            CLAN_APPLICATION,
+            ack_clan_application,
+            emojis=[constants.EMOJI_CHECKMARK, constants.EMOJI_CROSSMARK],
+        )
 
         self.destiny = Pydest(
             api_key=config.destiny.api_key,
@@ -101,45 +114,6 @@ class SeraphSix(commands.Bot):
                 exc = traceback.format_exception(type(e), e, e.__traceback__)
                 log.error(f"Failed to load extension {extension}: {exc}")
 
-        if config.enable_activity_tracking:
-            self.update_members.start()
-
-        self.cache_clan_members.start()
-
-    @tasks.loop(minutes=5.0)
-    async def update_members(self):
-        guilds = await Guild.all()
-        if not guilds:
-            return
-        for guild in guilds:
-            guild_id = guild.guild_id
-            discord_guild = await self.fetch_guild(guild_id)
-            guild_name = str(discord_guild)
-
-            log.info(
-                f"Queueing task to find last active date for all members of {guild_name} ({guild_id})"
-            )
-            await self.ext_conns["redis_jobs"].enqueue_job(
-                "store_last_active",
-                guild_id,
-                guild_name,
-                _job_id=f"store_last_active-{guild_id}",
-            )
-
-            log.info(
-                f"Queueing task to find recent games for all members {guild_name} ({guild_id})"
-            )
-            await self.ext_conns["redis_jobs"].enqueue_job(
-                "store_all_games",
-                guild_id,
-                guild_name,
-                _job_id=f"store_all_games-{guild_id}",
-            )
-
-    @update_members.before_loop
-    async def before_update_members(self):
-        await self.wait_until_ready()
-
     async def update_sherpa_roles(self):
         guilds = await Guild.all()
         if not guilds:
@@ -181,29 +155,8 @@ class SeraphSix(commands.Bot):
         self.redis = await aioredis.create_redis_pool(self.config.redis_url)
         self.ext_conns["redis_cache"] = self.redis
         self.ext_conns["redis_jobs"] = await create_redis_jobs_pool()
-
-    @tasks.loop(hours=1.0)
-    async def cache_clan_members(self):
-        guilds = await Guild.all()
-        if not guilds:
-            return
-        for guild in guilds:
-            guild_id = guild.guild_id
-            discord_guild = await self.fetch_guild(guild.guild_id)
-            guild_name = str(discord_guild)
-            log.info(
-                f"Queueing task to update cached members of {guild_name} ({guild_id})"
-            )
-            await self.ext_conns["redis_jobs"].enqueue_job(
-                "set_cached_members",
-                guild_id,
-                guild_name,
-                _job_id=f"set_cached_members-{guild_id}",
-            )
-
-    @cache_clan_members.before_loop
-    async def before_cache_clan_members(self):
-        await self.wait_until_ready()
+        await self.guild_cache.start(self.redis)
+        await self.sherpa_index.start(self.redis)
 
     async def on_connect(self):
         await self.database.initialize()
@@ -213,9 +166,13 @@ class SeraphSix(commands.Bot):
         guilds = await Guild.all()
         if not guilds:
             return
-        self.guild_map = {}
-        for guild in guilds:
-            self.guild_map[guild.guild_id] = guild
+        self.guild_cache.warm(guilds)
+
+        message_ids = await ClanMemberApplication.filter(approved=False).values_list(
+            "message_id", flat=True
+        )
+        self.reactions.warm(message_ids, CLAN_APPLICATION)
+        await set_guild_names(self.redis, self.guilds)
 
         self.log_channel = self.get_channel(self.config.log_channel)
         self.reg_channel = self.get_channel(self.config.reg_channel)
@@ -238,17 +195,16 @@ class SeraphSix(commands.Bot):
             await update_sherpa(self, before, after)
 
     async def on_raw_reaction_add(self, payload):
-        if payload.channel_id == self.guild_map[
-            payload.guild_id
-        ].admin_channel and payload.emoji.name in [
-            constants.EMOJI_CHECKMARK,
-            constants.EMOJI_CROSSMARK,
-        ]:
-            await ack_clan_application(self, payload)
+        await self.reactions.dispatch(self, payload)
 
     async def on_guild_join(self, guild):
+        await set_guild_names(self.redis, [guild])
         await self.log_channel.send(f"Seraph Six joined {guild.name} (id:{guild.id})!")
 
+    async def on_guild_update(self, before, after):
+        if before.name != after.name:
+            await set_guild_names(self.redis, [after])
+
     async def on_guild_remove(self, guild):
         await self.log_channel.send(f"Seraph Six left {guild.name} (id:{guild.id})...")
 
@@ -339,6 +295,8 @@ class SeraphSix(commands.Bot):
         self.ext_conns["redis_jobs"].close()
         await self.ext_conns["redis_jobs"].wait_closed()
 
+        await self.guild_cache.stop()
+        await self.sherpa_index.stop()
         self.ext_conns["redis_cache"].close()
         await self.ext_conns["redis_cache"].wait_closed()
 
@@ -0,0 +1,275 @@
+import asyncio
+import discord
+import logging
+import time
+import uuid
+
+from tortoise.expressions import Subquery
+
+from seraphsix import constants
+from seraphsix.models import deserializer, serializer
+from seraphsix.models.database import ClanMember, Guild, Role
+from seraphsix.models.records import PermissionRecord
+
+log = logging.getLogger(__name__)
+
+
+class GuildConfigCache(object):
+    """In-memory guild settings, kept in sync across bot processes over redis pub/sub.
+
+    Every guild setting change has to go through `save` so the other processes
+    hear about it and reload that guild from the database.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.redis = None
+        self.guilds = {}
+        self.instance_id = uuid.uuid4().hex
+        self.listener = None
+
+    def warm(self, guild_dbs):
+        for guild_db in guild_dbs:
+            self.guilds[guild_db.guild_id] = guild_db
+        log.info(f"Cached config for {len(self.guilds)} guilds")
+
+    async def load(self, guild_id):
+        guild_db = await Guild.get_or_none(guild_id=guild_id)
+        if not guild_db:
+            await self.database.create_guild(guild_id)
+            guild_db = await Guild.get(guild_id=guild_id)
+        self.guilds[guild_id] = guild_db
+        return guild_db
+
+    async def get(self, guild_id):
+        try:
+            return self.guilds[guild_id]
+        except KeyError:
+            return await self.load(guild_id)
+
+    async def get_prefix(self, guild_id):
+        guild_db = await self.get(guild_id)
+        return guild_db.prefix or constants.DEFAULT_PREFIX
+
+    async def save(self, guild_db):
+        await guild_db.save()
+        self.guilds[guild_db.guild_id] = guild_db
+        if self.redis:
+            await self.redis.publish(
+                constants.GUILD_CONFIG_CHANNEL,
+                f"{self.instance_id}:{guild_db.guild_id}",
+            )
+
+    async def start(self, redis):
+        self.redis = redis
+        if not self.listener:
+            (channel,) = await redis.subscribe(constants.GUILD_CONFIG_CHANNEL)
+            self.listener = asyncio.create_task(self.listen(channel))
+
+    async def listen(self, channel):
+        while await channel.wait_message():
+            instance_id, guild_id = (await channel.get(encoding="utf-8")).split(":")
+            if instance_id == self.instance_id:
+                continue
+            log.debug(f"Reloading config for guild {guild_id}")
+            try:
+                await self.load(int(guild_id))
+            except Exception:
+                # Drop the stale entry so the next lookup goes to the database
+                self.guilds.pop(int(guild_id), None)
+                log.exception(f"Failed to reload config for guild {guild_id}")
+
+    async def stop(self):
+        if self.listener:
+            self.listener.cancel()
+            self.listener = None
+        if self.redis and not self.redis.closed:
+            await self.redis.unsubscribe(constants.GUILD_CONFIG_CHANNEL)
+
+
+class UserCache(object):
+    """Discord users by id, served from the gateway cache where possible.
+
+    Anything the gateway doesn't know about is fetched over REST with bounded
+    concurrency and kept for a while, including users that no longer exist.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.users = {}
+        self.semaphore = asyncio.Semaphore(constants.DISCORD_FETCH_CONCURRENCY)
+
+    async def fetch(self, user_id):
+        async with self.semaphore:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                user = None
+        self.users[user_id] = (user, time.monotonic() + constants.USER_CACHE_SECONDS)
+        return user
+
+    def prune(self):
+        now = time.monotonic()
+        for user_id, (_, expires) in list(self.users.items()):
+            if expires < now:
+                del self.users[user_id]
+
+    async def resolve(self, user_ids):
+        """Users keyed by id, None for ids Discord doesn't know"""
+        self.prune()
+        users = {}
+        misses = []
+        for user_id in set(user_ids):
+            user = self.bot.get_user(user_id)
+            if user:
+                users[user_id] = user
+            elif user_id in self.users:
+                users[user_id] = self.users[user_id][0]
+            else:
+                misses.append(user_id)
+
+        if misses:
+            fetched = await asyncio.gather(*[self.fetch(user_id) for user_id in misses])
+            users.update(zip(misses, fetched))
+        return users
+
+    async def get(self, user_id):
+        return (await self.resolve([user_id]))[user_id]
+
+
+class SherpaIndex(object):
+    """Sherpa role ids and clan member discord ids per guild.
+
+    Lets role change events be checked without touching the database, the
+    resulting sherpa flag changes are written out in batches. Guilds are
+    reloaded lazily after being invalidated, which other processes can trigger
+    by publishing the guild id on the sherpa index channel.
+    """
+
+    def __init__(self):
+        self.guilds = {}
+        self.pending = {}
+        self.flusher = None
+        self.redis = None
+        self.listener = None
+
+    async def load(self, guild_id):
+        role_ids = await Role.filter(
+            guild__guild_id=guild_id, is_sherpa=True
+        ).values_list("role_id", flat=True)
+        discord_ids = await ClanMember.filter(
+            clan__guild__guild_id=guild_id, member__discord_id__not_isnull=True
+        ).values_list("member__discord_id", flat=True)
+        self.guilds[guild_id] = (set(role_ids), set(discord_ids))
+        return self.guilds[guild_id]
+
+    async def get(self, guild_id):
+        try:
+            return self.guilds[guild_id]
+        except KeyError:
+            return await self.load(guild_id)
+
+    def invalidate(self, guild_id):
+        self.guilds.pop(guild_id, None)
+
+    def queue(self, guild_id, discord_id, is_sherpa):
+        self.pending.setdefault(guild_id, {})[discord_id] = is_sherpa
+        if not self.flusher:
+            self.flusher = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(constants.SHERPA_FLUSH_SECONDS)
+        self.flusher = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for guild_id, members in pending.items():
+            for is_sherpa in (True, False):
+                discord_ids = [
+                    discord_id
+                    for discord_id, value in members.items()
+                    if value == is_sherpa
+                ]
+                if not discord_ids:
+                    continue
+                members_db = ClanMember.filter(
+                    clan__guild__guild_id=guild_id,
+                    member__discord_id__in=discord_ids,
+                    is_sherpa=not is_sherpa,
+                ).values("id")
+                await ClanMember.filter(id__in=Subquery(members_db)).update(
+                    is_sherpa=is_sherpa
+                )
+            log.debug(f"Flushed {len(members)} sherpa changes for guild {guild_id}")
+
+    async def start(self, redis):
+        self.redis = redis
+        if not self.listener:
+            (channel,) = await redis.subscribe(constants.SHERPA_INDEX_CHANNEL)
+            self.listener = asyncio.create_task(self.listen(channel))
+
+    async def listen(self, channel):
+        while await channel.wait_message():
+            guild_id = await channel.get(encoding="utf-8")
+            self.invalidate(int(guild_id))
+
+    async def stop(self):
+        if self.flusher:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+        if self.listener:
+            self.listener.cancel()
+            self.listener = None
+        if self.redis and not self.redis.closed:
+            await self.redis.unsubscribe(constants.SHERPA_INDEX_CHANNEL)
+
+
+def permissions_key(guild_id):
+    return f"{guild_id}-permissions"
+
+
+async def get_member_permissions(conns, guild_id, discord_id):
+    """Registration, clan link and clan rank state for a user, cached briefly in redis"""
+    redis = conns["redis_cache"]
+    key = permissions_key(guild_id)
+
+    cached = await redis.hget(key, discord_id)
+    if cached:
+        *permissions, cached_at = deserializer(cached)
+        if time.time() - cached_at < constants.PERMISSIONS_CACHE_SECONDS:
+            return PermissionRecord(*permissions)
+
+    permissions = await conns["database"].get_member_permissions(guild_id, discord_id)
+    # The hash expiry is pushed back on every write, so entries carry their own
+    # timestamp to keep individual users from going stale
+    tr = redis.multi_exec()
+    tr.hset(key, discord_id, serializer([*permissions, time.time()]))
+    tr.expire(key, constants.PERMISSIONS_CACHE_SECONDS)
+    await tr.execute()
+    return permissions
+
+
+async def clear_member_permissions(conns, guild_ids, discord_id=None):
+    """Drop cached permissions for one user, or everyone if no user is given"""
+    tr = conns["redis_cache"].multi_exec()
+    for guild_id in guild_ids:
+        if discord_id:
+            tr.hdel(permissions_key(guild_id), discord_id)
+        else:
+            tr.delete(permissions_key(guild_id))
+    await tr.execute()
+
+
+async def set_guild_names(redis, guilds):
+    """Publish discord guild names so workers can log them without REST calls"""
+    if guilds:
+        await redis.hmset_dict(
+            constants.GUILD_NAMES_KEY, {guild.id: str(guild) for guild in guilds}
+        )
+
+
+async def get_guild_names(redis):
+    names = await redis.hgetall(constants.GUILD_NAMES_KEY, encoding="utf-8")
+    return {int(guild_id): name for guild_id, name in names.items()}
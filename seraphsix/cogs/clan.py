@@ -3,6 +3,7 @@ import discord
 import logging
 import pydest
 import pytz
+import time
 
 from datetime import datetime
 from discord.ext import commands
@@ -10,6 +11,7 @@ from discord.ext.commands.errors import BadArgument
 from tortoise.query_utils import Q
 
 from seraphsix import constants
+from seraphsix.cache import clear_member_permissions
 from seraphsix.cogs.utils.checks import (
     is_clan_admin,
     is_valid_game_mode,
@@ -18,25 +20,37 @@ from seraphsix.cogs.utils.checks import (
 )
 from seraphsix.cogs.utils.helpers import date_as_string, get_requestor
 from seraphsix.cogs.utils.message_manager import MessageManager
-from seraphsix.cogs.utils.paginator import FieldPages, EmbedPages
+from seraphsix.cogs.utils.paginator import EmbedPages, LazyFieldPages
 from seraphsix.errors import InvalidAdminError, InvalidCommandError
 from seraphsix.models import deserializer, serializer
-from seraphsix.models.database import Clan, Guild, ClanMemberApplication, Role
+from seraphsix.models.database import (
+    Clan,
+    ClanMember,
+    ClanMemberApplication,
+    Guild,
+    Role,
+)
 from seraphsix.models.destiny import (
     DestinyMembershipResponse,
     DestinyMemberGroupResponse,
-    DestinyGroupResponse,
     DestinyGroupPendingMembersResponse,
     DestinySearchPlayerResponse,
 )
+from seraphsix.reactions import CLAN_APPLICATION
 from seraphsix.tasks.activity import get_game_counts, get_last_active
 from seraphsix.tasks.core import (
     execute_pydest,
     get_primary_membership,
     execute_pydest_auth,
-    get_memberships,
+    enqueue_guild_jobs,
+    get_cached_roster,
+    get_cached_roster_range,
+    get_inactive_report,
+    set_cached_members,
+    set_cached_roster,
+    set_inactive_report,
 )
-from seraphsix.tasks.clan import info_sync, member_sync
+from seraphsix.tasks.clan import get_clan_info, info_sync, member_sync, set_clan_info
 
 log = logging.getLogger(__name__)
 
@@ -205,11 +219,11 @@ class ClanCog(commands.Cog, name="Clan"):
         bungie_url = f"https://www.bungie.net/en/Profile/{platform_id}/{membership_id}"
         bungie_link = f"[{membership_name}]({bungie_url})"
 
+        discord_username = None
         if requestor_db.discord_id:
-            member_discord = await commands.MemberConverter().convert(
-                ctx, str(requestor_db.discord_id)
-            )
-            discord_username = str(member_discord)
+            member_discord = await self.bot.user_cache.get(requestor_db.discord_id)
+            if member_discord:
+                discord_username = str(member_discord)
 
         embed.add_field(name="Last Active Date", value=date_as_string(last_active))
         embed.add_field(name="Bungie Username", value=bungie_link)
@@ -227,32 +241,32 @@ class ClanCog(commands.Cog, name="Clan"):
         )
         return embed
 
-    async def get_inactive_members(self, ctx, clan_db):
-        inactive_members_filtered = []
-
+    async def get_inactive_members(self, ctx, clan_db, fresh=False):
         query = Role.filter(guild__guild_id=ctx.guild.id, is_protected_clanmember=True)
-        protected_roles = [role.role_id for role in await query]
-
-        inactive_members = await self.bot.database.get_clan_members_inactive(clan_db)
-        if len(inactive_members) > 0:
-            for clanmember in inactive_members:
-                time_delta = (
-                    datetime.now(pytz.utc) - clanmember.last_active
-                ).total_seconds()
-                platform_id, membership_id, username = get_primary_membership(
-                    clanmember.member
-                )
-                member_discord = ctx.guild.get_member(clanmember.member.discord_id)
-                if member_discord:
-                    member_roles = [role.id for role in member_discord.roles]
-                    if any(role in protected_roles for role in member_roles):
-                        continue
-                inactive_members_filtered.append(
-                    (time_delta, platform_id, membership_id, username)
-                )
+        protected_roles = set([role.role_id for role in await query])
 
-        inactive_members_filtered.sort(reverse=True)
-        return inactive_members_filtered
+        # The cached report can be a day old, anything acting on it must be fresh
+        if fresh:
+            get_report = set_inactive_report
+        else:
+            get_report = get_inactive_report
+
+        inactive_members = []
+        report = await get_report(self.bot.ext_conns, ctx.guild.id, clan_db.id)
+        for record in report:
+            member_discord = ctx.guild.get_member(record.discord_id)
+            if member_discord and any(
+                role.id in protected_roles for role in member_discord.roles
+            ):
+                continue
+            inactive_members.append(record)
+        return inactive_members
+
+    def inactive_time(self, record):
+        time_delta = (datetime.now(pytz.utc) - record.last_active).total_seconds()
+        months, remainder = divmod(time_delta, 2628000)
+        days, _ = divmod(remainder, 86400)
+        return int(months), int(days)
 
     @commands.group(invoke_without_command=True)
     async def clan(self, ctx):
@@ -349,7 +363,6 @@ class ClanCog(commands.Cog, name="Clan"):
     @commands.guild_only()
     async def info(self, ctx, *args):
         """Show information for all connected clans"""
-        redis_cache = self.bot.ext_conns["redis_cache"]
         manager = MessageManager(ctx)
 
         clan_dbs = await self.bot.database.get_clans_by_guild(ctx.guild.id)
@@ -359,61 +372,20 @@ class ClanCog(commands.Cog, name="Clan"):
                 "No connected clans found", mention=False
             )
 
-        embeds = []
-        clan_redis_key = f"{ctx.guild.id}-clan-info"
-        clan_info_redis = await redis_cache.get(clan_redis_key)
-        if clan_info_redis and "-nocache" not in args:
-            log.debug(f"{clan_redis_key} {clan_info_redis}")
-            await redis_cache.expire(clan_redis_key, constants.TIME_HOUR_SECONDS)
-            embeds = [
-                discord.Embed.from_dict(embed)
-                for embed in deserializer(clan_info_redis)
-            ]
-        else:
-            for clan_db in clan_dbs:
-                group = await execute_pydest(
-                    self.bot.destiny.api.get_group,
-                    clan_db.clan_id,
-                    return_type=DestinyGroupResponse,
-                )
-                if not group.response:
-                    log.error(
-                        f"Could not get details for clan {clan_db.name} ({clan_db.clan_id}) - "
-                        f"{group.error_status} {group.error_description}"
-                    )
-                    return await manager.send_and_clean(
-                        f"Clan {clan_db.name} not found", mention=False
-                    )
-                else:
-                    group = group.response
+        embeds, refreshed = await get_clan_info(self.bot.ext_conns, ctx.guild.id)
+        if not embeds or "-nocache" in args:
+            embeds = await set_clan_info(self.bot.ext_conns, ctx.guild.id, clan_dbs)
+        elif time.time() - refreshed > constants.CLAN_INFO_REFRESH_SECONDS:
+            # Serve what we have and let the worker catch up in the background
+            await enqueue_guild_jobs(
+                self.bot.ext_conns,
+                "set_clan_info",
+                [(f"set_clan_info-{ctx.guild.id}", (ctx.guild.id,))],
+            )
 
-                embed = discord.Embed(
-                    colour=constants.BLUE,
-                    title=group.detail.motto,
-                    description=group.detail.about,
-                )
-                embed.set_author(
-                    name=f"{group.detail.name} [{group.detail.clan_info.clan_callsign}]",
-                    url=f"https://www.bungie.net/en/ClanV2?groupid={clan_db.clan_id}",
-                )
-                embed.add_field(
-                    name="Members", value=group.detail.member_count, inline=True
-                )
-                embed.add_field(
-                    name="Founder",
-                    value=group.founder.bungie_net_user_info.display_name,
-                    inline=True,
-                )
-                embed.add_field(
-                    name="Founded",
-                    value=date_as_string(group.detail.creation_date),
-                    inline=True,
-                )
-                embeds.append(embed)
-            await redis_cache.set(
-                clan_redis_key,
-                serializer([embed.to_dict() for embed in embeds]),
-                expire=constants.TIME_HOUR_SECONDS,
+        if not embeds:
+            return await manager.send_and_clean(
+                "Could not get details for connected clans", mention=False
             )
 
         if len(embeds) > 1:
@@ -433,76 +405,54 @@ class ClanCog(commands.Cog, name="Clan"):
         if not clan_dbs:
             return await manager.send_and_clean("No connected clans found")
 
-        # members = []
-        # members_redis = await self.bot.ext_conns['redis_cache'].lrange(f"{ctx.guild.id}-clan-roster", 0, -1)
-        # if members_redis and '-nocache' not in args:
-        #     await self.bot.ext_conns['redis_cache'].expire(f"{ctx.guild.id}-clan-roster", constants.TIME_HOUR_SECONDS)
-        #     for member in members_redis:
-        #         members.append(deserializer(member))
-        # else:
-        #     members_db = await self.bot.database.get_clan_members([clan_db.clan_id for clan_db in clan_dbs])
-        #     for member in members_db:
-        #         await self.bot.ext_conns['redis_cache'].rpush(f"{ctx.guild.id}-clan-roster", serializer(member))
-        #     await self.bot.ext_conns['redis_cache'].expire(f"{ctx.guild.id}-clan-roster", constants.TIME_HOUR_SECONDS)
-        #     members = members_db
-        members_db = await self.bot.database.get_clan_members(
-            [clan_db.clan_id for clan_db in clan_dbs]
-        )
-
-        platform_names = list(constants.PLATFORM_MAP.keys())
-        platform_ids = list(constants.PLATFORM_MAP.values())
-
-        entries = []
-
-        clans = {}
-        for clanmember in members_db:
-            if clanmember.clan.id not in clans.keys():
-                clans[clanmember.clan.id] = {}
-
-            member = clanmember.member
-            timezone = "Not Set"
-            if member.timezone:
-                tz = datetime.now(pytz.timezone(member.timezone))
-                timezone = f"{tz.strftime('UTC%z')} ({tz.tzname()})"
-
-            if member.bungie_username:
-                username = member.bungie_username
-            else:
-                username = f"{member.xbox_username} X"
-            memberships = get_memberships(member)
-            if constants.PLATFORM_BUNGIE in memberships.keys():
-                username = memberships[constants.PLATFORM_BUNGIE][1]
-            else:
-                username = list(memberships.values())[0][1]
+        per_page = 5
+        if "-nocache" in args:
+            entries = await set_cached_roster(self.bot.ext_conns, ctx.guild.id)
+            first_page, count = entries[:per_page], len(entries)
+        else:
+            first_page, count = await get_cached_roster(
+                self.bot.ext_conns, ctx.guild.id, per_page
+            )
 
-            platform_emojis = [
-                constants.PLATFORM_EMOJI_MAP.get(
-                    platform_names[platform_ids.index(platform)]
-                )
-                for platform in memberships.keys()
-            ]
+        if not count:
+            return await manager.send_and_clean("No clan members found")
 
-            member_info = (
-                f"{username} {' '.join([str(self.bot.get_emoji(emoji)) for emoji in platform_emojis if emoji])}",
-                f"Clan: {clanmember.clan.name} [{clanmember.clan.callsign}]\n"
-                f"Join Date: {date_as_string(clanmember.join_date)}\n"
-                f"Timezone: {timezone}",
+        async def fetch(start, stop):
+            return await get_cached_roster_range(
+                self.bot.ext_conns, ctx.guild.id, start, stop
             )
-            clans[clanmember.clan.id][username] = member_info
 
-        entries = []
-        for i in sorted(clans.keys()):
-            for v in sorted(clans[i].keys()):
-                entries.append(clans[i][v])
-        p = FieldPages(
+        p = LazyFieldPages(
             ctx,
-            entries=entries,
-            per_page=5,
+            count=count,
+            fetch=fetch,
+            render=self.roster_field,
+            first_page=first_page,
+            per_page=per_page,
             title="Roster for All Connected Clans",
             color=constants.BLUE,
         )
         await p.paginate()
 
+    def roster_field(self, entry):
+        username, platform_names, clan_name, join_date, timezone_name = entry
+        timezone = "Not Set"
+        if timezone_name:
+            tz = datetime.now(pytz.timezone(timezone_name))
+            timezone = f"{tz.strftime('UTC%z')} ({tz.tzname()})"
+
+        platform_emojis = [
+            constants.PLATFORM_EMOJI_MAP.get(platform_name)
+            for platform_name in platform_names
+        ]
+        emojis = " ".join(
+            [str(self.bot.get_emoji(emoji)) for emoji in platform_emojis if emoji]
+        )
+        return (
+            f"{username} {emojis}",
+            f"Clan: {clan_name}\n" f"Join Date: {join_date}\n" f"Timezone: {timezone}",
+        )
+
     @admin.command()
     async def pending(self, ctx):
         """Show a list of pending members (Admin only, requires registration)"""
@@ -805,6 +755,7 @@ Examples:
                 message_id=application_embed.id,
                 approved=False,
             )
+            self.bot.reactions.track(application_embed.id, CLAN_APPLICATION)
 
             await manager.send_and_clean(
                 "Your application has been submitted for admin approval."
@@ -848,6 +799,8 @@ Examples:
                 new_message = await manager.send_embed(deserializer(embed_packed))
                 application_db.message_id = new_message.id
                 await application_db.save()
+                self.bot.reactions.untrack(previous_message_id)
+                self.bot.reactions.track(new_message.id, CLAN_APPLICATION)
         else:
             await manager.send_and_clean("No applications found.")
 
@@ -884,7 +837,7 @@ Examples:
         """Enable activity tracking on all connected clans (Admin only)"""
         manager = MessageManager(ctx)
 
-        clan_dbs = await self.bot.database.get_clans_by_guild(ctx.guild.id)
+        clan_dbs = await Clan.filter(guild__guild_id=ctx.guild.id)
         for clan_db in clan_dbs:
             if clan_db.activity_tracking:
                 clan_db.activity_tracking = False
@@ -910,13 +863,10 @@ Examples:
 
         message = f"Queueing task to find recent games for all members of {guild_name} ({guild_id})"
         log.info(message)
-        await self.bot.ext_conns["redis_jobs"].enqueue_job(
+        await enqueue_guild_jobs(
+            self.bot.ext_conns,
             "store_all_games",
-            guild_id,
-            guild_name,
-            30,
-            False,
-            _job_id=f"store_all_games-{guild_id}",
+            [(f"store_all_games-{guild_id}", (guild_id, guild_name, 30, False))],
         )
 
         await manager.send_message(message, mention=False, clean=False)
@@ -926,9 +876,7 @@ Examples:
         manager = MessageManager(ctx)
 
         embeds = []
-        clan_dbs = await Clan.filter(guild__guild_id=ctx.guild.id).prefetch_related(
-            "guild"
-        )
+        clan_dbs = await self.bot.database.get_clans_by_guild(ctx.guild.id)
         for clan_db in clan_dbs:
             embed = discord.Embed(
                 colour=constants.BLUE,
@@ -940,11 +888,10 @@ Examples:
                 embed.add_field(name="None", value="-")
             else:
                 for inactive_member in inactive_members:
-                    time_delta, _, _, username = inactive_member
-                    months, remainder = divmod(time_delta, 2628000)
-                    days, _ = divmod(remainder, 86400)
+                    months, days = self.inactive_time(inactive_member)
                     embed.add_field(
-                        name=username, value=f"{int(months)} months {int(days)} days"
+                        name=inactive_member.username,
+                        value=f"{months} months {days} days",
                     )
 
             embeds.append(embed)
@@ -987,6 +934,7 @@ Examples:
         )
 
         await member_db.delete()  # TODO
+        await clear_member_permissions(self.bot.ext_conns, [ctx.guild.id])
 
         return await manager.send_message(
             f"Member **{username}** has been kicked from {admin_db.clan.name}"
@@ -998,7 +946,9 @@ Examples:
 
         admin_db = await self.bot.database.get_member_by_discord_id(ctx.author.id)
 
-        inactive_members = await self.get_inactive_members(ctx, admin_db.clan)
+        inactive_members = await self.get_inactive_members(
+            ctx, admin_db.clan, fresh=True
+        )
         if not inactive_members:
             return await manager.send_message(
                 f"Clan {admin_db.clan.name} has no inactive members in the past 30 days"
@@ -1029,26 +979,21 @@ Examples:
 
         announcements = []
         for member in inactive_members:
-            time_delta, platform_id, membership_id, username = member
-            months, remainder = divmod(time_delta, 2628000)
-            days, _ = divmod(remainder, 86400)
-
-            member_db = await self.bot.database.get_clan_member_by_platform(
-                membership_id, platform_id, [admin_db.clan.id]
-            )
+            username = member.username
+            months, days = self.inactive_time(member)
 
             kick_message = f"Kick **{username}** "
 
             member_discord = None
-            if member_db.member.discord_id:
-                member_discord = ctx.guild.get_member(member_db.member.discord_id)
+            if member.discord_id:
+                member_discord = ctx.guild.get_member(member.discord_id)
                 if member_discord:
                     kick_message += f"(Discord: {member_discord.display_name}), "
 
             if not member_discord:
                 kick_message += "(not in this Discord server or not registered), "
 
-            kick_message += f"inactive for {int(months)} months {int(days)} days?"
+            kick_message += f"inactive for {months} months {days} days?"
 
             confirm = {
                 constants.EMOJI_CHECKMARK: True,
@@ -1069,16 +1014,16 @@ Examples:
                 admin_db.member,
                 manager,
                 group_id=admin_db.clan.clan_id,
-                membership_type=platform_id,
-                membership_id=membership_id,
+                membership_type=member.platform_id,
+                membership_id=member.membership_id,
                 access_token=admin_db.bungie_access_token,
             )
 
-            await member_db.delete()  # TODO
+            await ClanMember.filter(id=member.clanmember_id).delete()  # TODO
 
             announcement_base = (
                 f"has been kicked from {admin_db.clan.name} after being inactive "
-                f"for {int(months)} months {int(days)} days"
+                f"for {months} months {days} days"
             )
             await manager.send_message(
                 f"Member **{username}** {announcement_base}", mention=False, clean=False
@@ -1094,7 +1039,12 @@ Examples:
             announcements.append(announcement)
 
         if announcements:
-            # await set_cached_members(self.bot.ext_conns, ctx.guild.id, ctx.guild.name)
+            await set_cached_members(self.bot.ext_conns, ctx.guild.id, ctx.guild.name)
+            await set_cached_roster(self.bot.ext_conns, ctx.guild.id)
+            await set_inactive_report(
+                self.bot.ext_conns, ctx.guild.id, admin_db.clan.id
+            )
+            await clear_member_permissions(self.bot.ext_conns, [ctx.guild.id])
 
             announcement_channel = ctx.guild.get_channel(
                 self.bot.guild_map[ctx.guild.id].announcement_channel
@@ -4,7 +4,7 @@ import pytz
 
 from datetime import datetime
 from discord.ext import commands
-from discord.ext.commands.errors import BadArgument, MemberNotFound
+from discord.ext.commands.errors import BadArgument
 from urllib.parse import quote
 
 from seraphsix import constants
@@ -26,6 +26,7 @@ from seraphsix.tasks.activity import (
     get_sherpa_time_played,
     execute_pydest,
 )
+from seraphsix.tasks.core import clear_cached_roster
 
 log = logging.getLogger(__name__)
 
@@ -104,10 +105,9 @@ class MemberCog(commands.Cog, name="Member"):
             timezone = f"{tz.strftime('UTC%z')} ({tz.tzname()})"
 
         if member_db.discord_id:
-            member_discord = await commands.MemberConverter().convert(
-                ctx, str(member_db.discord_id)
-            )
-            discord_username = str(member_discord)
+            member_discord = await self.bot.user_cache.get(member_db.discord_id)
+            if member_discord:
+                discord_username = str(member_discord)
 
         requestor_is_admin = False
         if requestor_db and requestor_db.member_type >= constants.CLAN_MEMBER_ADMIN:
@@ -337,21 +337,21 @@ Example: ?member sherpatime
                 f'Getting sherpa time played by username "{member_name}" for "{ctx.author}"'
             )
 
-        time_played, sherpa_ids = await get_sherpa_time_played(member_db)
+        time_played, sherpa_ids = await get_sherpa_time_played(
+            self.bot.database, member_db
+        )
 
         sherpa_list = []
         if time_played > 0:
-            for sherpa_id in await sherpa_ids:
-                try:
-                    sherpa_discord = await commands.MemberConverter().convert(
-                        ctx, str(sherpa_id)
-                    )
-                except MemberNotFound:
-                    sherpa_list.append(str(sherpa_id))
-                else:
+            sherpas_discord = await self.bot.user_cache.resolve(sherpa_ids)
+            for sherpa_id in sherpa_ids:
+                sherpa_discord = sherpas_discord[sherpa_id]
+                if sherpa_discord:
                     sherpa_list.append(
                         f"{sherpa_discord.name}#{sherpa_discord.discriminator}"
                     )
+                else:
+                    sherpa_list.append(str(sherpa_id))
 
         embed = discord.Embed(
             colour=constants.BLUE,
@@ -421,6 +421,10 @@ Example: ?member sherpatime
             else:
                 return await manager.send_and_clean("Unexpected response, canceling")
 
+        await clear_cached_roster(
+            self.bot.ext_conns,
+            await self.bot.database.get_member_guild_ids(member_db.id),
+        )
         return await manager.send_and_clean("Timezone updated successfully!")
 
 
@@ -4,10 +4,11 @@ import logging
 from discord.ext import commands
 
 from seraphsix import constants
+from seraphsix.cache import clear_member_permissions
 from seraphsix.cogs.utils.message_manager import MessageManager
 from seraphsix.models.database import Member, Role
 from seraphsix.models.destiny import User, DestinyMembershipResponse
-from seraphsix.tasks.core import execute_pydest, register
+from seraphsix.tasks.core import clear_cached_roster, execute_pydest, register
 
 log = logging.getLogger(__name__)
 
@@ -102,6 +103,13 @@ class RegisterCog(commands.Cog, name="Register"):
         member_db.bungie_access_token = bungie_access_token
         member_db.bungie_refresh_token = user_info.get("refresh_token")
         await member_db.save()
+        await clear_member_permissions(
+            self.bot.ext_conns, self.bot.guild_map.keys(), ctx.author.id
+        )
+        await clear_cached_roster(
+            self.bot.ext_conns,
+            await self.bot.database.get_member_guild_ids(member_db.id),
+        )
 
         e = discord.Embed(colour=constants.BLUE, title="Full Registration Complete")
 
@@ -4,6 +4,7 @@ import logging
 from discord.ext import commands
 from tortoise.exceptions import DoesNotExist
 from seraphsix import constants
+from seraphsix.cache import clear_member_permissions
 from seraphsix.cogs.utils.checks import twitter_enabled, clan_is_linked
 from seraphsix.cogs.utils.message_manager import MessageManager
 from seraphsix.models.database import TwitterChannel, Clan, Guild, Role
@@ -171,6 +172,7 @@ class ServerCog(commands.Cog, name="Server"):
                 clan_db.callsign = callsign
                 await clan_db.save()
 
+        await clear_member_permissions(self.bot.ext_conns, [ctx.guild.id])
         return await manager.send_and_clean(
             f"Server **{ctx.message.guild.name}** linked to **{clan_name} [{callsign}]**"
         )
@@ -183,12 +185,13 @@ class ServerCog(commands.Cog, name="Server"):
         manager = MessageManager(ctx)
 
         try:
-            clan_db = await self.bot.database.get_clans_by_guild(ctx.guild.id)
+            clan_db = await Clan.get(guild__guild_id=ctx.guild.id)
         except DoesNotExist:
             message = "No clan linked to this server."
         else:
             clan_db.guild_id = None
             await clan_db.save()
+            await clear_member_permissions(self.bot.ext_conns, [ctx.guild.id])
             message = f"Server **{ctx.message.guild.name}** unlinked from **{clan_db.name} [{clan_db.callsign}]**"
 
         return await manager.send_and_clean(message)
@@ -203,9 +206,9 @@ class ServerCog(commands.Cog, name="Server"):
         if len(new_prefix) > 5:
             message = "Prefix must be less than 6 characters."
         else:
-            guild_db = await Guild.get(guild_id=ctx.guild.id)
+            guild_db = await self.bot.guild_cache.get(ctx.guild.id)
             guild_db.prefix = new_prefix
-            await guild_db.save()
+            await self.bot.guild_cache.save(guild_db)
             message = f"Command prefix has been changed to `{new_prefix}`"
 
         return await manager.send_and_clean(message)
@@ -223,8 +226,7 @@ class ServerCog(commands.Cog, name="Server"):
         if not platform_id:
             message = f"Platform must be one of `{', '.join(constants.PLATFORM_MAP.keys()).title()}`.`"
         else:
-            clan_dbs = await self.bot.database.get_clans_by_guild(ctx.guild.id)
-            await clan_dbs.update(platform=platform_id)
+            await Clan.filter(guild__guild_id=ctx.guild.id).update(platform=platform_id)
             message = f"Platform has been set to `{platform}`"
 
         return await manager.send_and_clean(message)
@@ -243,9 +245,9 @@ class ServerCog(commands.Cog, name="Server"):
             if not channel:
                 message = f"Channel ID {channel_id} not found"
             else:
-                guild_db = await Guild.get(guild_id=ctx.guild.id)
+                guild_db = await self.bot.guild_cache.get(ctx.guild.id)
                 guild_db.admin_channel = channel_id
-                await guild_db.save()
+                await self.bot.guild_cache.save(guild_db)
                 message = f"Channel for Admin Notifications set to {str(channel)} ({channel_id})"
 
         return await manager.send_and_clean(message)
@@ -283,6 +285,10 @@ class ServerCog(commands.Cog, name="Server"):
 
         if roles:
             await Role.bulk_create(roles)
+            self.bot.sherpa_index.invalidate(ctx.guild.id)
+            await self.bot.ext_conns["redis_cache"].publish(
+                constants.SHERPA_INDEX_CHANNEL, ctx.guild.id
+            )
 
         return await manager.send_and_clean("Sherpa roles have been set")
 
@@ -346,7 +352,7 @@ class ServerCog(commands.Cog, name="Server"):
     async def sherpatracking(self, ctx):
         """Set server sherpa role tracking state (Manage Server only)"""
         manager = MessageManager(ctx)
-        guild_db = await Guild.get(guild_id=ctx.guild.id)
+        guild_db = await self.bot.guild_cache.get(ctx.guild.id)
 
         reactions = {
             constants.EMOJI_CHECKMARK: "True",
@@ -363,7 +369,12 @@ class ServerCog(commands.Cog, name="Server"):
             return await manager.send_and_clean("Canceling command")
 
         track = reactions[react] == "True"
-        await guild_db.update(track_sherpas=track)
+        guild_db.track_sherpas = track
+        await self.bot.guild_cache.save(guild_db)
+        self.bot.sherpa_index.invalidate(ctx.guild.id)
+        await self.bot.ext_conns["redis_cache"].publish(
+            constants.SHERPA_INDEX_CHANNEL, ctx.guild.id
+        )
 
         message = "Sherpa tracking has been"
         if track:
@@ -477,6 +488,11 @@ class ServerCog(commands.Cog, name="Server"):
             return await manager.send_and_clean("Canceling command")
 
         await Role.filter(guild=guild_db).delete()
+        # Sherpa roles are cleared along with the platform roles
+        self.bot.sherpa_index.invalidate(ctx.guild.id)
+        await self.bot.ext_conns["redis_cache"].publish(
+            constants.SHERPA_INDEX_CHANNEL, ctx.guild.id
+        )
         return await manager.send_and_clean("Platform roles cleared")
 
     @role_set.command(name="protectedmember")
@@ -525,7 +541,7 @@ class ServerCog(commands.Cog, name="Server"):
     async def aggregateclans(self, ctx):
         """Aggregate all connected clan data (Admin only)"""
         manager = MessageManager(ctx)
-        guild_db = await Guild.get(guild_id=ctx.guild.id)
+        guild_db = await self.bot.guild_cache.get(ctx.guild.id)
 
         if guild_db.aggregate_clans:
             guild_db.aggregate_clans = False
@@ -533,7 +549,7 @@ class ServerCog(commands.Cog, name="Server"):
             guild_db.aggregate_clans = True
 
         message = f"Clan aggregation has been {'enabled' if guild_db.aggregate_clans else 'disabled'}."
-        await guild_db.save()
+        await self.bot.guild_cache.save(guild_db)
         return await manager.send_and_clean(message)
 
 
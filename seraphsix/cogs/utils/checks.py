@@ -1,9 +1,9 @@
 import discord
 
 from discord.ext import commands
-from tortoise.exceptions import DoesNotExist
 
-from seraphsix.constants import SUPPORTED_GAME_MODES, CLAN_MEMBER_ADMIN
+from seraphsix.cache import get_member_permissions
+from seraphsix.constants import SUPPORTED_GAME_MODES
 from seraphsix.errors import (
     ConfigurationError,
     InvalidAdminError,
@@ -13,7 +13,7 @@ from seraphsix.errors import (
     NotRegisteredError,
     MissingTimezoneError,
 )
-from seraphsix.models.database import Member, ClanMember
+from seraphsix.models.database import Member
 
 
 def is_event(message):
@@ -66,17 +66,26 @@ def is_valid_game_mode():
     return commands.check(predicate)
 
 
+async def get_permissions(ctx):
+    """Permission state of the invoking user, looked up at most once per command"""
+    permissions = getattr(ctx, "member_permissions", None)
+    if not permissions:
+        guild_id = ctx.guild.id if ctx.guild else 0
+        permissions = await get_member_permissions(
+            ctx.bot.ext_conns, guild_id, ctx.author.id
+        )
+        ctx.member_permissions = permissions
+    return permissions
+
+
 async def check_registered(ctx):
-    member_db = await Member.get_or_none(discord_id=ctx.author.id)
-    if not member_db or not member_db.bungie_access_token:
+    if not (await get_permissions(ctx)).is_registered:
         raise NotRegisteredError(ctx.prefix)
     return True
 
 
 async def check_clan_linked(ctx):
-    try:
-        await ctx.bot.database.get_clans_by_guild(ctx.guild.id)
-    except DoesNotExist:
+    if not (await get_permissions(ctx)).is_clan_linked:
         raise ConfigurationError(
             (
                 f"Server **{ctx.message.guild.name}** has not been linked to "
@@ -87,15 +96,17 @@ async def check_clan_linked(ctx):
 
 
 async def check_clan_member(ctx):
-    try:
-        await ClanMember.get(
-            clan__guild__guild_id=ctx.message.guild.id, member__discord_id=ctx.author.id
-        )
-    except DoesNotExist:
+    if not (await get_permissions(ctx)).is_clan_member:
         raise InvalidMemberError
     return True
 
 
+async def check_clan_admin(ctx):
+    if not (await get_permissions(ctx)).is_clan_admin:
+        raise InvalidAdminError
+    return True
+
+
 async def check_timezone(ctx):
     member_db = await Member.get_or_none(discord_id=ctx.author.id)
     if not member_db:
@@ -139,14 +150,7 @@ def is_clan_admin():
         await check_registered(ctx)
         await check_clan_linked(ctx)
         await check_clan_member(ctx)
-        try:
-            await ClanMember.get(
-                clan__guild__guild_id=ctx.message.guild.id,
-                member_type__gte=CLAN_MEMBER_ADMIN,
-                member__discord_id=ctx.author.id,
-            )
-        except DoesNotExist:
-            raise InvalidAdminError
+        await check_clan_admin(ctx)
         return True
 
     return commands.check(predicate)
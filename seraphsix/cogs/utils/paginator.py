@@ -309,6 +309,31 @@ class FieldPages(Pages):
             self.embed.set_footer(text=text)
 
 
+class LazyFieldPages(FieldPages):
+    """FieldPages that loads its entries one page at a time.
+
+    fetch is a coroutine taking the start and stop index of a page and render
+    turns a fetched entry into the (key, value) tuple shown as a field.
+    """
+
+    def __init__(self, ctx, *, count, fetch, render, first_page=None, **kwargs):
+        super().__init__(ctx, entries=range(count), **kwargs)
+        self.fetch = fetch
+        self.render = render
+        self.pages = {}
+        if first_page is not None:
+            self.pages[1] = first_page
+
+    def get_page(self, page):
+        return [self.render(entry) for entry in self.pages[page]]
+
+    async def show_page(self, page, *, first=False):
+        if page not in self.pages:
+            base = (page - 1) * self.per_page
+            self.pages[page] = await self.fetch(base, base + self.per_page - 1)
+        return await super().show_page(page, first=first)
+
+
 class TextPages(Pages):
     """Uses a commands.Paginator internally to paginate some text."""
 
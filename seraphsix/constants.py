@@ -5,15 +5,68 @@ from datetime import datetime
 
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 DATE_FORMAT_TZ = f"{DATE_FORMAT} %Z"
+TIME_DAY_SECONDS = 86400
 TIME_HOUR_SECONDS = 3600
 TIME_MIN_SECONDS = 60
 ROOT_LOG_LEVEL = "INFO"
+DEFAULT_PREFIX = "?"
+GUILD_CONFIG_CHANNEL = "guild-config"
+SHERPA_INDEX_CHANNEL = "sherpa-index"
+SHERPA_FLUSH_SECONDS = 5
+GUILD_NAMES_KEY = "guild-names"
+PERMISSIONS_CACHE_SECONDS = 60
+USER_CACHE_SECONDS = TIME_HOUR_SECONDS
+DISCORD_FETCH_CONCURRENCY = 5
+# Bump when the layout of the member cache snapshot changes
+MEMBER_CACHE_VERSION = 1
+CLAN_INFO_REFRESH_SECONDS = TIME_MIN_SECONDS * 45
 
 LOG_FORMAT_MSG = "%(asctime)s %(name)s[%(process)d]: %(levelname)s %(message)s"
 DB_MAX_CONNECTIONS = 20
+DB_INGEST_MAX_CONNECTIONS = 20
+DB_CONN_READ = "default"
+DB_CONN_INGEST = "ingest"
 
 ARQ_MAX_JOBS = 100
 ARQ_JOB_TIMEOUT = TIME_HOUR_SECONDS
+ARQ_ENQUEUE_BATCH_SIZE = 500
+WORKER_MEMBERS_KEY = "worker-members"
+SHARD_HEARTBEAT_SECONDS = 10
+SHARD_LEASE_SECONDS = 30
+# Must stay under the lease so a shard isn't picked up while it still drains
+SHARD_DRAIN_SECONDS = 15
+SHARD_VNODES = 64
+# Worker processes sharing a host serve metrics on the next free port from
+# metrics_port, up to this many ports
+METRICS_PORTS = 16
+DEAD_LETTER_KEY = "dead-letter"
+# Jobs waiting in the queues per function, kept by enqueue_jobs and instrument
+QUEUED_JOBS_KEY = "queued-jobs"
+JOB_RETRIES_SECONDS = TIME_DAY_SECONDS
+# Retries per job and error class, on top of the backoff inside execute_pydest
+MAINTENANCE_RETRIES = 12
+MAINTENANCE_RETRY_SECONDS = TIME_MIN_SECONDS * 10
+API_ERROR_RETRIES = 3
+API_ERROR_RETRY_SECONDS = TIME_MIN_SECONDS * 2
+# arq counts every try, so room for all retry budgets together plus timeouts and
+# shard handovers that cancel a job back onto the queue
+ARQ_CANCELLED_TRIES = 5
+ARQ_MAX_TRIES = 1 + MAINTENANCE_RETRIES + API_ERROR_RETRIES + ARQ_CANCELLED_TRIES
+
+DESTINY_API_RATE = 20
+GUILD_MAX_JOBS = ARQ_MAX_JOBS // 4
+GUILD_JOB_DEFER_SECONDS = 5
+DESTINY_API_BACKOFF_SECONDS = TIME_MIN_SECONDS * 5
+PRIVATE_HISTORY_CACHE_SECONDS = TIME_DAY_SECONDS
+UPDATE_MEMBERS_SECONDS = TIME_MIN_SECONDS * 5
+LAST_ACTIVE_CACHE_SECONDS = TIME_MIN_SECONDS * 4
+LAST_ACTIVE_CONCURRENCY = 20
+
+MANIFEST_VERSION_KEY = "destiny-manifest-version"
+MANIFEST_DEFINITIONS = ["DestinyActivityDefinition", "DestinyActivityModeDefinition"]
+
+GAME_PARTITION_MONTHS_AHEAD = 3
+GAME_RETENTION_MONTHS = 12
 
 BLUE = discord.Color(3381759)
 CLEANUP_DELAY = 4
@@ -1,58 +1,355 @@
-import asyncio
 import logging
+import re
+import time
 
-from datetime import timedelta
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from seraphsix import constants
 from seraphsix.tasks.parsing import member_hash
 from seraphsix.models.database import (
     Member,
-    Clan,
     ClanMember,
-    GameMember,
+    GamePartition,
     Game,
-    ClanGame,
 )
+from seraphsix.models.records import (
+    ClanMemberRecord,
+    ClanRecord,
+    InactiveMemberRecord,
+    MemberRecord,
+    PermissionRecord,
+)
+from seraphsix.pool import QUERY_SECONDS
 
 from urllib.parse import urlparse
 
 from tortoise import Tortoise
-from tortoise.exceptions import IntegrityError
 from tortoise.functions import Lower
 from tortoise.query_utils import Q
+from tortoise.transactions import in_transaction
 from tortoise import timezone
 
 log = logging.getLogger(__name__)
 
+PARTITIONED_GAME_TABLES = ["game", "gamemember"]
+PARTITION_NAME_RE = re.compile(r"^game_y(\d{4})m(\d{2})$")
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_{month.strftime('y%Ym%m')}"
+
+
+def retention_horizon(retention_months, today=None):
+    """Start of the first month that is kept in live partitions"""
+    return add_months(month_start(today or date.today()), -retention_months)
+
+
+PLATFORM_ID_FIELDS = {
+    constants.PLATFORM_BUNGIE: "bungie_id",
+    constants.PLATFORM_PSN: "psn_id",
+    constants.PLATFORM_XBOX: "xbox_id",
+    constants.PLATFORM_BLIZZARD: "blizzard_id",
+    constants.PLATFORM_STEAM: "steam_id",
+    constants.PLATFORM_STADIA: "stadia_id",
+}
+
+
+def platform_id_query(memberships, prefix=""):
+    """Group (platform_id, membership_id) pairs by platform and build a Q matching any
+
+    Returns the grouped membership ids and the query, which is None if there
+    are no pairs.
+    """
+    platform_ids = {}
+    for platform_id, membership_id in memberships:
+        platform_ids.setdefault(platform_id, set()).add(membership_id)
+    if not platform_ids:
+        return platform_ids, None
+
+    query = Q(
+        *[
+            Q(
+                **{
+                    f"{prefix}{PLATFORM_ID_FIELDS[platform_id]}__in": list(
+                        membership_ids
+                    )
+                }
+            )
+            for platform_id, membership_ids in platform_ids.items()
+        ],
+        join_type="OR",
+    )
+    return platform_ids, query
+
+
+def match_platform_ids(platform_ids, member_db):
+    """Yield the (platform_id, membership_id) pairs a member was looked up by"""
+    for platform_id, membership_ids in platform_ids.items():
+        membership_id = getattr(member_db, PLATFORM_ID_FIELDS[platform_id])
+        if membership_id in membership_ids:
+            yield platform_id, membership_id
+
+
+def columns(alias, fields):
+    return ", ".join([f'{alias}."{field}"' for field in fields])
+
+
+MEMBER_FIELDS = MemberRecord._fields
+CLAN_FIELDS = ClanRecord._fields
+# The last two fields of a clan member record are the nested member and clan
+CLANMEMBER_FIELDS = ClanMemberRecord._fields[:-2]
+
+CLANMEMBER_SELECT = (
+    f"SELECT {columns('cm', CLANMEMBER_FIELDS)}, "
+    f"{columns('m', MEMBER_FIELDS)}, {columns('c', CLAN_FIELDS)} "
+    f"FROM clanmember cm "
+    f"JOIN member m ON m.id = cm.member_id "
+    f"JOIN clan c ON c.id = cm.clan_id "
+)
+
+# Named queries used by the asyncpg fast path. asyncpg keeps a per-connection
+# cache of prepared statements keyed on the query text, so each of these is
+# only parsed and planned once per pooled connection.
+QUERIES = {
+    "clan_members_by_guild": (
+        f"{CLANMEMBER_SELECT}"
+        f"JOIN guild g ON g.id = c.guild_id "
+        f"WHERE g.guild_id = $1"
+    ),
+    "clans_by_guild": (
+        f"SELECT {columns('c', CLAN_FIELDS)} FROM clan c "
+        f"JOIN guild g ON g.id = c.guild_id "
+        f"WHERE g.guild_id = $1 ORDER BY c.id"
+    ),
+    "guild_has_clans": (
+        "SELECT EXISTS ("
+        "SELECT 1 FROM clan c JOIN guild g ON g.id = c.guild_id WHERE g.guild_id = $1"
+        ")"
+    ),
+    "guild_prefix": "SELECT prefix FROM guild WHERE guild_id = $1",
+    "create_guild": (
+        "INSERT INTO guild (guild_id, prefix, clear_spam, aggregate_clans, track_sherpas) "
+        "VALUES ($1, $2, false, true, false) "
+        "ON CONFLICT (guild_id) DO NOTHING"
+    ),
+    "member_is_registered": (
+        "SELECT EXISTS ("
+        "SELECT 1 FROM member WHERE discord_id = $1 AND bungie_access_token IS NOT NULL"
+        ")"
+    ),
+    "member_clan_rank": (
+        "SELECT MAX(cm.member_type) FROM clanmember cm "
+        "JOIN member m ON m.id = cm.member_id "
+        "JOIN clan c ON c.id = cm.clan_id "
+        "JOIN guild g ON g.id = c.guild_id "
+        "WHERE g.guild_id = $1 AND m.discord_id = $2"
+    ),
+    "member_is_clan_member": (
+        "SELECT EXISTS ("
+        "SELECT 1 FROM clanmember cm "
+        "JOIN member m ON m.id = cm.member_id "
+        "JOIN clan c ON c.id = cm.clan_id "
+        "JOIN guild g ON g.id = c.guild_id "
+        "WHERE g.guild_id = $1 AND m.discord_id = $2"
+        ")"
+    ),
+    # Everything the permission checks need for a (guild, user) in one round trip
+    "member_permissions": (
+        "SELECT "
+        "EXISTS ("
+        "SELECT 1 FROM member WHERE discord_id = $2 AND bungie_access_token IS NOT NULL"
+        "), "
+        "EXISTS ("
+        "SELECT 1 FROM clan c JOIN guild g ON g.id = c.guild_id WHERE g.guild_id = $1"
+        "), "
+        "count(cm.id) > 0, max(cm.member_type) "
+        "FROM clanmember cm "
+        "JOIN member m ON m.id = cm.member_id AND m.discord_id = $2 "
+        "JOIN clan c ON c.id = cm.clan_id "
+        "JOIN guild g ON g.id = c.guild_id AND g.guild_id = $1"
+    ),
+    # Mirrors get_primary_membership: the primary membership if one is set,
+    # otherwise the first of xbox, psn, steam or stadia the member has
+    "inactive_clan_members": (
+        f"SELECT cm.id, m.id, m.discord_id, cm.last_active, "
+        f"p.platform_id, p.membership_id, p.username "
+        f"FROM clanmember cm "
+        f"JOIN member m ON m.id = cm.member_id "
+        f"LEFT JOIN LATERAL ("
+        f"SELECT platform_id, membership_id, username FROM (VALUES "
+        f"(1, {constants.PLATFORM_XBOX}, m.xbox_id, m.xbox_username), "
+        f"(2, {constants.PLATFORM_PSN}, m.psn_id, m.psn_username), "
+        f"(3, {constants.PLATFORM_STEAM}, m.steam_id, m.steam_username), "
+        f"(4, {constants.PLATFORM_STADIA}, m.stadia_id, m.stadia_username)"
+        f") AS v (position, platform_id, membership_id, username) "
+        f"WHERE v.membership_id IS NOT NULL AND ("
+        f"m.primary_membership_id IS NULL "
+        f"OR v.membership_id = m.primary_membership_id"
+        f") ORDER BY v.position LIMIT 1"
+        f") p ON true "
+        f"WHERE cm.clan_id = $1 AND cm.last_active < now() - $2::interval "
+        f"ORDER BY cm.last_active"
+    ),
+    # Ingestion upserts, run on the ingest connection. The unique constraints all
+    # include the partition key so they can back ON CONFLICT on partitioned tables.
+    # Detached months aren't covered by the unique constraint any more, their
+    # games are remembered in gamearchive so they aren't ingested twice
+    "create_game": (
+        "INSERT INTO game (mode_id, instance_id, date, reference_id) "
+        "SELECT $1::int, $2::bigint, $3::timestamptz, $4::bigint "
+        "WHERE NOT EXISTS ("
+        "SELECT 1 FROM gamearchive WHERE instance_id = $2 AND date = $3"
+        ") "
+        "ON CONFLICT (instance_id, date) DO NOTHING "
+        "RETURNING id"
+    ),
+    "create_clan_game": (
+        "INSERT INTO clangame (clan_id, game_id) VALUES ($1, $2) "
+        "ON CONFLICT (clan_id, game_id) DO NOTHING "
+        "RETURNING id"
+    ),
+    "upsert_game_members": (
+        "INSERT INTO gamemember (game_id, date, member_id, time_played, completed) "
+        "SELECT $1::int, $2::timestamptz, * FROM unnest($3::int[], $4::float8[], $5::bool[]) "
+        "ON CONFLICT (game_id, member_id, date) DO UPDATE SET "
+        "time_played = coalesce(gamemember.time_played, 0) + EXCLUDED.time_played, "
+        "completed = gamemember.completed OR EXCLUDED.completed"
+    ),
+    # Games for a month that was already rolled up, e.g. from a full history sync
+    # of a new member, have to be rolled up again. Only run for games older than
+    # the retention horizon, later months are never rolled up.
+    "mark_game_month_dirty": (
+        "UPDATE gamepartition SET dirty = true "
+        "WHERE month = date_trunc('month', $1::timestamptz)::date "
+        "AND rolled_up IS NOT NULL AND NOT dirty"
+    ),
+    "update_last_active": (
+        "UPDATE clanmember SET last_active = v.last_active "
+        "FROM unnest($1::int[], $2::timestamptz[]) AS v (id, last_active) "
+        "WHERE clanmember.id = v.id"
+    ),
+}
+
+
+def clan_member_record(row):
+    values = tuple(row)
+    clanmember_end = len(CLANMEMBER_FIELDS)
+    member_end = clanmember_end + len(MEMBER_FIELDS)
+    member = MemberRecord(*values[clanmember_end:member_end])
+    clan = ClanRecord(*values[member_end:])
+    return ClanMemberRecord(*values[:clanmember_end], member, clan)
+
 
 class Database(object):
-    def __init__(self, url, max_connections=constants.DB_MAX_CONNECTIONS):
+    def __init__(
+        self,
+        url,
+        max_connections=constants.DB_MAX_CONNECTIONS,
+        ingest_connections=constants.DB_INGEST_MAX_CONNECTIONS,
+        game_retention_months=constants.GAME_RETENTION_MONTHS,
+    ):
         self.url = urlparse(url)
         self.max_size = max_connections
+        self.ingest_max_size = ingest_connections
+        self.game_retention_months = game_retention_months
+
+    def connection_config(self, max_size):
+        return {
+            "engine": "seraphsix.pool",
+            "credentials": {
+                "host": self.url.hostname,
+                "port": self.url.port,
+                "user": self.url.username,
+                "password": self.url.password,
+                "database": self.url.path[1:],
+                "max_size": max_size,
+            },
+        }
 
     async def initialize(self):
+        # Interactive reads and ingestion writes get separately sized pools so a
+        # burst of activity jobs can't starve command handlers of connections
         await Tortoise.init(
             config={
                 "connections": {
-                    "default": {
-                        "engine": "tortoise.backends.asyncpg",
-                        "credentials": {
-                            "host": self.url.hostname,
-                            "port": self.url.port,
-                            "user": self.url.username,
-                            "password": self.url.password,
-                            "database": self.url.path[1:],
-                            "max_size": self.max_size,
-                        },
-                    }
+                    constants.DB_CONN_READ: self.connection_config(self.max_size),
+                    constants.DB_CONN_INGEST: self.connection_config(
+                        self.ingest_max_size
+                    ),
                 },
                 "apps": {
                     "seraphsix": {
                         "models": ["seraphsix.models.database"],
+                        "default_connection": constants.DB_CONN_READ,
                     }
                 },
             }
         )
 
+    @property
+    def ingest(self):
+        return Tortoise.get_connection(constants.DB_CONN_INGEST)
+
+    def transaction(self):
+        return in_transaction(constants.DB_CONN_INGEST)
+
+    async def run_query(self, method, query_name, *args):
+        client = Tortoise.get_connection(constants.DB_CONN_READ)
+        async with client.acquire_connection() as conn:
+            # Same format as Tortoise's db_client query log
+            log.debug("%s: %s", QUERIES[query_name], list(args))
+            start = time.perf_counter()
+            try:
+                return await getattr(conn, method)(QUERIES[query_name], *args)
+            finally:
+                QUERY_SECONDS.labels(
+                    pool=constants.DB_CONN_READ, query=query_name
+                ).observe(time.perf_counter() - start)
+
+    async def fetch(self, query_name, *args):
+        return await self.run_query("fetch", query_name, *args)
+
+    async def fetchval(self, query_name, *args):
+        return await self.run_query("fetchval", query_name, *args)
+
+    async def execute(self, query_name, *args):
+        return await self.run_query("execute", query_name, *args)
+
+    async def get_guild_prefix(self, guild_id):
+        prefix = await self.fetchval("guild_prefix", guild_id)
+        if prefix is None:
+            await self.create_guild(guild_id)
+            prefix = constants.DEFAULT_PREFIX
+        return prefix
+
+    async def create_guild(self, guild_id):
+        await self.execute("create_guild", guild_id, constants.DEFAULT_PREFIX)
+
+    async def guild_has_clans(self, guild_id):
+        return await self.fetchval("guild_has_clans", guild_id)
+
+    async def member_is_registered(self, discord_id):
+        return await self.fetchval("member_is_registered", discord_id)
+
+    async def member_is_clan_member(self, guild_id, discord_id):
+        return await self.fetchval("member_is_clan_member", guild_id, discord_id)
+
+    async def member_is_clan_admin(self, guild_id, discord_id):
+        rank = await self.fetchval("member_clan_rank", guild_id, discord_id)
+        return rank is not None and rank >= constants.CLAN_MEMBER_ADMIN
+
+    async def get_member_permissions(self, guild_id, discord_id):
+        row = await self.fetch("member_permissions", guild_id, discord_id)
+        return PermissionRecord(*row[0])
+
     async def get_member_by_platform(self, member_id, platform_id):
         if platform_id == constants.PLATFORM_BUNGIE:
             query = Member.get_or_none(bungie_id=member_id)
@@ -68,6 +365,46 @@ class Database(object):
             query = Member.get_or_none(stadia_id=member_id)
         return await query
 
+    async def get_members_by_platform_ids(self, memberships, using_db=None):
+        """Look up members for many (platform_id, membership_id) pairs in one query.
+
+        Returns a dict keyed by the (platform_id, membership_id) pair, pairs which
+        don't match a member are left out.
+        """
+        platform_ids, query = platform_id_query(memberships)
+        if query is None:
+            return {}
+
+        member_dbs = Member.filter(query)
+        if using_db:
+            member_dbs = member_dbs.using_db(using_db)
+
+        members = {}
+        for member_db in await member_dbs:
+            for membership in match_platform_ids(platform_ids, member_db):
+                members[membership] = member_db
+        return members
+
+    async def get_clan_members_by_platforms(self, memberships, clan_ids):
+        """Look up clan members for many (platform_id, membership_id) pairs in one query.
+
+        Returns a dict keyed by the (platform_id, membership_id) pair, pairs which
+        don't match a member of one of the clans are left out.
+        """
+        platform_ids, query = platform_id_query(memberships, prefix="member__")
+        if query is None:
+            return {}
+
+        clanmember_dbs = await ClanMember.filter(
+            query, clan_id__in=clan_ids
+        ).prefetch_related("member")
+
+        clan_members = {}
+        for clanmember_db in clanmember_dbs:
+            for membership in match_platform_ids(platform_ids, clanmember_db.member):
+                clan_members[membership] = clanmember_db
+        return clan_members
+
     async def get_member_by_naive_username(self, username, include_clan=True):
         username = username.lower()
 
@@ -150,6 +487,14 @@ class Database(object):
         )
         return query
 
+    async def get_member_guild_ids(self, member_id):
+        """Discord guild ids of the clans a member belongs to"""
+        return await (
+            ClanMember.filter(member_id=member_id)
+            .distinct()
+            .values_list("clan__guild__guild_id", flat=True)
+        )
+
     async def get_member_by_discord_id(self, discord_id, include_clan=True):
         if include_clan:
             query = ClanMember.get_or_none(
@@ -165,88 +510,294 @@ class Database(object):
         )
 
     async def get_clan_members_by_guild_id(self, guild_id):
-        return await ClanMember.filter(clan__guild__guild_id=guild_id).prefetch_related(
-            "member", "clan", "clan__guild"
-        )
-
-    async def get_clan_member_by_platform(self, member_id, platform_id, clan_ids):
-        if platform_id == constants.PLATFORM_PSN:
-            query = ClanMember.get(clan_id__in=clan_ids, member__psn_id=member_id)
-        elif platform_id == constants.PLATFORM_XBOX:
-            query = ClanMember.get(clan_id__in=clan_ids, member__xbox_id=member_id)
-        elif platform_id == constants.PLATFORM_BLIZZARD:
-            query = ClanMember.get(clan_id__in=clan_ids, member__blizzard_id=member_id)
-        elif platform_id == constants.PLATFORM_STEAM:
-            query = ClanMember.get(clan_id__in=clan_ids, member__steam_id=member_id)
-        elif platform_id == constants.PLATFORM_STADIA:
-            query = ClanMember.get(clan_id__in=clan_ids, member__stadia_id=member_id)
-        return await query.prefetch_related("member")
+        rows = await self.fetch("clan_members_by_guild", guild_id)
+        return [clan_member_record(row) for row in rows]
 
     async def get_clans_by_guild(self, guild_id):
-        return await Clan.filter(guild__guild_id=guild_id).prefetch_related("guild")
+        rows = await self.fetch("clans_by_guild", guild_id)
+        return [ClanRecord(*row) for row in rows]
 
     async def get_clan_members_active(self, clan_db, **kwargs):
         if not kwargs:
             kwargs = dict(hours=1)
         return await ClanMember.filter(
-            last_active__gt=timezone.now() - timedelta(**kwargs), clan=clan_db
+            last_active__gt=timezone.now() - timedelta(**kwargs), clan_id=clan_db.id
         ).prefetch_related("member")
 
     async def get_clan_members_inactive(self, clan_db, **kwargs):
         if not kwargs:
             kwargs = dict(days=30)
         return await ClanMember.filter(
-            last_active__lt=timezone.now() - timedelta(**kwargs), clan=clan_db
+            last_active__lt=timezone.now() - timedelta(**kwargs), clan_id=clan_db.id
         ).prefetch_related("member")
 
+    async def get_inactive_report(self, clan_id, **kwargs):
+        """Clan members inactive longer than kwargs (a timedelta), least active first"""
+        if not kwargs:
+            kwargs = dict(days=30)
+        rows = await self.fetch("inactive_clan_members", clan_id, timedelta(**kwargs))
+        return [InactiveMemberRecord(*row) for row in rows]
+
     async def create_game(self, game):
-        retval = None
-        game_db, is_created = await Game.get_or_create(**vars(game))
-        if is_created:
-            log.info(f"Game {game.instance_id} created")
-            retval = game_db
-        return retval
+        _, rows = await self.ingest.execute_query(
+            QUERIES["create_game"],
+            [game.mode_id, game.instance_id, game.date, game.reference_id],
+        )
+        if not rows:
+            return None
+        await self.mark_game_month_dirty(self.ingest, game.date)
+        log.info(f"Game {game.instance_id} created")
+        return Game(
+            id=rows[0]["id"],
+            mode_id=game.mode_id,
+            instance_id=game.instance_id,
+            date=game.date,
+            reference_id=game.reference_id,
+        )
 
     async def create_clan_game(self, game_db, game, clan_id):
-        data = dict(clan_id=clan_id, game=game_db)
-        _, is_created = await ClanGame.get_or_create(**data)
-        if is_created:
-            tasks = [
-                self.create_game_member(player, game_db, clan_id)
+        # Resolve players before taking an ingest connection so the transaction
+        # only covers the writes
+        clanmember_dbs = await self.get_clan_members_by_platforms(
+            [
+                (player.membership_type, player.membership_id)
                 for player in game.clan_players
-            ]
-            await asyncio.gather(*tasks)
+            ],
+            [clan_id],
+        )
+        players = []
+        for player in game.clan_players:
+            membership = (player.membership_type, player.membership_id)
+            if membership in clanmember_dbs:
+                players.append((clanmember_dbs[membership].member_id, player))
+        async with self.transaction() as conn:
+            _, rows = await conn.execute_query(
+                QUERIES["create_clan_game"], [clan_id, game_db.id]
+            )
+            if rows:
+                await self.upsert_game_members(game_db, players, conn)
+
+    async def mark_game_month_dirty(self, conn, game_date):
+        # Maintenance only rolls up months before the retention horizon, so
+        # newer games can skip the round trip
+        horizon = retention_horizon(self.game_retention_months)
+        if game_date.date() >= horizon:
+            return
+        await conn.execute_query(QUERIES["mark_game_month_dirty"], [game_date])
+
+    async def update_last_active(self, last_active):
+        """Write last active dates keyed by clan member id in one statement"""
+        if not last_active:
+            return
+        await self.ingest.execute_query(
+            QUERIES["update_last_active"],
+            [list(last_active.keys()), list(last_active.values())],
+        )
+
+    async def upsert_game_members(self, game_db, players, conn=None):
+        """Insert or update game members from a list of (member id, player) tuples"""
+        # A player shows up once per session in a game, so drop/re-join events are
+        # folded together here since ON CONFLICT can't touch the same row twice
+        time_played = {}
+        completed = {}
+        for member_id, player in players:
+            time_played[member_id] = time_played.get(member_id, 0) + (
+                player.time_played or 0
+            )
+            completed[member_id] = completed.get(member_id, False) or player.completed
+
+        member_ids = list(time_played.keys())
+        conn = conn or self.ingest
+        await self.mark_game_month_dirty(conn, game_db.date)
+        await conn.execute_query(
+            QUERIES["upsert_game_members"],
+            [
+                game_db.id,
+                game_db.date,
+                member_ids,
+                [time_played[member_id] for member_id in member_ids],
+                [completed[member_id] for member_id in member_ids],
+            ],
+        )
+
+        for _, player in players:
+            log.info(
+                f"Player {member_hash(player)} created in game id {game_db.instance_id}"
+            )
+
+    async def get_game_partition_months(self):
+        conn = self.ingest
+        _, rows = await conn.execute_query(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'game'"
+        )
+        months = []
+        for row in rows:
+            match = PARTITION_NAME_RE.match(row["relname"])
+            if match:
+                months.append(date(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months)
 
-    async def create_game_member(self, player, game_db, clan_id, player_db=None):
-        if not player_db:
-            clanmember_db = await self.get_clan_member_by_platform(
-                player.membership_id, player.membership_type, [clan_id]
+    async def get_game_default_months(self):
+        """Months with games in the default partitions
+
+        Those are games for detached months, or older than the first partition.
+        """
+        _, rows = await self.ingest.execute_query(
+            "SELECT DISTINCT date_trunc('month', date)::date AS month FROM game_default"
+        )
+        return sorted([row["month"] for row in rows])
+
+    async def archive_games(self, conn, table, month):
+        next_month = add_months(month, 1)
+        await conn.execute_query(
+            f"INSERT INTO gamearchive (instance_id, date) "
+            f'SELECT instance_id, date FROM "{table}" '
+            f"WHERE date >= $1::date AND date < $2::date "
+            f"ON CONFLICT DO NOTHING",
+            [month, next_month],
+        )
+
+    async def create_game_partitions(self, start, count):
+        conn = self.ingest
+        for i in range(count):
+            month = add_months(month_start(start), i)
+            next_month = add_months(month, 1)
+            for table in PARTITIONED_GAME_TABLES:
+                await conn.execute_script(
+                    f'CREATE TABLE IF NOT EXISTS "{partition_name(table, month)}" '
+                    f"PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+                )
+
+    async def insert_game_rollups(
+        self, conn, month, mode_ids, game_table, member_table
+    ):
+        next_month = add_months(month, 1)
+
+        # Counts of all games per mode, as used by "clan games"
+        await conn.execute_query(
+            f"INSERT INTO gamerollup (month, mode_id, count, member_id) "
+            f'SELECT $1::date, mode_id, COUNT(*), NULL FROM "{game_table}" '
+            f"WHERE date >= $1::date AND date < $2::date "
+            f"GROUP BY mode_id",
+            [month, next_month],
+        )
+
+        # Counts of games per mode for each member, as used by "member games"
+        await conn.execute_query(
+            f"INSERT INTO gamerollup (month, mode_id, count, member_id) "
+            f"SELECT $1::date, g.mode_id, COUNT(DISTINCT g.id), gm.member_id "
+            f'FROM "{game_table}" g JOIN "{member_table}" gm ON gm.game_id = g.id '
+            f"WHERE g.date >= $1::date AND g.date < $2::date "
+            f"GROUP BY g.mode_id, gm.member_id",
+            [month, next_month],
+        )
+
+        # Sherpa time for each member, split by sherpa. Only the longest playing
+        # sherpa of each game is credited with the time so the sum over all
+        # sherpas matches the live query, which takes the max per game.
+        await conn.execute_query(
+            f"WITH ranked AS ("
+            f"  SELECT gm.member_id, s.member_id AS sherpa_id, s.time_played,"
+            f"    ROW_NUMBER() OVER ("
+            f"      PARTITION BY gm.member_id, gm.game_id"
+            f"      ORDER BY s.time_played DESC, s.member_id"
+            f"    ) AS rank"
+            f'  FROM "{member_table}" gm'
+            f'  JOIN "{game_table}" g ON g.id = gm.game_id'
+            f'  JOIN "{member_table}" s'
+            f"    ON s.game_id = gm.game_id AND s.member_id <> gm.member_id"
+            f"  WHERE g.mode_id = ANY($3::int[])"
+            f"    AND g.date >= $1::date AND g.date < $2::date"
+            f"    AND gm.time_played IS NOT NULL"
+            f"    AND s.time_played IS NOT NULL"
+            f"    AND s.member_id IN (SELECT member_id FROM clanmember WHERE is_sherpa)"
+            f") "
+            f"INSERT INTO sherpatimerollup (month, sherpa_time, member_id, sherpa_id) "
+            f"SELECT $1::date, SUM(CASE WHEN rank = 1 THEN time_played ELSE 0 END), "
+            f"member_id, sherpa_id FROM ranked GROUP BY member_id, sherpa_id",
+            [month, next_month, list(mode_ids)],
+        )
+
+    async def mark_rolled_up(self, conn, month):
+        # Done before reading the games, so a game ingested while the rollup runs
+        # waits on this row and marks the month dirty again afterwards
+        await conn.execute_query(
+            "INSERT INTO gamepartition (month, rolled_up, dirty) VALUES ($1, now(), false) "
+            "ON CONFLICT (month) DO UPDATE SET rolled_up = EXCLUDED.rolled_up, dirty = false",
+            [month],
+        )
+
+    async def rollup_game_partition(self, month, mode_ids):
+        async with self.transaction() as conn:
+            await self.mark_rolled_up(conn, month)
+            await conn.execute_query("DELETE FROM gamerollup WHERE month = $1", [month])
+            await conn.execute_query(
+                "DELETE FROM sherpatimerollup WHERE month = $1", [month]
             )
-            player_db = clanmember_db.member
-        try:
-            # Create the game member
-            await GameMember.create(
-                member=player_db,
-                game=game_db,
-                completed=player.completed,
-                time_played=player.time_played,
+            await self.insert_game_rollups(
+                conn,
+                month,
+                mode_ids,
+                partition_name("game", month),
+                partition_name("gamemember", month),
             )
-        except IntegrityError:
-            # If one already exists, we can assume this is due to a drop/re-join event so
-            # increment the time played and set the completion flag
-            game_member_db = await GameMember.get(game=game_db, member=player_db)
-            game_member_db.time_played += player.time_played
-
-            if (
-                not game_member_db.completed
-                or game_member_db.completed != player.completed
-            ):
-                game_member_db.completed = player.completed
-            await game_member_db.save()
-
-        log.info(
-            f"Player {member_hash(player)} created in game id {game_db.instance_id}"
+        log.info(f"Rolled up game partitions for {month.strftime('%Y-%m')}")
+
+    async def rollup_game_default(self, month, mode_ids):
+        """Add games in the default partitions for a month without its own to its rollups
+
+        Games are only added once, the archive stops them from being ingested
+        into the default partitions again after they are moved out of there.
+        """
+        next_month = add_months(month, 1)
+        async with self.transaction() as conn:
+            await self.mark_rolled_up(conn, month)
+            await self.insert_game_rollups(
+                conn, month, mode_ids, "game_default", "gamemember_default"
+            )
+            await self.archive_games(conn, "game_default", month)
+            for table in reversed(PARTITIONED_GAME_TABLES):
+                await conn.execute_query(
+                    f'DELETE FROM "{table}_default" '
+                    f"WHERE date >= $1::date AND date < $2::date",
+                    [month, next_month],
+                )
+        log.info(f"Rolled up default partition games for {month.strftime('%Y-%m')}")
+
+    async def detach_game_partition(self, month):
+        async with self.transaction() as conn:
+            await self.archive_games(conn, partition_name("game", month), month)
+            for table in reversed(PARTITIONED_GAME_TABLES):
+                await conn.execute_script(
+                    f'ALTER TABLE {table} DETACH PARTITION "{partition_name(table, month)}"'
+                )
+            await conn.execute_query(
+                "UPDATE gamepartition SET detached = now() WHERE month = $1", [month]
+            )
+        log.info(f"Detached game partitions for {month.strftime('%Y-%m')}")
+
+    async def get_game_partition_state(self):
+        return {partition.month: partition for partition in await GamePartition.all()}
+
+    async def get_rollup_horizon(self):
+        """Return the start of the first month that has not been rolled up, if any.
+
+        Live game queries must be limited to dates on or after the horizon, which
+        also lets Postgres prune the partitions that are covered by the rollups.
+        """
+        partition = (
+            await GamePartition.filter(rolled_up__not_isnull=True)
+            .order_by("-month")
+            .first()
         )
+        if not partition:
+            return None
+        month = add_months(partition.month, 1)
+        return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
 
     async def close(self):
         await Tortoise.close_connections()
@@ -0,0 +1,231 @@
+# pylama:ignore=E203
+import asyncio
+import functools
+import inspect
+import logging
+import time
+
+from aiohttp import ClientError
+from arq import Retry
+from datetime import datetime, timezone
+from prometheus_client import Counter, Gauge, Histogram
+from pydest.pydest import PydestException
+from pyrate_limiter import BucketFullException
+
+from seraphsix import constants
+from seraphsix.errors import MaintenanceError, PrivateHistoryError
+from seraphsix.models import serializer
+from seraphsix.models.records import DeadLetterRecord
+
+log = logging.getLogger(__name__)
+
+JOB_BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200]
+
+JOBS_RUNNING = Gauge(
+    "seraphsix_arq_jobs_running", "Jobs currently running in this worker", ["function"]
+)
+JOB_RESULTS = Counter(
+    "seraphsix_arq_jobs",
+    "Finished job tries by function and result",
+    ["function", "result"],
+)
+JOB_QUEUE_SECONDS = Histogram(
+    "seraphsix_arq_job_queue_seconds",
+    "Time between a job becoming due and a worker starting it",
+    ["function"],
+    buckets=JOB_BUCKETS,
+)
+JOB_SECONDS = Histogram(
+    "seraphsix_arq_job_seconds",
+    "Time spent running a job",
+    ["function"],
+    buckets=JOB_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "seraphsix_arq_queue_depth", "Queued jobs by queue and state", ["queue", "state"]
+)
+QUEUED_JOBS = Gauge(
+    "seraphsix_arq_queued_jobs", "Jobs waiting in the queues by function", ["function"]
+)
+QUEUE_LAG = Gauge(
+    "seraphsix_arq_queue_lag_seconds",
+    "Age of the oldest job that is due but not yet started, by queue",
+    ["queue"],
+)
+JOBS_DEAD_LETTERED = Counter(
+    "seraphsix_arq_jobs_dead_lettered",
+    "Jobs that ran out of retries by error",
+    ["function", "error"],
+)
+DEAD_LETTERS = Gauge(
+    "seraphsix_arq_dead_letters", "Jobs waiting in the dead letter store"
+)
+
+# Empties the queued job counts once every queue is empty, jobs dropped by arq
+# without running, e.g. expired ones, would otherwise be counted forever
+RESET_QUEUED_JOBS_SCRIPT = """
+for i = 2, #KEYS do
+    if redis.call("ZCARD", KEYS[i]) > 0 then
+        return 0
+    end
+end
+return redis.call("DEL", KEYS[1])
+"""
+
+# Errors worth trying the whole job again for, as (errors, retries, defer
+# seconds). Anything else goes straight to the dead letter store.
+RETRY_BUDGETS = [
+    (
+        MaintenanceError,
+        constants.MAINTENANCE_RETRIES,
+        constants.MAINTENANCE_RETRY_SECONDS,
+    ),
+    (
+        (PydestException, BucketFullException, ClientError, asyncio.TimeoutError),
+        constants.API_ERROR_RETRIES,
+        constants.API_ERROR_RETRY_SECONDS,
+    ),
+]
+
+
+def instrument(function):
+    """Record run counts, queue wait and run time for a worker function"""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    async def wrapper(ctx, *args, **kwargs):
+        start = time.time()
+        JOB_QUEUE_SECONDS.labels(function=name).observe(
+            max(start - ctx["score"] / 1000, 0)
+        )
+        JOBS_RUNNING.labels(function=name).inc()
+        # Cron jobs aren't queued through enqueue_jobs, so aren't counted
+        counted = not ctx["job_id"].startswith("cron:")
+        if counted:
+            await ctx["redis_jobs"].hincrby(constants.QUEUED_JOBS_KEY, name, -1)
+        result = "failure"
+        try:
+            retval = await function(ctx, *args, **kwargs)
+            result = "success"
+            return retval
+        except (Retry, asyncio.CancelledError) as e:
+            # Retried, timed out or aborted jobs go back on the queue
+            if isinstance(e, Retry):
+                result = "retry"
+            else:
+                result = "cancelled"
+            if counted:
+                await ctx["redis_jobs"].hincrby(constants.QUEUED_JOBS_KEY, name, 1)
+            raise
+        finally:
+            JOBS_RUNNING.labels(function=name).dec()
+            JOB_SECONDS.labels(function=name).observe(time.time() - start)
+            JOB_RESULTS.labels(function=name, result=result).inc()
+
+    return wrapper
+
+
+def retry_budget(error):
+    for errors, retries, defer in RETRY_BUDGETS:
+        if isinstance(error, errors):
+            return retries, defer
+    return 0, 0
+
+
+def job_retries_key(job_id):
+    return f"job-retries-{job_id}"
+
+
+def dead_letter(function):
+    """Retry failed jobs within the budget for their error, then dead letter them
+
+    Attempts are counted per error class and job id, apart from arq's job_try
+    which also counts cancellations. Jobs on their last arq try are dead
+    lettered whatever their budget, arq would drop them otherwise.
+    """
+    name = function.__qualname__
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    async def wrapper(ctx, *args, **kwargs):
+        try:
+            retval = await function(ctx, *args, **kwargs)
+        except (Retry, PrivateHistoryError):
+            # Private history is cached by the activity tasks, replaying won't help
+            raise
+        except Exception as e:
+            redis = ctx["redis_jobs"]
+            job_id = ctx["job_id"]
+            error = type(e).__name__
+            retries, defer = retry_budget(e)
+
+            tr = redis.multi_exec()
+            tr.hincrby(job_retries_key(job_id), error, 1)
+            tr.expire(job_retries_key(job_id), constants.JOB_RETRIES_SECONDS)
+            attempts, _ = await tr.execute()
+            if attempts <= retries and ctx["job_try"] < constants.ARQ_MAX_TRIES:
+                log.info(
+                    f"Retrying {name} job {job_id} in {defer}s after {error}, "
+                    f"attempt {attempts} of {retries}"
+                )
+                raise Retry(defer=defer)
+
+            record = DeadLetterRecord(
+                name,
+                list(args),
+                kwargs,
+                error,
+                str(e) or repr(e),
+                attempts,
+                datetime.now(tz=timezone.utc),
+                signature.bind_partial(ctx, *args, **kwargs).arguments.get("guild_id"),
+            )
+            tr = redis.multi_exec()
+            tr.hset(constants.DEAD_LETTER_KEY, job_id, serializer(record))
+            tr.delete(job_retries_key(job_id))
+            await tr.execute()
+            JOBS_DEAD_LETTERED.labels(function=name, error=error).inc()
+            log.error(f"Dead lettered {name} job {job_id} after {attempts} {error}")
+            raise
+        else:
+            # Recurring jobs reuse their ids, failures of earlier runs don't count.
+            # Only earlier tries can have left a count behind.
+            if ctx["job_try"] > 1:
+                await ctx["redis_jobs"].delete(job_retries_key(ctx["job_id"]))
+            return retval
+
+    return wrapper
+
+
+async def collect_queue_metrics(redis, queue_names):
+    # Counts and the head of each queue only, walking a queue holding a large
+    # backfill would block redis for everyone
+    now = int(time.time() * 1000)
+    tr = redis.multi_exec()
+    for queue_name in queue_names:
+        tr.zcount(queue_name, max=now)
+        tr.zcount(queue_name, min=now, exclude=redis.ZSET_EXCLUDE_MIN)
+        tr.zrange(queue_name, 0, 0, withscores=True)
+    tr.hgetall(constants.QUEUED_JOBS_KEY, encoding="utf-8")
+    *results, queued = await tr.execute()
+
+    total = 0
+    for index, queue_name in enumerate(queue_names):
+        ready, deferred, head = results[index * 3 : index * 3 + 3]
+        total += ready + deferred
+        QUEUE_DEPTH.labels(queue=queue_name, state="ready").set(ready)
+        QUEUE_DEPTH.labels(queue=queue_name, state="deferred").set(deferred)
+        lag = 0
+        if head and head[0][1] <= now:
+            lag = (now - head[0][1]) / 1000
+        QUEUE_LAG.labels(queue=queue_name).set(lag)
+
+    if queued and not total:
+        await redis.eval(
+            RESET_QUEUED_JOBS_SCRIPT,
+            keys=[constants.QUEUED_JOBS_KEY] + list(queue_names),
+        )
+    QUEUED_JOBS.clear()
+    for function, count in queued.items():
+        QUEUED_JOBS.labels(function=function).set(max(int(count), 0))
+    DEAD_LETTERS.set(await redis.hlen(constants.DEAD_LETTER_KEY))
@@ -0,0 +1,212 @@
+# pylama:ignore=E203
+import aiohttp
+import asyncio
+import fcntl
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zipfile
+
+from contextlib import closing
+from pydest.pydest import PydestException
+
+from seraphsix import constants
+from seraphsix.models import deserializer, serializer
+from seraphsix.tasks.core import execute_pydest
+
+log = logging.getLogger(__name__)
+
+# The index file starts with the length of the packed hash index, followed by
+# the index itself and then the raw definition json the index points into
+HEADER = struct.Struct("<Q")
+
+
+def build_index(sqlite_path, index_path, definitions):
+    """Copy the given definition tables out of a manifest database"""
+    index = []
+    data_path = f"{index_path}.data"
+    offset = 0
+    with closing(sqlite3.connect(sqlite_path)) as conn, open(data_path, "wb") as data:
+        for definition in definitions:
+            entries = []
+            for row_id, row_json in conn.execute(f"SELECT id, json FROM {definition}"):
+                blob = row_json.encode("utf-8")
+                # Ids are stored as signed 32 bit ints, hashes are unsigned
+                entries.append([row_id & 0xFFFFFFFF, offset, len(blob)])
+                data.write(blob)
+                offset += len(blob)
+            index.append([definition, entries])
+
+    packed_index = serializer(index)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "wb") as f, open(data_path, "rb") as data:
+        f.write(HEADER.pack(len(packed_index)))
+        f.write(packed_index)
+        while chunk := data.read(1024 * 1024):
+            f.write(chunk)
+    os.remove(data_path)
+    os.replace(tmp_path, index_path)
+
+
+def extract_and_build(zip_path, index_path, definitions):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with zipfile.ZipFile(zip_path) as zip_ref:
+            (member,) = zip_ref.namelist()
+            sqlite_path = zip_ref.extract(member, tmp_dir)
+        build_index(sqlite_path, index_path, definitions)
+
+
+class Manifest(object):
+    """Destiny manifest definitions kept in a local memory-mapped file.
+
+    Nothing is loaded until the first lookup, after that the version is checked
+    again at most hourly and the manifest is only downloaded when Bungie
+    publishes a new one. Processes on a host map the same file, so the
+    definitions are held once in the page cache, the hash index is loaded by
+    every process.
+    """
+
+    def __init__(self, destiny, path, definitions=constants.MANIFEST_DEFINITIONS):
+        self.destiny = destiny
+        self.path = path
+        self.definitions = definitions
+        self.version = None
+        self.mmap = None
+        self.data_offset = 0
+        self.index = {}
+        self.checked = 0
+        self.lock = asyncio.Lock()
+
+    def index_path(self, version):
+        return os.path.join(self.path, f"manifest-{version}.bin")
+
+    async def get_version(self, redis):
+        cached = await redis.get(constants.MANIFEST_VERSION_KEY)
+        if cached:
+            return deserializer(cached)
+
+        data = await execute_pydest(
+            self.destiny.api.get_destiny_manifest, return_type=None
+        )
+        if data["ErrorCode"] != 1:
+            raise PydestException("Could not retrieve Manifest from Bungie.net")
+        version = data["Response"]["version"]
+        url = data["Response"]["mobileWorldContentPaths"]["en"]
+        await redis.set(
+            constants.MANIFEST_VERSION_KEY,
+            serializer([version, url]),
+            expire=constants.TIME_HOUR_SECONDS,
+        )
+        return version, url
+
+    async def download(self, url, zip_path):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"https://www.bungie.net{url}") as response:
+                response.raise_for_status()
+                with open(zip_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(1024 * 1024):
+                        f.write(chunk)
+
+    async def build(self, version, url, index_path):
+        # Worker processes share the manifest directory, the first one to take
+        # the lock downloads and builds, the others find the index afterwards
+        loop = asyncio.get_event_loop()
+        with open(os.path.join(self.path, "manifest.lock"), "w") as lock:
+            await loop.run_in_executor(None, fcntl.flock, lock, fcntl.LOCK_EX)
+            if os.path.isfile(index_path):
+                return
+
+            log.info(f"Downloading Destiny manifest version {version}")
+            zip_path = f"{index_path}.zip"
+            try:
+                await self.download(url, zip_path)
+                await loop.run_in_executor(
+                    None, extract_and_build, zip_path, index_path, self.definitions
+                )
+            finally:
+                if os.path.isfile(zip_path):
+                    os.remove(zip_path)
+
+    async def update(self, redis):
+        version, url = await self.get_version(redis)
+        if version == self.version:
+            return
+
+        index_path = self.index_path(version)
+        if not os.path.isfile(index_path):
+            os.makedirs(self.path, exist_ok=True)
+            await self.build(version, url, index_path)
+
+        self.load(index_path)
+        self.version = version
+        log.info(f"Loaded Destiny manifest version {version}")
+        self.remove_old(index_path)
+
+    def remove_old(self, index_path):
+        # Processes still mapping an old file keep it until they unmap it
+        current = os.path.basename(index_path)
+        for name in os.listdir(self.path):
+            if (
+                name.startswith("manifest-")
+                and name.endswith(".bin")
+                and name != current
+            ):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+                else:
+                    log.info(f"Removed old Destiny manifest {name}")
+
+    async def ensure(self, redis):
+        """Load the manifest on first use and pick up new versions hourly"""
+        if (
+            self.version
+            and time.monotonic() - self.checked < constants.TIME_HOUR_SECONDS
+        ):
+            return
+        async with self.lock:
+            if (
+                self.version
+                and time.monotonic() - self.checked < constants.TIME_HOUR_SECONDS
+            ):
+                return
+            await self.update(redis)
+            self.checked = time.monotonic()
+
+    def load(self, index_path):
+        with open(index_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (index_length,) = HEADER.unpack_from(mapped, 0)
+        index = deserializer(mapped[HEADER.size : HEADER.size + index_length])
+
+        old_mmap = self.mmap
+        self.mmap = mapped
+        self.data_offset = HEADER.size + index_length
+        self.index = {
+            definition: {
+                hash_id: (offset, length) for hash_id, offset, length in entries
+            }
+            for definition, entries in index
+        }
+        if old_mmap:
+            old_mmap.close()
+
+    def decode(self, hash_id, definition):
+        """Definition json for a hash, or None if the hash isn't known"""
+        try:
+            offset, length = self.index[definition][int(hash_id) & 0xFFFFFFFF]
+        except KeyError:
+            return None
+        start = self.data_offset + offset
+        return json.loads(self.mmap[start : start + length])
+
+    def close(self):
+        if self.mmap:
+            self.mmap.close()
+            self.mmap = None
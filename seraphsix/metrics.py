@@ -0,0 +1,47 @@
+import errno
+import logging
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+COLLECTORS = []
+
+
+def add_collector(collector):
+    """Register a coroutine that refreshes gauges right before they are served"""
+    COLLECTORS.append(collector)
+
+
+async def start_metrics_server(port, registry=REGISTRY, ports=1):
+    """Serve metrics on the first free port of `ports` starting at `port`"""
+
+    async def handle_metrics(request):
+        for collector in COLLECTORS:
+            try:
+                await collector()
+            except Exception:
+                log.exception(f"Metrics collector {collector} failed")
+        return web.Response(
+            body=generate_latest(registry),
+            headers={"Content-Type": CONTENT_TYPE_LATEST},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    for offset in range(ports):
+        site = web.TCPSite(runner, port=port + offset)
+        try:
+            await site.start()
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE or offset == ports - 1:
+                await runner.cleanup()
+                raise
+            continue
+        log.info(f"Serving metrics on port {port + offset}")
+        return runner
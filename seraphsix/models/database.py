@@ -7,6 +7,7 @@ from tortoise.fields import (
     IntField,
     CharField,
     BooleanField,
+    DateField,
     ForeignKeyRelation,
     ForeignKeyField,
     DatetimeField,
@@ -78,14 +79,7 @@ class Member(Model):
             )
         ]
 
-    # TODO: Figure out how to migrate this to Tortoise
-    #     index_names = [index.name for index in self._database.get_indexes('member')]
-    #     for platform in constants.PLATFORM_MAP.keys():
-    #         index_name = f"member_{platform}_username_lower"
-    #         if index_name not in index_names:
-    #             Member.add_index(SQL(
-    #                 f"CREATE INDEX {index_name} ON member(lower({platform}_username) varchar_pattern_ops)"
-    #             ))
+    # Case insensitive username indexes are in migrations/0003_query_plan_indexes.sql
 
 
 class Guild(Model):
@@ -151,11 +145,14 @@ class ClanMemberApplication(Model):
 
 class Game(Model):
     mode_id = IntField()
-    instance_id = BigIntField(unique=True)
+    instance_id = BigIntField()
     date = DatetimeField()
     reference_id = BigIntField(null=True)
 
     class Meta:
+        # The game table is range partitioned by month on date, so any unique
+        # constraint has to include the partition key
+        unique_together = ("instance_id", "date")
         indexes = ("mode_id", "reference_id")
 
 
@@ -169,12 +166,14 @@ class ClanGame(Model):
     )
 
     class Meta:
-        indexes = ("clan", "game")
+        unique_together = ("clan", "game")
 
 
 class GameMember(Model):
     time_played = FloatField(null=True)
     completed = BooleanField(null=True)
+    # Copy of game.date, used as the partition key for this table
+    date = DatetimeField()
 
     member: ForeignKeyRelation[Member] = ForeignKeyField(
         "seraphsix.Member", related_name="games", to_field="id"
@@ -185,7 +184,47 @@ class GameMember(Model):
     )
 
     class Meta:
-        indexes = ("member", "game")
+        # Includes the partition key, see Game
+        unique_together = ("game", "member", "date")
+        indexes = ("member",)
+
+
+class GameRollup(Model):
+    month = DateField()
+    mode_id = IntField()
+    count = IntField()
+
+    # A null member denotes the count of all games in the month
+    member: ForeignKeyRelation[Member] = ForeignKeyField(
+        "seraphsix.Member", related_name="game_rollups", to_field="id", null=True
+    )
+
+    class Meta:
+        indexes = ("month", "member")
+
+
+class SherpaTimeRollup(Model):
+    month = DateField()
+    sherpa_time = FloatField()
+
+    member: ForeignKeyRelation[Member] = ForeignKeyField(
+        "seraphsix.Member", related_name="sherpa_rollups", to_field="id"
+    )
+
+    sherpa: ForeignKeyRelation[Member] = ForeignKeyField(
+        "seraphsix.Member", related_name="sherpa_rollups_as_sherpa", to_field="id"
+    )
+
+    class Meta:
+        indexes = ("month", "member")
+
+
+class GamePartition(Model):
+    month = DateField(unique=True)
+    rolled_up = DatetimeField(null=True)
+    detached = DatetimeField(null=True)
+    # Games were ingested for the month after it was rolled up
+    dirty = BooleanField(default=False)
 
 
 class TwitterChannel(Model):
@@ -223,6 +262,9 @@ __models__ = [
     Game,
     ClanGame,
     GameMember,
+    GameRollup,
+    SherpaTimeRollup,
+    GamePartition,
     TwitterChannel,
     Role,
 ]
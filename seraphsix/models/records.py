@@ -0,0 +1,132 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from seraphsix.constants import CLAN_MEMBER_ADMIN
+
+__all__ = [
+    "ActivityRecord",
+    "CachedClanMemberRecord",
+    "CachedMemberRecord",
+    "ClanMemberRecord",
+    "ClanRecord",
+    "DeadLetterRecord",
+    "InactiveMemberRecord",
+    "MemberRecord",
+    "PermissionRecord",
+]
+
+
+# Lightweight, read-only counterparts of the Tortoise models. These are built
+# straight from asyncpg rows by the Database fast path, so field order has to
+# match the column order used in the queries.
+
+
+class MemberRecord(NamedTuple):
+    id: int
+    discord_id: Optional[int]
+    bungie_id: Optional[int]
+    bungie_username: Optional[str]
+    xbox_id: Optional[int]
+    xbox_username: Optional[str]
+    psn_id: Optional[int]
+    psn_username: Optional[str]
+    blizzard_id: Optional[int]
+    blizzard_username: Optional[str]
+    steam_id: Optional[int]
+    steam_username: Optional[str]
+    stadia_id: Optional[int]
+    stadia_username: Optional[str]
+    the100_id: Optional[int]
+    the100_username: Optional[str]
+    timezone: Optional[str]
+    is_cross_save: bool
+    primary_membership_id: Optional[int]
+
+
+class ClanRecord(NamedTuple):
+    id: int
+    clan_id: int
+    name: str
+    callsign: str
+    platform: Optional[int]
+    the100_group_id: Optional[int]
+    activity_tracking: bool
+    guild_id: int
+
+
+class ClanMemberRecord(NamedTuple):
+    id: int
+    platform_id: int
+    join_date: datetime
+    is_active: bool
+    last_active: Optional[datetime]
+    is_sherpa: bool
+    member_type: Optional[int]
+    clan_id: int
+    member_id: int
+    member: MemberRecord
+    clan: ClanRecord
+
+
+class InactiveMemberRecord(NamedTuple):
+    clanmember_id: int
+    member_id: int
+    discord_id: Optional[int]
+    last_active: datetime
+    platform_id: Optional[int]
+    membership_id: Optional[int]
+    username: Optional[str]
+
+
+class PermissionRecord(NamedTuple):
+    is_registered: bool
+    is_clan_linked: bool
+    is_clan_member: bool
+    clan_rank: Optional[int]
+
+    @property
+    def is_clan_admin(self):
+        return self.clan_rank is not None and self.clan_rank >= CLAN_MEMBER_ADMIN
+
+
+# Members as stored in the guild member cache, only what ingestion needs
+
+
+class CachedMemberRecord(NamedTuple):
+    id: int
+    discord_id: Optional[int]
+    bungie_id: Optional[int]
+    xbox_id: Optional[int]
+    psn_id: Optional[int]
+    blizzard_id: Optional[int]
+    steam_id: Optional[int]
+    stadia_id: Optional[int]
+
+
+class CachedClanMemberRecord(NamedTuple):
+    clan_id: int
+    join_date: datetime
+    member: CachedMemberRecord
+
+
+# What process_activity needs to know about an activity, everything else comes
+# from the post game carnage report
+
+
+class ActivityRecord(NamedTuple):
+    instance_id: int
+    mode_id: int
+    date: datetime
+    reference_id: int
+
+
+class DeadLetterRecord(NamedTuple):
+    function: str
+    args: list
+    kwargs: dict
+    error: str
+    reason: str
+    attempts: int
+    failed_at: datetime
+    # Picks the shard queue on replay, records written before it have none
+    guild_id: Optional[int] = None
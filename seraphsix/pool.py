@@ -0,0 +1,108 @@
+import time
+
+from tortoise.backends.asyncpg.client import AsyncpgDBClient
+
+from prometheus_client import Gauge, Histogram
+
+from seraphsix.metrics import LATENCY_BUCKETS
+
+POOL_SIZE = Gauge(
+    "seraphsix_db_pool_size", "Maximum number of connections in the pool", ["pool"]
+)
+POOL_IN_USE = Gauge(
+    "seraphsix_db_pool_in_use", "Number of connections currently checked out", ["pool"]
+)
+POOL_WAITERS = Gauge(
+    "seraphsix_db_pool_waiters",
+    "Number of tasks waiting to acquire a connection",
+    ["pool"],
+)
+POOL_ACQUIRE_SECONDS = Histogram(
+    "seraphsix_db_pool_acquire_seconds",
+    "Time spent waiting for a pool connection",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+POOL_HOLD_SECONDS = Histogram(
+    "seraphsix_db_pool_hold_seconds",
+    "Time a connection is held before release",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+QUERY_SECONDS = Histogram(
+    "seraphsix_db_query_seconds",
+    "Time spent executing a query",
+    ["pool", "query"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class InstrumentedPool(object):
+    """Wraps an asyncpg pool to record acquire latency, waiters and in-use counts.
+
+    Tortoise acquires every connection (plain queries and transactions alike)
+    through `pool.acquire()`/`pool.release()`, so this sees all pool traffic.
+    """
+
+    def __init__(self, pool, name, max_size):
+        self.pool = pool
+        self.name = name
+        self.acquired_at = {}
+        POOL_SIZE.labels(pool=name).set(max_size)
+
+    async def acquire(self, *, timeout=None):
+        POOL_WAITERS.labels(pool=self.name).inc()
+        start = time.perf_counter()
+        try:
+            connection = await self.pool.acquire(timeout=timeout)
+        finally:
+            POOL_WAITERS.labels(pool=self.name).dec()
+        now = time.perf_counter()
+        POOL_ACQUIRE_SECONDS.labels(pool=self.name).observe(now - start)
+        POOL_IN_USE.labels(pool=self.name).inc()
+        self.acquired_at[id(connection)] = now
+        return connection
+
+    async def release(self, connection, *, timeout=None):
+        acquired_at = self.acquired_at.pop(id(connection), None)
+        if acquired_at is not None:
+            POOL_HOLD_SECONDS.labels(pool=self.name).observe(
+                time.perf_counter() - acquired_at
+            )
+        try:
+            await self.pool.release(connection, timeout=timeout)
+        finally:
+            POOL_IN_USE.labels(pool=self.name).dec()
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+
+class InstrumentedAsyncpgDBClient(AsyncpgDBClient):
+    async def create_connection(self, with_db):
+        await super().create_connection(with_db)
+        self._pool = InstrumentedPool(
+            self._pool, self.connection_name, self._template["max_size"]
+        )
+
+    async def execute_query(self, query, values=None):
+        start = time.perf_counter()
+        try:
+            return await super().execute_query(query, values)
+        finally:
+            QUERY_SECONDS.labels(pool=self.connection_name, query="orm").observe(
+                time.perf_counter() - start
+            )
+
+    async def execute_query_dict(self, query, values=None):
+        start = time.perf_counter()
+        try:
+            return await super().execute_query_dict(query, values)
+        finally:
+            QUERY_SECONDS.labels(pool=self.connection_name, query="orm").observe(
+                time.perf_counter() - start
+            )
+
+
+# Tortoise loads the client from the engine module's `client_class`
+client_class = InstrumentedAsyncpgDBClient
@@ -0,0 +1,40 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+CLAN_APPLICATION = "clan-application"
+
+
+class ReactionDispatcher(object):
+    """Routes raw reaction events to handlers by message id.
+
+    Only messages that have been tracked are of interest, every other reaction
+    is dropped before anything else is looked at.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.messages = {}
+
+    def register(self, kind, handler, emojis):
+        self.handlers[kind] = (set(emojis), handler)
+
+    def track(self, message_id, kind):
+        self.messages[message_id] = kind
+
+    def untrack(self, message_id):
+        self.messages.pop(message_id, None)
+
+    def warm(self, message_ids, kind):
+        for message_id in message_ids:
+            self.track(message_id, kind)
+        log.info(f"Tracking reactions on {len(message_ids)} {kind} messages")
+
+    async def dispatch(self, bot, payload):
+        try:
+            kind = self.messages[payload.message_id]
+        except KeyError:
+            return
+        emojis, handler = self.handlers[kind]
+        if payload.emoji.name in emojis:
+            await handler(bot, payload)
@@ -0,0 +1,135 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+
+from arq import Retry
+from arq.constants import retry_key_prefix
+from collections import deque
+from contextvars import ContextVar
+from prometheus_client import Counter, Gauge, Histogram
+
+from seraphsix import constants
+from seraphsix.metrics import LATENCY_BUCKETS
+
+log = logging.getLogger(__name__)
+
+API_REQUESTS = Counter(
+    "seraphsix_destiny_api_requests", "Destiny API requests made per guild", ["guild"]
+)
+API_WAIT_SECONDS = Histogram(
+    "seraphsix_destiny_api_wait_seconds",
+    "Time spent waiting for a Destiny API token",
+    ["guild"],
+    buckets=LATENCY_BUCKETS,
+)
+API_WAITERS = Gauge(
+    "seraphsix_destiny_api_waiters",
+    "Requests waiting for a Destiny API token",
+    ["guild"],
+)
+GUILD_JOBS = Gauge("seraphsix_guild_jobs_running", "Jobs running per guild", ["guild"])
+GUILD_JOBS_DEFERRED = Counter(
+    "seraphsix_guild_jobs_deferred",
+    "Jobs pushed back because their guild was busy",
+    ["guild"],
+)
+
+# Guild the running job works for, requests made outside of a job have none
+current_guild = ContextVar("current_guild", default=None)
+
+
+class FairScheduler(object):
+    """Shares the Destiny API budget and worker job slots between guilds.
+
+    API tokens are handed out at `rate` per second using deficit round robin
+    over the guilds that have requests waiting, so a guild gets tokens in
+    proportion to its weight no matter how many requests it has queued. Jobs
+    for a guild that already has `max_guild_jobs` running are deferred instead
+    of holding on to worker slots.
+    """
+
+    def __init__(self, rate, weights=None, max_guild_jobs=constants.GUILD_MAX_JOBS):
+        self.interval = 1 / rate
+        self.weights = weights or {}
+        self.max_guild_jobs = max_guild_jobs
+        self.queues = {}
+        self.deficits = {}
+        self.running = {}
+        self.dispatcher = None
+
+    def weight(self, guild_id):
+        return self.weights.get(guild_id, 1)
+
+    async def acquire(self):
+        guild_id = current_guild.get()
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(guild_id, deque()).append(waiter)
+        if not self.dispatcher or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch())
+
+        start = time.monotonic()
+        API_WAITERS.labels(guild=guild_id).inc()
+        try:
+            await waiter
+        finally:
+            API_WAITERS.labels(guild=guild_id).dec()
+        API_WAIT_SECONDS.labels(guild=guild_id).observe(time.monotonic() - start)
+        API_REQUESTS.labels(guild=guild_id).inc()
+
+    async def dispatch(self):
+        while self.queues:
+            for guild_id in list(self.queues.keys()):
+                queue = self.queues[guild_id]
+                self.deficits[guild_id] = self.deficits.get(guild_id, 0) + self.weight(
+                    guild_id
+                )
+                while queue and self.deficits[guild_id] >= 1:
+                    waiter = queue.popleft()
+                    if waiter.done():
+                        # The waiting job was cancelled or timed out
+                        continue
+                    waiter.set_result(None)
+                    self.deficits[guild_id] -= 1
+                    await asyncio.sleep(self.interval)
+                if not queue:
+                    # Idle guilds don't get to save up credit
+                    del self.queues[guild_id]
+                    del self.deficits[guild_id]
+
+    def job(self, function):
+        """Run a worker function under the guild named by its guild_id argument"""
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        async def wrapper(ctx, *args, **kwargs):
+            arguments = signature.bind_partial(ctx, *args, **kwargs).arguments
+            guild_id = arguments.get("guild_id")
+            if guild_id is None:
+                return await function(ctx, *args, **kwargs)
+
+            if self.running.get(guild_id, 0) >= self.max_guild_jobs:
+                GUILD_JOBS_DEFERRED.labels(guild=guild_id).inc()
+                # Waiting for a busy guild isn't a failed try, hand back the try
+                # arq counted when it picked the job up
+                await ctx["redis"].decr(retry_key_prefix + ctx["job_id"])
+                waited = time.time() - ctx["enqueue_time"].timestamp()
+                raise Retry(
+                    defer=min(
+                        max(waited / 10, constants.GUILD_JOB_DEFER_SECONDS),
+                        constants.GUILD_JOB_DEFER_SECONDS * 10,
+                    )
+                )
+
+            self.running[guild_id] = self.running.get(guild_id, 0) + 1
+            GUILD_JOBS.labels(guild=guild_id).inc()
+            token = current_guild.set(guild_id)
+            try:
+                return await function(ctx, *args, **kwargs)
+            finally:
+                current_guild.reset(token)
+                self.running[guild_id] -= 1
+                GUILD_JOBS.labels(guild=guild_id).dec()
+
+        return wrapper
@@ -0,0 +1,256 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import signal
+import time
+
+from arq import Worker
+from arq.connections import create_pool
+from arq.constants import default_queue_name
+from arq.worker import get_kwargs
+
+from seraphsix import constants
+from seraphsix.tasks.config import Config
+
+log = logging.getLogger(__name__)
+config = Config()
+
+# Takes a shard if it's free or already ours, so handovers wait for the old
+# owner to release it or for its lease to run out
+CLAIM_SHARD_SCRIPT = """
+local owner = redis.call("GET", KEYS[1])
+if owner == ARGV[1] then
+    redis.call("PEXPIRE", KEYS[1], ARGV[2])
+    return 1
+elseif not owner then
+    redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_SHARD_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def ring_hash(value):
+    # Python's own hash is salted per process, every process has to agree
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_queues(shard_count=None):
+    """Every queue a worker may own, the default queue carries the cron jobs"""
+    if shard_count is None:
+        shard_count = config.worker_shards
+    return [default_queue_name] + [
+        f"{default_queue_name}:shard-{shard}" for shard in range(shard_count)
+    ]
+
+
+def shard_queue(guild_id):
+    """Queue for a guild's jobs, guilds never move between shards"""
+    if not config.worker_shards or guild_id is None:
+        return default_queue_name
+    return shard_queues()[1 + ring_hash(guild_id) % config.worker_shards]
+
+
+class HashRing(object):
+    """Consistent hash ring of worker instances.
+
+    Each instance gets a number of points on the ring and a key belongs to the
+    first point at or after its own hash, so an instance joining or leaving
+    only moves the keys next to its points. Keys assigned together are spread
+    evenly, an instance that already has its share is skipped.
+    """
+
+    def __init__(self, members, vnodes=constants.SHARD_VNODES):
+        self.points = sorted(
+            (ring_hash(f"{member}-{vnode}"), member)
+            for member in members
+            for vnode in range(vnodes)
+        )
+        self.hashes = [point for point, _ in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        index = bisect.bisect_left(self.hashes, ring_hash(key)) % len(self.points)
+        return self.points[index][1]
+
+    def assign(self, keys):
+        """Owners for a set of keys, each instance gets an equal share or one more"""
+        members = set([member for _, member in self.points])
+        if not members:
+            return {}
+
+        # Everyone is filled up to the even share first, then the keys left over
+        # go to different instances
+        share = len(keys) // len(members)
+        load = {member: 0 for member in members}
+        owners = {}
+        for cap in (share, share + 1):
+            for key in sorted(keys, key=ring_hash):
+                if key in owners:
+                    continue
+                index = bisect.bisect_left(self.hashes, ring_hash(key))
+                for step in range(len(self.points)):
+                    member = self.points[(index + step) % len(self.points)][1]
+                    if load[member] < cap:
+                        owners[key] = member
+                        load[member] += 1
+                        break
+        return owners
+
+
+class ShardedWorker(object):
+    """Runs an arq worker for each shard queue this process owns.
+
+    Processes heartbeat into a shared member set and split the shard queues
+    between themselves with a hash ring, which is recomputed on every
+    heartbeat. A shard is only polled while its lease is held, leases are given
+    up after the shard's running jobs finish or the drain timeout cancels them
+    back onto the queue.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.ctx = {}
+        self.pool = None
+        self.workers = {}
+        self.main_task = None
+        # One set of job slots for all shards, however many this process owns
+        self.sem = asyncio.BoundedSemaphore(settings.max_jobs)
+
+    @property
+    def instance_id(self):
+        return self.ctx["instance_id"]
+
+    def run(self):
+        loop = asyncio.get_event_loop()
+        self.main_task = loop.create_task(self.main())
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.main_task.cancel)
+        try:
+            loop.run_until_complete(self.main_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.run_until_complete(self.close())
+
+    async def main(self):
+        self.pool = await create_pool(
+            self.settings.redis_settings,
+            job_serializer=self.settings.job_serializer,
+            job_deserializer=self.settings.job_deserializer,
+        )
+        self.ctx["redis"] = self.pool
+        await self.settings.on_startup(self.ctx)
+        log.info(f"Starting sharded worker {self.instance_id}")
+
+        while True:
+            try:
+                await self.rebalance()
+            except Exception:
+                # Leases run out on their own if this keeps failing
+                log.exception(f"Failed to rebalance shards for {self.instance_id}")
+            await asyncio.sleep(constants.SHARD_HEARTBEAT_SECONDS)
+
+    async def heartbeat(self):
+        now = time.time()
+        tr = self.pool.multi_exec()
+        tr.zadd(constants.WORKER_MEMBERS_KEY, now, self.instance_id)
+        tr.zremrangebyscore(
+            constants.WORKER_MEMBERS_KEY, max=now - constants.SHARD_LEASE_SECONDS
+        )
+        tr.zrange(constants.WORKER_MEMBERS_KEY, encoding="utf-8")
+        _, _, members = await tr.execute()
+        return members
+
+    async def claim(self, queue_name):
+        return await self.pool.eval(
+            CLAIM_SHARD_SCRIPT,
+            keys=[f"worker-shard-{queue_name}"],
+            args=[self.instance_id, constants.SHARD_LEASE_SECONDS * 1000],
+        )
+
+    async def release(self, queue_name):
+        await self.pool.eval(
+            RELEASE_SHARD_SCRIPT,
+            keys=[f"worker-shard-{queue_name}"],
+            args=[self.instance_id],
+        )
+
+    async def rebalance(self):
+        owners = HashRing(await self.heartbeat()).assign(shard_queues())
+        owned = set(
+            [
+                queue_name
+                for queue_name, owner in owners.items()
+                if owner == self.instance_id
+            ]
+        )
+
+        lost = set(self.workers.keys()) - owned
+        for queue_name in owned:
+            if await self.claim(queue_name):
+                if queue_name not in self.workers:
+                    self.start(queue_name)
+            elif queue_name in self.workers:
+                log.warning(f"Lost the lease on {queue_name} to another worker")
+                lost.add(queue_name)
+        if lost:
+            await asyncio.gather(*[self.stop(queue_name) for queue_name in lost])
+
+    def start(self, queue_name):
+        kwargs = get_kwargs(self.settings)
+        for key in ("on_startup", "on_shutdown", "redis_settings", "cron_jobs"):
+            kwargs.pop(key, None)
+        if queue_name == default_queue_name:
+            kwargs["cron_jobs"] = self.settings.cron_jobs
+
+        worker = Worker(
+            **kwargs,
+            queue_name=queue_name,
+            redis_pool=self.pool,
+            ctx=self.ctx,
+            handle_signals=False,
+        )
+        worker.sem = self.sem
+        worker.main_task = asyncio.create_task(worker.main())
+        self.workers[queue_name] = worker
+        log.info(f"Worker {self.instance_id} started polling {queue_name}")
+
+    async def stop(self, queue_name):
+        worker = self.workers.pop(queue_name)
+        worker.main_task.cancel()
+        tasks = [task for task in worker.tasks.values() if not task.done()]
+        if tasks:
+            _, pending = await asyncio.wait(
+                tasks, timeout=constants.SHARD_DRAIN_SECONDS
+            )
+            # Cancelled jobs stay queued for whoever owns the shard next
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.pool.delete(worker.health_check_key)
+        await self.release(queue_name)
+        log.info(f"Worker {self.instance_id} stopped polling {queue_name}")
+
+    async def close(self):
+        if not self.pool:
+            return
+        await asyncio.gather(
+            *[self.stop(queue_name) for queue_name in list(self.workers.keys())]
+        )
+        if "instance_id" in self.ctx:
+            await self.pool.zrem(constants.WORKER_MEMBERS_KEY, self.instance_id)
+            await self.settings.on_shutdown(self.ctx)
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.pool = None
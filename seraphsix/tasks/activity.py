@@ -2,30 +2,46 @@ import asyncio
 import itertools
 import logging
 
-from tortoise.functions import Max, Count
+from tortoise.functions import Max, Count, Sum
 from tortoise.exceptions import DoesNotExist
 from tortoise.expressions import Subquery
 from typing import Tuple
 
 from seraphsix import constants
 from seraphsix.errors import PrivateHistoryError
-from seraphsix.models.database import ClanMember, Game, GameMember, Member
+from seraphsix.models import deserializer, serializer
+from seraphsix.models.database import (
+    ClanMember,
+    Game,
+    GameMember,
+    GameRollup,
+    Member,
+    SherpaTimeRollup,
+)
 from seraphsix.models.destiny import (
     Game as GameApi,
     ClanGame,
     DestinyProfileResponse,
     DestinyActivityResponse,
     DestinyPGCRResponse,
+    DestinyActivity,
 )
+from seraphsix.models.records import ActivityRecord
+from seraphsix.sharding import shard_queue
+from seraphsix.tasks.config import Config
 from seraphsix.tasks.core import (
+    enqueue_jobs,
     execute_pydest,
     get_cached_members,
     get_primary_membership,
+    set_inactive_report,
+    set_inactive_reports,
 )
 from seraphsix.tasks.parsing import member_hash, member_hash_db
 
 
 log = logging.getLogger(__name__)
+config = Config()
 
 
 async def get_activity_history(
@@ -86,12 +102,9 @@ async def get_pgcr(ctx, activity_id):
     return data.response
 
 
-async def decode_activity(ctx, reference_id, definition):
-    destiny = ctx["destiny"]
-    await execute_pydest(destiny.update_manifest, return_type=None)
-    return await execute_pydest(
-        destiny.decode_hash, reference_id, definition, return_type=None
-    )
+async def decode_activity(ctx, reference_id, definition="DestinyActivityDefinition"):
+    await ctx["manifest"].ensure(ctx["redis_cache"])
+    return ctx["manifest"].decode(reference_id, definition)
 
 
 async def get_activity_list(
@@ -107,12 +120,25 @@ async def get_activity_list(
         activities = await asyncio.gather(*tasks)
     except PrivateHistoryError:
         log.info(f"Member {platform_id}-{member_id} has set their account private")
+        await ctx["redis_cache"].set(
+            private_history_key(platform_id, member_id),
+            1,
+            expire=config.private_history_cache_seconds,
+        )
         all_activities = []
     else:
         all_activities = list(itertools.chain.from_iterable(activities))
     return all_activities
 
 
+def private_history_key(platform_id, member_id):
+    return f"private-history-{platform_id}-{member_id}"
+
+
+def last_active_key(platform_id, member_id):
+    return f"last-active-{platform_id}-{member_id}"
+
+
 async def get_last_active(ctx, member_db=None, platform_id=None, member_id=None):
     acct_last_active = None
     if member_db and not platform_id and not member_id:
@@ -134,33 +160,109 @@ async def get_last_active(ctx, member_db=None, platform_id=None, member_id=None)
         log.debug(
             f"Found last active date for {platform_id}-{member_id}: {acct_last_active}"
         )
+        await ctx["redis_cache"].set(
+            last_active_key(platform_id, member_id),
+            serializer(acct_last_active),
+            expire=constants.LAST_ACTIVE_CACHE_SECONDS,
+        )
     return acct_last_active
 
 
-async def save_last_active(ctx, member_id):
+async def save_last_active(ctx, member_id, guild_id=None):
     clanmember_db = await ClanMember.get(member__id=member_id).prefetch_related(
         "member"
     )
     last_active = await get_last_active(ctx, clanmember_db.member)
     clanmember_db.last_active = last_active
-    await clanmember_db.save()
+    await clanmember_db.save(using_db=ctx["database"].ingest)
+    if guild_id:
+        await set_inactive_report(ctx, guild_id, clanmember_db.clan_id)
+
+
+async def get_last_active_bounded(ctx, semaphore, platform_id, member_id):
+    async with semaphore:
+        return await get_last_active(ctx, platform_id=platform_id, member_id=member_id)
 
 
 async def store_last_active(ctx, guild_id, guild_name):
-    redis_jobs = ctx["redis_jobs"]
-    for member_db in await get_cached_members(ctx, guild_id, guild_name):
-        await redis_jobs.enqueue_job(
-            "save_last_active",
-            member_db.member.id,
-            _job_id=f"save_last_active-{member_db.member.id}",
+    """Collect last active dates for all members of a guild in one pass
+
+    Dates fetched recently, e.g. by commands, are reused. Members whose profile
+    could not be fetched are retried individually with save_last_active.
+    """
+    database = ctx["database"]
+    clanmember_dbs = await database.get_clan_members_by_guild_id(guild_id)
+    if not clanmember_dbs:
+        return
+
+    members = []
+    for clanmember_db in clanmember_dbs:
+        membership = get_primary_membership(clanmember_db.member)[:2]
+        if not membership[0]:
+            log.info(
+                f"Skipping last active collection for member {clanmember_db.member.id} "
+                f"without a supported platform"
+            )
+            continue
+        members.append((clanmember_db, membership))
+
+    cached = []
+    if members:
+        cached = await ctx["redis_cache"].mget(
+            *[last_active_key(*membership) for _, membership in members]
         )
+
+    last_active = {}
+    misses = []
+    for (clanmember_db, membership), cached_last_active in zip(members, cached):
+        if cached_last_active:
+            last_active[clanmember_db.id] = deserializer(cached_last_active)
+        else:
+            misses.append((clanmember_db, membership))
+
+    semaphore = asyncio.Semaphore(constants.LAST_ACTIVE_CONCURRENCY)
+    results = await asyncio.gather(
+        *[
+            get_last_active_bounded(ctx, semaphore, *membership)
+            for _, membership in misses
+        ],
+        return_exceptions=True,
+    )
+
+    retry_ids = []
+    for (clanmember_db, membership), result in zip(misses, results):
+        if isinstance(result, Exception):
+            log.info(f"Retrying last active collection for {membership}: {result!r}")
+            retry_ids.append(clanmember_db.member.id)
+        elif result:
+            last_active[clanmember_db.id] = result
+
+    await database.update_last_active(last_active)
     log.info(
-        f"Queued last active collection for all members of {guild_name} ({guild_id})"
+        f"Stored last active dates for {len(last_active)} members of {guild_name} ({guild_id}), "
+        f"{len(cached) - len(misses)} from cache"
     )
 
+    await set_inactive_reports(ctx, guild_id)
+
+    # Retries can be deferred for a long time, they refresh the inactive report
+    # of their clan themselves instead of being waited on here
+    if retry_ids:
+        await enqueue_jobs(
+            ctx,
+            "save_last_active",
+            [
+                (f"save_last_active-{member_id}", (member_id, guild_id))
+                for member_id in retry_ids
+            ],
+            _queue_name=shard_queue(guild_id),
+        )
+
 
 async def get_game_counts(database, game_mode, member_db=None):
+    horizon = await database.get_rollup_horizon()
     base_query = Game.annotate(count=Count("id"))
+    rollup_query = GameRollup.annotate(total=Sum("count"))
     modes = [mode_id for mode_id in constants.SUPPORTED_GAME_MODES.get(game_mode)]
 
     if member_db:
@@ -169,18 +271,40 @@ async def get_game_counts(database, game_mode, member_db=None):
             members__member__clans__clan=member_db.clan,
             mode_id__in=modes,
         )
+        if horizon:
+            query = query.filter(date__gte=horizon, members__date__gte=horizon)
+        rollup_query = rollup_query.filter(member=member_db.member, mode_id__in=modes)
     else:
         query = base_query.filter(mode_id__in=modes)
+        if horizon:
+            query = query.filter(date__gte=horizon)
+        rollup_query = rollup_query.filter(member_id__isnull=True, mode_id__in=modes)
 
     counts = {}
     for row in await query.group_by("mode_id").values("mode_id", "count"):
         game_title = constants.MODE_MAP[row["mode_id"]]["title"]
         counts[game_title] = row["count"]
+
+    # Games older than the horizon only exist as rollups
+    if horizon:
+        for row in await rollup_query.group_by("mode_id").values("mode_id", "total"):
+            game_title = constants.MODE_MAP[row["mode_id"]]["title"]
+            counts[game_title] = counts.get(game_title, 0) + row["total"]
     return counts
 
 
-async def get_sherpa_time_played(member_db: object) -> Tuple[int, list]:
+async def get_sherpa_time_played(database, member_db: object) -> Tuple[int, list]:
     await member_db.member
+    horizon = await database.get_rollup_horizon()
+
+    # Restricting on the partition key lets Postgres skip partitions which are
+    # already covered by the rollups
+    date_filter = {}
+    game_date_filter = {}
+    if horizon:
+        date_filter = dict(date__gte=horizon)
+        game_date_filter = dict(game__date__gte=horizon)
+
     clan_sherpas = ClanMember.filter(is_sherpa=True, id__not=member_db.id).only(
         "member_id"
     )
@@ -192,6 +316,8 @@ async def get_sherpa_time_played(member_db: object) -> Tuple[int, list]:
         game__mode_id__in=mode_list,
         member=member_db.member,
         time_played__not_isnull=True,
+        **date_filter,
+        **game_date_filter,
     ).only("game_id")
 
     sherpa_games = (
@@ -199,6 +325,7 @@ async def get_sherpa_time_played(member_db: object) -> Tuple[int, list]:
             game_id__in=Subquery(all_games),
             member_id__in=Subquery(clan_sherpas),
             time_played__not_isnull=True,
+            **date_filter,
         )
         .distinct()
         .only("game_id")
@@ -223,6 +350,7 @@ async def get_sherpa_time_played(member_db: object) -> Tuple[int, list]:
             game_id__in=Subquery(sherpa_games),
             member_id__in=Subquery(clan_sherpas),
             sherpa_time__not_isnull=True,
+            **date_filter,
         )
         .group_by("game_id")
         .values("game_id", "sherpa_time")
@@ -237,6 +365,8 @@ async def get_sherpa_time_played(member_db: object) -> Tuple[int, list]:
         game__mode_id__in=mode_list,
         member=member_db.member,
         time_played__not_isnull=True,
+        **date_filter,
+        **game_date_filter,
     ).only("game_id")
 
     sherpa_games = (
@@ -244,27 +374,60 @@ async def get_sherpa_time_played(member_db: object) -> Tuple[int, list]:
             game_id__in=Subquery(all_games),
             member_id__in=Subquery(clan_sherpas),
             time_played__not_isnull=True,
+            **date_filter,
         )
         .distinct()
         .only("game_id")
     )
 
-    sherpa_ids = (
+    sherpa_ids = await (
         GameMember.filter(
             game_id__in=Subquery(sherpa_games),
             member_id__in=Subquery(clan_sherpas),
             time_played__not_isnull=True,
+            **date_filter,
         )
         .distinct()
         .values_list("member__discord_id", flat=True)
     )
 
+    if horizon:
+        rollups = await SherpaTimeRollup.filter(
+            member=member_db.member
+        ).prefetch_related("sherpa")
+        for rollup in rollups:
+            total_time += rollup.sherpa_time
+            if rollup.sherpa.discord_id and rollup.sherpa.discord_id not in sherpa_ids:
+                sherpa_ids.append(rollup.sherpa.discord_id)
+
     return (total_time, sherpa_ids)
 
 
+def activity_record(activity):
+    game = GameApi(activity)
+    return ActivityRecord(game.instance_id, game.mode_id, game.date, game.reference_id)
+
+
+async def enqueue_activities(ctx, activities, guild_id, guild_name):
+    # Jobs only carry a reference to the activity rather than the whole thing
+    # with every stat value in it
+    records = [activity_record(activity) for activity in activities]
+    await enqueue_jobs(
+        ctx,
+        "process_activity",
+        [
+            (
+                f"process_activity-{record.instance_id}",
+                (list(record), guild_id, guild_name),
+            )
+            for record in records
+        ],
+        _queue_name=shard_queue(guild_id),
+    )
+
+
 async def store_all_games(ctx, guild_id, guild_name, count=30, recent=True):
     database = ctx["database"]
-    redis_jobs = ctx["redis_jobs"]
 
     try:
         clan_dbs = await database.get_clans_by_guild(guild_id)
@@ -324,16 +487,7 @@ async def store_all_games(ctx, guild_id, guild_name, count=30, recent=True):
             all_activities_dict[key] = activity
     unique_activities = list(all_activities_dict.values())
 
-    tasks = []
-    for activity in unique_activities:
-        activity_id = activity.activity_details.instance_id
-        await redis_jobs.enqueue_job(
-            "process_activity",
-            activity,
-            guild_id,
-            guild_name,
-            _job_id=f"process_activity-{activity_id}",
-        )
+    await enqueue_activities(ctx, unique_activities, guild_id, guild_name)
 
     log.info(
         f"Processed {len(unique_activities)} games for members of {guild_name} ({guild_id}) active in the last hour"
@@ -342,6 +496,10 @@ async def store_all_games(ctx, guild_id, guild_name, count=30, recent=True):
 
 async def get_member_activity(ctx, member_db, count=250, full_sync=False, mode=0):
     platform_id, member_id, _ = get_primary_membership(member_db)
+    if await ctx["redis_cache"].exists(private_history_key(platform_id, member_id)):
+        log.debug(f"Skipping member {platform_id}-{member_id} with private history")
+        return []
+
     characters = await get_characters(ctx, member_id, platform_id)
     if not characters:
         log.error(
@@ -370,13 +528,17 @@ async def get_characters(ctx, member_id, platform_id):
 
 async def process_activity(ctx, activity, guild_id, guild_name, player_check=False):
     database = ctx["database"]
-    game = GameApi(activity)
+    if isinstance(activity, DestinyActivity):
+        # Queued before jobs switched to activity records
+        game = activity_record(activity)
+    else:
+        game = ActivityRecord(*activity)
     member_dbs = await get_cached_members(ctx, guild_id, guild_name)
 
     clan_dbs = await database.get_clans_by_guild(guild_id)
     clan_ids = [clan.id for clan in clan_dbs]
 
-    game_db = await Game.get_or_none(instance_id=game.instance_id)
+    game_db = await Game.get_or_none(instance_id=game.instance_id, date=game.date)
     if not game_db:
         log.debug(
             f"Skipping missing player check because game {game.instance_id} does not exist"
@@ -384,12 +546,14 @@ async def process_activity(ctx, activity, guild_id, guild_name, player_check=Fal
     elif player_check:
         pgcr = await get_pgcr(ctx, game.instance_id)
         clan_game = ClanGame(pgcr, member_dbs)
-        api_players_db = [
-            await database.get_clan_member_by_platform(
-                player.membership_id, player.membership_type, clan_ids
-            )
+        memberships = [
+            (player.membership_type, player.membership_id)
             for player in clan_game.clan_players
         ]
+        api_players_db = await database.get_clan_members_by_platforms(
+            memberships, clan_ids
+        )
+        api_players_db = list(api_players_db.values())
 
         db_players_db = await ClanMember.filter(
             member__games__game__instance_id=game.instance_id
@@ -406,6 +570,7 @@ async def process_activity(ctx, activity, guild_id, guild_name, player_check=Fal
             raise
 
         if len(missing_player_dbs) > 0:
+            missing_players = []
             for missing_player_db in missing_player_dbs:
                 member_db = missing_player_db.member
                 for game_player in clan_game.clan_players:
@@ -417,9 +582,9 @@ async def process_activity(ctx, activity, guild_id, guild_name, player_check=Fal
                         log.debug(
                             f"Found missing player in {game.instance_id} {game_player}"
                         )
-                        await database.create_game_member(
-                            game_player, game_db, member_dbs[0].clan_id, member_db
-                        )
+                        missing_players.append((member_db.id, game_player))
+            if missing_players:
+                await database.upsert_game_members(game_db, missing_players)
         else:
             log.debug(f"Continuing because game {game.instance_id} exists")
         return
@@ -457,17 +622,6 @@ async def process_activity(ctx, activity, guild_id, guild_name, player_check=Fal
 async def store_member_history(
     ctx, member_db_id, guild_id, guild_name, full_sync=False, count=250, mode=0
 ):
-    redis_jobs = ctx["redis_jobs"]
-
     member_db = await Member.get(id=member_db_id)
     activities = await get_member_activity(ctx, member_db, count, full_sync, mode)
-
-    for activity in activities:
-        activity_id = activity.activity_details.instance_id
-        await redis_jobs.enqueue_job(
-            "process_activity",
-            activity,
-            guild_id,
-            guild_name,
-            _job_id=f"process_activity-{activity_id}",
-        )
+    await enqueue_activities(ctx, activities, guild_id, guild_name)
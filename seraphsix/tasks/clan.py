@@ -1,9 +1,14 @@
 import asyncio
+import discord
 import logging
+import time
 
 from seraphsix import constants
+from seraphsix.cache import clear_member_permissions
+from seraphsix.cogs.utils.helpers import date_as_string
 from seraphsix.cogs.utils.message_manager import MessageManager
 from seraphsix.errors import InvalidAdminError
+from seraphsix.models import deserializer, serializer
 from seraphsix.models.database import (
     Member as MemberDb,
     ClanMember,
@@ -16,35 +21,23 @@ from seraphsix.models.destiny import (
     DestinyMembershipResponse,
     DestinyGroupResponse,
 )
+from seraphsix.reactions import CLAN_APPLICATION
+from seraphsix.sharding import shard_queue
 from seraphsix.tasks.core import (
+    enqueue_jobs,
     execute_pydest,
     execute_pydest_auth,
     get_primary_membership,
+    set_cached_members,
+    set_cached_roster,
 )
+from seraphsix.tasks.parsing import parse_platform
 
 log = logging.getLogger(__name__)
 
 
-async def sort_members(database, member_list):
-    return_list = []
-    for member_hash in member_list:
-        _, platform_id, member_id = map(int, member_hash.split("-"))
-
-        member_db = await database.get_member_by_platform(member_id, platform_id)
-        if platform_id == constants.PLATFORM_XBOX:
-            username = member_db.xbox_username
-        elif platform_id == constants.PLATFORM_PSN:
-            username = member_db.psn_username
-        elif platform_id == constants.PLATFORM_BLIZZARD:
-            username = member_db.blizzard_username
-        elif platform_id == constants.PLATFORM_STEAM:
-            username = member_db.steam_username
-        elif platform_id == constants.PLATFORM_STADIA:
-            username = member_db.stadia_username
-
-        return_list.append(username)
-
-    return sorted(return_list, key=lambda s: s.lower())
+def sort_members(usernames):
+    return sorted(usernames, key=lambda s: s.lower())
 
 
 async def get_all_members(destiny, group_id):
@@ -91,7 +84,10 @@ async def get_database_members(database, clan_id):
 
 
 async def member_sync(ctx, guild_id, guild_name):
-    clan_dbs = await ctx["database"].get_clans_by_guild(guild_id)
+    database = ctx["database"]
+    clan_dbs = await database.get_clans_by_guild(guild_id)
+    clan_db_ids = {clan_db.clan_id: clan_db.id for clan_db in clan_dbs}
+
     member_changes = {}
     for clan_db in clan_dbs:
         member_changes[clan_db.clan_id] = {"added": [], "removed": [], "changed": []}
@@ -106,7 +102,7 @@ async def member_sync(ctx, guild_id, guild_name):
     for clan_db in clan_dbs:
         clan_id = clan_db.clan_id
         bungie_tasks.append(get_bungie_members(ctx["destiny"], clan_id))
-        db_tasks.append(get_database_members(ctx["database"], clan_id))
+        db_tasks.append(get_database_members(database, clan_id))
 
     results = await asyncio.gather(*bungie_tasks, *db_tasks)
 
@@ -123,78 +119,246 @@ async def member_sync(ctx, guild_id, guild_name):
 
     db_member_set = set([member for member in db_members.keys()])
 
-    # Figure out if there are any members to add
-    member_added_dbs = []
-    members_added = bungie_member_set - db_member_set
-    for member_hash in members_added:
-        member_info = bungie_members[member_hash]
-        clan_id, platform_id, member_id = map(int, member_hash.split("-"))
-        member_db = await ctx["database"].get_member_by_platform(member_id, platform_id)
-        if not member_db:
-            member_db = await MemberDb.create(**member_info.to_dict())
-
-        clan_db = await Clan.get(clan_id=clan_id)
-        member_details = dict(
-            join_date=member_info.join_date,
-            platform_id=member_info.platform_id,
-            is_active=True,
-            member_type=member_info.member_type,
-            last_active=member_info.last_online_status_change,
+    members_added = [
+        (member_hash, *map(int, member_hash.split("-")))
+        for member_hash in bungie_member_set - db_member_set
+    ]
+    members_removed = [
+        (member_hash, *map(int, member_hash.split("-")))
+        for member_hash in db_member_set - bungie_member_set
+    ]
+
+    added_member_ids = {clan_id: set() for clan_id in member_changes.keys()}
+
+    async with database.transaction() as connection:
+        # Find all added members that already exist in one query, create the rest
+        # in bulk and then look them up again to get their primary keys
+        memberships = [
+            (platform_id, member_id) for _, _, platform_id, member_id in members_added
+        ]
+        member_dbs = await database.get_members_by_platform_ids(
+            memberships, using_db=connection
         )
 
-        await ClanMember.create(clan=clan_db, member=member_db, **member_details)
+        new_member_dbs = {}
+        for member_hash, _, platform_id, member_id in members_added:
+            if (platform_id, member_id) not in member_dbs:
+                new_member_dbs[(platform_id, member_id)] = MemberDb(
+                    **bungie_members[member_hash].to_dict()
+                )
+
+        if new_member_dbs:
+            await MemberDb.bulk_create(
+                list(new_member_dbs.values()), using_db=connection
+            )
+            member_dbs.update(
+                await database.get_members_by_platform_ids(
+                    new_member_dbs.keys(), using_db=connection
+                )
+            )
 
-        member_added_dbs.append(member_db)
-        member_changes[clan_db.clan_id]["added"].append(member_hash)
+        clanmember_dbs = []
+        for member_hash, clan_id, platform_id, member_id in members_added:
+            member_info = bungie_members[member_hash]
+            member_db = member_dbs[(platform_id, member_id)]
+            clanmember_dbs.append(
+                ClanMember(
+                    clan_id=clan_db_ids[clan_id],
+                    member_id=member_db.id,
+                    join_date=member_info.join_date,
+                    platform_id=member_info.platform_id,
+                    is_active=True,
+                    member_type=member_info.member_type,
+                    last_active=member_info.last_online_status_change,
+                )
+            )
+            added_member_ids[clan_id].add(member_db.id)
+            member_changes[clan_id]["added"].append(
+                parse_platform(member_db, platform_id)[1]
+            )
 
-    # Figure out if there are any members to remove
-    members_removed = db_member_set - bungie_member_set
-    for member_hash in members_removed:
-        clan_id, platform_id, member_id = map(int, member_hash.split("-"))
-        member_db = await ctx["database"].get_member_by_platform(member_id, platform_id)
-        if not member_db:
-            continue
-        await ClanMember.filter(member=member_db).delete()
-        member_changes[clan_db.clan_id]["removed"].append(member_hash)
+        if clanmember_dbs:
+            await ClanMember.bulk_create(clanmember_dbs, using_db=connection)
+
+        # The database members are already keyed by clan, so removals don't need
+        # any further lookups and are attributed to the clan they were found in
+        removed_ids = []
+        for member_hash, clan_id, platform_id, _ in members_removed:
+            clanmember_db = db_members[member_hash]
+            removed_ids.append(clanmember_db.id)
+            member_changes[clan_id]["removed"].append(
+                parse_platform(clanmember_db.member, platform_id)[1]
+            )
+
+        if removed_ids:
+            await ClanMember.filter(id__in=removed_ids).using_db(connection).delete()
 
     # Ensure we bust the member cache before queueing jobs
-    # TODO: Until Tortoise has deserialization support, this has to stay disabled
-    # await set_cached_members(ctx, guild_id, guild_name)
+    await set_cached_members(ctx, guild_id, guild_name)
+    await set_cached_roster(ctx, guild_id)
+    await clear_member_permissions(ctx, [guild_id])
+    await ctx["redis_cache"].publish(constants.SHERPA_INDEX_CHANNEL, guild_id)
 
     for clan_id, changes in member_changes.items():
         if len(changes["added"]):
             # Kick off activity scans for each of the added members
-            for member_db in member_added_dbs:
-                await ctx["redis_jobs"].enqueue_job(
-                    "store_member_history",
-                    member_db.id,
-                    guild_id,
-                    guild_name,
-                    full_sync=True,
-                    _job_id=f"store_member_history-{member_db.id}",
-                )
+            await enqueue_jobs(
+                ctx,
+                "store_member_history",
+                [
+                    (
+                        f"store_member_history-{member_db_id}",
+                        (member_db_id, guild_id, guild_name),
+                    )
+                    for member_db_id in added_member_ids[clan_id]
+                ],
+                _queue_name=shard_queue(guild_id),
+                full_sync=True,
+            )
 
-            changes["added"] = await sort_members(ctx["database"], changes["added"])
+            changes["added"] = sort_members(changes["added"])
             log.info(f"Added members {changes['added']} to clan id {clan_id}")
         if len(changes["removed"]):
-            changes["removed"] = await sort_members(ctx["database"], changes["removed"])
+            changes["removed"] = sort_members(changes["removed"])
             log.info(f"Removed members {changes['removed']} from clan id {clan_id}")
 
     return member_changes
 
 
+def clan_info_key(guild_id):
+    return f"{guild_id}-clan-info"
+
+
+async def get_groups(ctx, clan_dbs):
+    """Group details for each clan keyed by clan id, fetched concurrently
+
+    Clans that could not be fetched are left out so one bad clan doesn't take
+    down the rest.
+    """
+    results = await asyncio.gather(
+        *[
+            execute_pydest(
+                ctx["destiny"].api.get_group,
+                clan_db.clan_id,
+                return_type=DestinyGroupResponse,
+            )
+            for clan_db in clan_dbs
+        ],
+        return_exceptions=True,
+    )
+
+    groups = {}
+    for clan_db, group in zip(clan_dbs, results):
+        if isinstance(group, Exception) or not group.response:
+            log.error(
+                f"Could not get details for clan {clan_db.name} ({clan_db.clan_id}) - {group}"
+            )
+            continue
+        groups[clan_db.clan_id] = group.response
+    return groups
+
+
+def clan_info_embed(clan_id, group):
+    embed = discord.Embed(
+        colour=constants.BLUE,
+        title=group.detail.motto,
+        description=group.detail.about,
+    )
+    embed.set_author(
+        name=f"{group.detail.name} [{group.detail.clan_info.clan_callsign}]",
+        url=f"https://www.bungie.net/en/ClanV2?groupid={clan_id}",
+    )
+    embed.add_field(name="Members", value=group.detail.member_count, inline=True)
+    embed.add_field(
+        name="Founder",
+        value=group.founder.bungie_net_user_info.display_name,
+        inline=True,
+    )
+    embed.add_field(
+        name="Founded",
+        value=date_as_string(group.detail.creation_date),
+        inline=True,
+    )
+    return embed
+
+
+async def get_cached_clan_info(ctx, guild_id):
+    clan_info = await ctx["redis_cache"].get(clan_info_key(guild_id))
+    if not clan_info:
+        return None
+    clan_info = deserializer(clan_info)
+    if not isinstance(clan_info, dict) or "clans" not in clan_info:
+        # Written by an older version, treat it as a miss
+        return None
+    return clan_info
+
+
+async def get_clan_info(ctx, guild_id):
+    """Cached clan info embeds and the time they were built, if any"""
+    clan_info = await get_cached_clan_info(ctx, guild_id)
+    if not clan_info:
+        return None, None
+    embeds = [discord.Embed.from_dict(embed) for _, embed in clan_info["clans"]]
+    return embeds, clan_info["refreshed"]
+
+
+async def set_clan_info(ctx, guild_id, clan_dbs=None, groups=None):
+    if clan_dbs is None:
+        clan_dbs = await ctx["database"].get_clans_by_guild(guild_id)
+    if groups is None:
+        groups = await get_groups(ctx, clan_dbs)
+
+    # Clans that couldn't be fetched keep their previous embed, and the refresh
+    # time isn't moved forward so they are tried again soon
+    previous = await get_cached_clan_info(ctx, guild_id) or {}
+    previous_embeds = dict(previous.get("clans", []))
+    refreshed = time.time()
+    clans = []
+    for clan_db in clan_dbs:
+        if clan_db.clan_id in groups:
+            embed = clan_info_embed(clan_db.clan_id, groups[clan_db.clan_id])
+            clans.append([clan_db.clan_id, embed.to_dict()])
+        else:
+            refreshed = previous.get("refreshed", 0)
+            if clan_db.clan_id in previous_embeds:
+                clans.append([clan_db.clan_id, previous_embeds[clan_db.clan_id]])
+
+    if clans:
+        # Kept well past the refresh interval so readers can be served stale
+        # embeds while a refresh is running
+        await ctx["redis_cache"].set(
+            clan_info_key(guild_id),
+            serializer(dict(refreshed=refreshed, clans=clans)),
+            expire=constants.TIME_DAY_SECONDS,
+        )
+    return [discord.Embed.from_dict(embed) for _, embed in clans]
+
+
+async def refresh_clan_info(ctx):
+    """Rebuild the clan info of every guild before it goes stale"""
+    guild_clans = {}
+    for clan_db in await Clan.all().prefetch_related("guild"):
+        guild_clans.setdefault(clan_db.guild.guild_id, []).append(clan_db)
+
+    for guild_id, clan_dbs in guild_clans.items():
+        _, refreshed = await get_clan_info(ctx, guild_id)
+        if refreshed and time.time() - refreshed < constants.CLAN_INFO_REFRESH_SECONDS:
+            continue
+        await set_clan_info(ctx, guild_id, clan_dbs)
+    log.info(f"Refreshed clan info for {len(guild_clans)} guilds")
+
+
 async def info_sync(ctx, guild_id):
-    clan_dbs = await ctx["database"].get_clans_by_guild(guild_id)
+    clan_dbs = await Clan.filter(guild__guild_id=guild_id)
+    groups = await get_groups(ctx, clan_dbs)
 
     clan_changes = {}
     for clan_db in clan_dbs:
-        group = await execute_pydest(
-            ctx["destiny"].api.get_group,
-            clan_db.clan_id,
-            return_type=DestinyGroupResponse,
-        )
-        bungie_name = group.response.detail.name
-        bungie_callsign = group.response.detail.clan_info.clan_callsign
+        group = groups.get(clan_db.clan_id)
+        if not group:
+            continue
+        bungie_name = group.detail.name
+        bungie_callsign = group.detail.clan_info.clan_callsign
         original_name = clan_db.name
         original_callsign = clan_db.callsign
 
@@ -225,6 +389,7 @@ async def info_sync(ctx, guild_id):
 
         await clan_db.save()
 
+    await set_clan_info(ctx, guild_id, clan_dbs, groups)
     return clan_changes
 
 
@@ -235,72 +400,83 @@ async def ack_clan_application(ctx, payload):
     approver_user = payload.member
     guild = approver_user.guild
 
-    application_db = await ClanMemberApplication.get_or_none(
-        message_id=message_id, approved=False
-    ).prefetch_related("member")
-    if not application_db:
-        log.debug(f"Application not found for {payload}")
-        return
-
-    approver_db = await ClanMember.get_or_none(
-        member_type__gte=constants.CLAN_MEMBER_ADMIN, member__discord_id=approver_id
-    ).prefetch_related("member", "clan")
-    if not approver_db:
-        raise InvalidAdminError
-
-    application_db.approved = is_approved
-    application_db.approved_by_id = approver_db.member.id
-
-    admin_channel = ctx.get_channel(ctx.guild_map[payload.guild_id].admin_channel)
-    applicant_user = guild.get_member(application_db.member.discord_id)
-    if is_approved:
-        ack_message = "Approved"
-    else:
-        ack_message = "Denied"
-
-    admin_message = await admin_channel.send(
-        f"Application for {applicant_user.display_name} was {ack_message} by {approver_user.display_name}."
-    )
-    await applicant_user.send(
-        f"Your application to join {approver_db.clan.name} has been {ack_message}."
-    )
-
-    if is_approved:
-        admin_context = await ctx.get_context(admin_message)
-        manager = MessageManager(admin_context)
+    # Untracked before anything is awaited so a second reaction dispatched
+    # meanwhile is ignored, and tracked again if this one doesn't go through
+    ctx.reactions.untrack(message_id)
+    try:
+        application_db = await ClanMemberApplication.get_or_none(
+            message_id=message_id, approved=False
+        ).prefetch_related("member")
+        if not application_db:
+            log.debug(f"Application not found for {payload}")
+            ctx.reactions.track(message_id, CLAN_APPLICATION)
+            return
+
+        approver_db = await ClanMember.get_or_none(
+            member_type__gte=constants.CLAN_MEMBER_ADMIN, member__discord_id=approver_id
+        ).prefetch_related("member", "clan")
+        if not approver_db:
+            raise InvalidAdminError
+
+        application_db.approved = is_approved
+        application_db.approved_by_id = approver_db.member.id
+
+        admin_channel = ctx.get_channel(ctx.guild_map[payload.guild_id].admin_channel)
+        applicant_user = guild.get_member(application_db.member.discord_id)
+        if is_approved:
+            ack_message = "Approved"
+        else:
+            ack_message = "Denied"
 
-        platform_id, membership_id, username = get_primary_membership(
-            application_db.member
+        admin_message = await admin_channel.send(
+            f"Application for {applicant_user.display_name} was {ack_message} by {approver_user.display_name}."
         )
-
-        res = await execute_pydest_auth(
-            ctx.ext_conns,
-            ctx.ext_conns["destiny"].api.group_invite_member,
-            approver_db.member,
-            manager,
-            group_id=approver_db.clan.clan_id,
-            membership_type=platform_id,
-            membership_id=membership_id,
-            message=f"Join my clan {approver_db.clan.name}!",
-            access_token=approver_db.member.bungie_access_token,
+        await applicant_user.send(
+            f"Your application to join {approver_db.clan.name} has been {ack_message}."
         )
 
-        if res.error_status == "ClanTargetDisallowsInvites":
-            message = f"User **{applicant_user.display_name}** ({username}) has disabled clan invites"
-        elif res.error_status != "Success":
-            message = f"Could not invite **{applicant_user.display_name}** ({username})"
-            log.info(
-                f"Could not invite '{applicant_user.display_name}' ({username}): {res}"
+        if is_approved:
+            admin_context = await ctx.get_context(admin_message)
+            manager = MessageManager(admin_context)
+
+            platform_id, membership_id, username = get_primary_membership(
+                application_db.member
             )
-        else:
-            message = (
-                f"Invited **{applicant_user.display_name}** ({username}) "
-                f"to clan **{approver_db.clan.name}**"
+
+            res = await execute_pydest_auth(
+                ctx.ext_conns,
+                ctx.ext_conns["destiny"].api.group_invite_member,
+                approver_db.member,
+                manager,
+                group_id=approver_db.clan.clan_id,
+                membership_type=platform_id,
+                membership_id=membership_id,
+                message=f"Join my clan {approver_db.clan.name}!",
+                access_token=approver_db.member.bungie_access_token,
             )
 
-        await manager.send_message(message, mention=False, clean=False)
+            if res.error_status == "ClanTargetDisallowsInvites":
+                message = f"User **{applicant_user.display_name}** ({username}) has disabled clan invites"
+            elif res.error_status != "Success":
+                message = (
+                    f"Could not invite **{applicant_user.display_name}** ({username})"
+                )
+                log.info(
+                    f"Could not invite '{applicant_user.display_name}' ({username}): {res}"
+                )
+            else:
+                message = (
+                    f"Invited **{applicant_user.display_name}** ({username}) "
+                    f"to clan **{approver_db.clan.name}**"
+                )
+
+            await manager.send_message(message, mention=False, clean=False)
 
-    await application_db.save()
+        await application_db.save()
+    except Exception:
+        # Leave the application open for another try
+        ctx.reactions.track(message_id, CLAN_APPLICATION)
+        raise
 
     await ctx.ext_conns["redis_cache"].delete(
         f"{payload.guild_id}-clan-application-{application_db.member_id}"
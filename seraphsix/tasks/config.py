@@ -10,7 +10,11 @@ from redis import ConnectionPool
 from seraphsix.constants import (
     LOG_FORMAT_MSG,
     DESTINY_DATE_FORMAT,
+    DB_INGEST_MAX_CONNECTIONS,
     DB_MAX_CONNECTIONS,
+    DESTINY_API_RATE,
+    GAME_RETENTION_MONTHS,
+    PRIVATE_HISTORY_CACHE_SECONDS,
     ROOT_LOG_LEVEL,
 )
 
@@ -115,6 +119,7 @@ class Config(Borg):
     twitter: TwitterConfig
     database_url: str
     database_conns: int
+    database_ingest_conns: int
     discord_api_key: str
     redis_url: str
     arq_redis: RedisSettings
@@ -125,6 +130,14 @@ class Config(Borg):
     activity_cutoff: str
     flask_app_key: str
     root_log_level: str
+    game_retention_months: int
+    game_partition_detach: bool
+    metrics_port: int
+    manifest_path: str
+    destiny_api_rate: int
+    guild_api_weights: dict
+    private_history_cache_seconds: int
+    worker_shards: int
 
     def __init__(self):
         Borg.__init__(self)
@@ -137,6 +150,11 @@ class Config(Borg):
         self.database_conns = get_docker_secret(
             "seraphsix_pg_db_conns", default=DB_MAX_CONNECTIONS, cast_to=int
         )
+        self.database_ingest_conns = get_docker_secret(
+            "seraphsix_pg_db_ingest_conns",
+            default=DB_INGEST_MAX_CONNECTIONS,
+            cast_to=int,
+        )
 
         database_auth = f"{database_user}:{database_password}"
         self.database_url = f"postgres://{database_auth}@{database_host}:{database_port}/{database_name}"
@@ -173,11 +191,45 @@ class Config(Borg):
             "root_log_level", default=ROOT_LOG_LEVEL, cast_to=str
         )
 
+        self.game_retention_months = get_docker_secret(
+            "game_retention_months", default=GAME_RETENTION_MONTHS, cast_to=int
+        )
+        self.game_partition_detach = get_docker_secret(
+            "game_partition_detach", default=False, cast_to=bool
+        )
+        self.metrics_port = get_docker_secret("metrics_port", cast_to=int)
+        # Share of the Destiny API budget per guild, as "guild_id:weight,..."
+        # Guilds not listed get a weight of 1
+        guild_api_weights = get_docker_secret("guild_api_weights", default="")
+        self.guild_api_weights = {}
+        for guild_weight in filter(None, guild_api_weights.split(",")):
+            guild_id, weight = guild_weight.split(":")
+            if float(weight) <= 0:
+                raise ValueError(
+                    f"Weight for guild {guild_id} in guild_api_weights must be positive"
+                )
+            self.guild_api_weights[int(guild_id)] = float(weight)
+
+        self.manifest_path = get_docker_secret(
+            "manifest_path", default="/tmp/seraphsix-manifest", cast_to=str
+        )
+        # How long members with private activity history are left alone
+        self.private_history_cache_seconds = get_docker_secret(
+            "private_history_cache_seconds",
+            default=PRIVATE_HISTORY_CACHE_SECONDS,
+            cast_to=int,
+        )
+        # Number of guild shard queues, 0 runs everything off the default queue
+        self.worker_shards = get_docker_secret("worker_shards", default=0, cast_to=int)
+
         bucket_kwargs = {
             "redis_pool": ConnectionPool.from_url(self.redis_url),
             "bucket_name": "ratelimit",
         }
-        destiny_api_rate = RequestRate(20, Duration.SECOND)
+        self.destiny_api_rate = get_docker_secret(
+            "destiny_api_rate", default=DESTINY_API_RATE, cast_to=int
+        )
+        destiny_api_rate = RequestRate(self.destiny_api_rate, Duration.SECOND)
         self.destiny_api_limiter = Limiter(
             destiny_api_rate, bucket_class=RedisBucket, bucket_kwargs=bucket_kwargs
         )
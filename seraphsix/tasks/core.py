@@ -1,3 +1,4 @@
+# pylama:ignore=E203
 import arq
 import asyncio
 import backoff
@@ -5,8 +6,14 @@ import discord
 import logging
 import pickle
 import pydest
+import uuid
 
 from aiohttp.client_exceptions import ServerDisconnectedError, ClientOSError
+from arq.connections import expires_extra_ms
+from arq.constants import job_key_prefix, result_key_prefix
+from arq.jobs import Job, serialize_job
+from arq.utils import timestamp_ms
+from datetime import datetime, timezone
 from pydest.pydest import PydestException
 from pyrate_limiter import BucketFullException
 
@@ -17,11 +24,19 @@ from seraphsix.models.destiny import (
     DestinyTokenResponse,
     DestinyTokenErrorResponse,
 )
+from seraphsix.models.records import (
+    CachedClanMemberRecord,
+    CachedMemberRecord,
+    InactiveMemberRecord,
+)
+from seraphsix.scheduler import FairScheduler
+from seraphsix.sharding import shard_queue
 from seraphsix.tasks.config import Config
 from seraphsix.errors import MaintenanceError, PrivateHistoryError, InvalidCommandError
 
 log = logging.getLogger(__name__)
 config = Config()
+scheduler = FairScheduler(config.destiny_api_rate, config.guild_api_weights)
 
 
 async def create_redis_jobs_pool():
@@ -37,6 +52,111 @@ async def queue_redis_job(ctx, message, *args, **kwargs):
     await ctx["redis_jobs"].enqueue_job(*args, **kwargs)
 
 
+# Same checks and writes as ArqRedis.enqueue_job, for a whole batch of jobs at
+# once, also counting the queued jobs of the function. KEYS holds the queue and
+# the queued job counts followed by the job and result key of each job, ARGV
+# the shared score, expiry and function followed by the id and payload of each
+# job.
+ENQUEUE_JOBS_SCRIPT = """
+local queue, counts = KEYS[1], KEYS[2]
+local score, expires, func = ARGV[1], ARGV[2], ARGV[3]
+local enqueued = {}
+local count = 0
+for i = 1, (#KEYS - 2) / 2 do
+    local job_key, result_key = KEYS[i * 2 + 1], KEYS[i * 2 + 2]
+    local job_id, job = ARGV[i * 2 + 2], ARGV[i * 2 + 3]
+    if redis.call("EXISTS", job_key, result_key) == 0 then
+        redis.call("PSETEX", job_key, expires, job)
+        redis.call("ZADD", queue, score, job_id)
+        enqueued[i] = 1
+        count = count + 1
+    else
+        enqueued[i] = 0
+    end
+end
+if count > 0 then
+    redis.call("HINCRBY", counts, func, count)
+end
+return enqueued
+"""
+
+
+async def enqueue_jobs(ctx, function, jobs, _queue_name=None, **kwargs):
+    """Enqueue many jobs for one function, in batches of one redis call each
+
+    `jobs` is a list of (job_id, args) pairs and kwargs are passed to every
+    job. Like enqueue_job, jobs whose id is already queued or has a result are
+    skipped and come back as None.
+    """
+    redis_jobs = ctx["redis_jobs"]
+    queue_name = _queue_name or redis_jobs.default_queue_name
+    retval = []
+    for start in range(0, len(jobs), constants.ARQ_ENQUEUE_BATCH_SIZE):
+        batch = [
+            (job_id or uuid.uuid4().hex, args)
+            for job_id, args in jobs[start : start + constants.ARQ_ENQUEUE_BATCH_SIZE]
+        ]
+        enqueue_time_ms = timestamp_ms()
+        keys = [queue_name, constants.QUEUED_JOBS_KEY]
+        args = [enqueue_time_ms, expires_extra_ms, function]
+        for job_id, job_args in batch:
+            keys.extend([job_key_prefix + job_id, result_key_prefix + job_id])
+            args.extend(
+                [
+                    job_id,
+                    serialize_job(
+                        function,
+                        job_args,
+                        kwargs,
+                        None,
+                        enqueue_time_ms,
+                        serializer=redis_jobs.job_serializer,
+                    ),
+                ]
+            )
+
+        enqueued = await redis_jobs.eval(ENQUEUE_JOBS_SCRIPT, keys=keys, args=args)
+        retval.extend(
+            [
+                Job(
+                    job_id,
+                    redis=redis_jobs,
+                    _queue_name=queue_name,
+                    _deserializer=redis_jobs.job_deserializer,
+                )
+                if was_enqueued
+                else None
+                for (job_id, _), was_enqueued in zip(batch, enqueued)
+            ]
+        )
+
+    log.info(f"Queued {len([job for job in retval if job])} {function} jobs")
+    return retval
+
+
+async def enqueue_guild_jobs(ctx, function, jobs, **kwargs):
+    """Like enqueue_jobs, for jobs whose first argument is a guild id
+
+    Each job goes to the shard queue of its guild, results come back in order.
+    """
+    queues = {}
+    for index, (job_id, args) in enumerate(jobs):
+        queues.setdefault(shard_queue(args[0]), []).append((index, (job_id, args)))
+
+    retval = [None] * len(jobs)
+    for queue_name, queue_jobs in queues.items():
+        enqueued = await enqueue_jobs(
+            ctx,
+            function,
+            [job for _, job in queue_jobs],
+            _queue_name=queue_name,
+            **kwargs,
+        )
+        for (index, _), job in zip(queue_jobs, enqueued):
+            retval[index] = job
+    return retval
+
+
 def backoff_handler(details):
     if details["wait"] > 30 or details["tries"] > 10:
         log.debug(
@@ -57,6 +177,7 @@ def backoff_handler(details):
         ServerDisconnectedError,
         ClientOSError,
     ),
+    max_time=constants.DESTINY_API_BACKOFF_SECONDS,
     logger=None,
     on_backoff=backoff_handler,
 )
@@ -70,6 +191,7 @@ async def execute_pydest(function, *args, **kwargs):
 
     log.debug(f"{function} {args} {kwargs}")
 
+    await scheduler.acquire()
     async with config.destiny_api_limiter.ratelimit("destiny_api", delay=True):
         data = await function(*args, **kwargs)
 
@@ -221,44 +343,162 @@ async def wait_for_msg(channel):
         return pickle.loads(pickled_msg)
 
 
-# def member_dbs_to_dict(member_dbs):
-#     members = []
-#     for member_db in member_dbs:
-#         member_dict = model_to_dict(member_db, recurse=False)
-#         member_dict['clanmember'] = model_to_dict(member_db.clanmember, recurse=False)
-#         members.append(member_dict)
-#     return members
+def members_key(guild_id):
+    return f"{guild_id}-members"
+
+
+def member_snapshot(member_dbs):
+    """Flatten clan members into the compact rows stored in the member cache"""
+    return dict(
+        version=constants.MEMBER_CACHE_VERSION,
+        members=[
+            [
+                member_db.clan_id,
+                member_db.join_date.timestamp(),
+                member_db.member.id,
+                member_db.member.discord_id,
+                member_db.member.bungie_id,
+                member_db.member.xbox_id,
+                member_db.member.psn_id,
+                member_db.member.blizzard_id,
+                member_db.member.steam_id,
+                member_db.member.stadia_id,
+            ]
+            for member_db in member_dbs
+        ],
+    )
+
+
+def member_snapshot_records(snapshot):
+    return [
+        CachedClanMemberRecord(
+            clan_id,
+            datetime.fromtimestamp(join_date, tz=timezone.utc),
+            CachedMemberRecord(*member),
+        )
+        for clan_id, join_date, *member in snapshot["members"]
+    ]
 
 
 async def get_cached_members(ctx, guild_id, guild_name):
-    return await ctx["database"].get_clan_members_by_guild_id(guild_id)
-    # TODO: Until Tortoise has deserialization support, this has to stay disabled
-    # cache_key = f'{guild_id}-members'
-    # clan_members = await ctx['redis_cache'].get(cache_key)
-    # if not clan_members:
-    #     clan_members = await set_cached_members(ctx, guild_id, guild_name)
-    # clan_members = deserializer(clan_members)
-    # member_dbs = [dict_to_model(ClanMember, member) for member in clan_members]
-    # return member_dbs
+    snapshot = await ctx["redis_cache"].get(members_key(guild_id))
+    if snapshot:
+        snapshot = deserializer(snapshot)
+        # Snapshots written by an older release are rebuilt instead of decoded
+        if snapshot.get("version") == constants.MEMBER_CACHE_VERSION:
+            return member_snapshot_records(snapshot)
+    return await set_cached_members(ctx, guild_id, guild_name)
+
+
+def inactive_report_key(guild_id, clan_id):
+    return f"{guild_id}-clan-inactive-{clan_id}"
+
+
+async def set_inactive_report(ctx, guild_id, clan_id):
+    report = await ctx["database"].get_inactive_report(clan_id)
+    await ctx["redis_cache"].set(
+        inactive_report_key(guild_id, clan_id),
+        serializer([list(record) for record in report]),
+        expire=constants.TIME_DAY_SECONDS,
+    )
+    return report
+
+
+async def get_inactive_report(ctx, guild_id, clan_id):
+    report = await ctx["redis_cache"].get(inactive_report_key(guild_id, clan_id))
+    if not report:
+        return await set_inactive_report(ctx, guild_id, clan_id)
+    return [InactiveMemberRecord(*record) for record in deserializer(report)]
+
+
+async def set_inactive_reports(ctx, guild_id):
+    for clan_db in await ctx["database"].get_clans_by_guild(guild_id):
+        await set_inactive_report(ctx, guild_id, clan_db.id)
+    log.info(f"Refreshed inactive member reports for {guild_id}")
 
 
 async def set_cached_members(ctx, guild_id, guild_name):
-    return
-    # TODO: Until Tortoise has deserialization support, this has to stay disabled
-    # cache_key = f'{guild_id}-members'
-    # redis_cache = ctx['redis_cache']
-    # database = ctx['database']
-
-    # members = []
-    # member_dbs = await database.get_clan_members_by_guild_id(guild_id)
-    # for member_db in member_dbs:
-    #     member_dict = model_to_dict(member_db.clanmember, recurse=False)
-    #     member_dict['member'] = model_to_dict(member_db, recurse=False)
-    #     members.append(member_dict)
-    # members = serializer([member for member in members])
-    # await redis_cache.set(cache_key, members, expire=constants.TIME_HOUR_SECONDS)
-    # log.info(f"Successfully cached all members of {guild_name} ({guild_id})")
-    # return members
+    member_dbs = await ctx["database"].get_clan_members_by_guild_id(guild_id)
+    snapshot = member_snapshot(member_dbs)
+    await ctx["redis_cache"].set(
+        members_key(guild_id),
+        serializer(snapshot),
+        expire=constants.TIME_HOUR_SECONDS * 2,
+    )
+    log.info(f"Successfully cached all members of {guild_name} ({guild_id})")
+    return member_snapshot_records(snapshot)
+
+
+def roster_key(guild_id):
+    return f"{guild_id}-clan-roster"
+
+
+def roster_entries(member_dbs):
+    """Sorted roster entries, timezones and emojis are left for render time"""
+    platform_names = {v: k for k, v in constants.PLATFORM_MAP.items()}
+    clans = {}
+    for clanmember in member_dbs:
+        member = clanmember.member
+        memberships = get_memberships(member)
+        if not memberships:
+            continue
+        if constants.PLATFORM_BUNGIE in memberships.keys():
+            username = memberships[constants.PLATFORM_BUNGIE][1]
+        else:
+            username = list(memberships.values())[0][1]
+
+        clans.setdefault(clanmember.clan.id, {})[username] = [
+            username,
+            [platform_names[platform_id] for platform_id in memberships.keys()],
+            f"{clanmember.clan.name} [{clanmember.clan.callsign}]",
+            clanmember.join_date.strftime(constants.DATE_FORMAT),
+            member.timezone,
+        ]
+
+    return [
+        clans[clan_id][username]
+        for clan_id in sorted(clans.keys())
+        for username in sorted(clans[clan_id].keys())
+    ]
+
+
+async def set_cached_roster(ctx, guild_id):
+    member_dbs = await ctx["database"].get_clan_members_by_guild_id(guild_id)
+    entries = roster_entries(member_dbs)
+    key = roster_key(guild_id)
+    tr = ctx["redis_cache"].multi_exec()
+    tr.delete(key)
+    if entries:
+        tr.rpush(key, *[serializer(entry) for entry in entries])
+        tr.expire(key, constants.TIME_DAY_SECONDS)
+    await tr.execute()
+    log.info(f"Cached roster of {len(entries)} members for {guild_id}")
+    return entries
+
+
+async def get_cached_roster(ctx, guild_id, count):
+    """The first `count` roster entries and the size of the roster"""
+    key = roster_key(guild_id)
+    tr = ctx["redis_cache"].multi_exec()
+    tr.lrange(key, 0, count - 1)
+    tr.llen(key)
+    entries, size = await tr.execute()
+    if not size:
+        entries = await set_cached_roster(ctx, guild_id)
+        return entries[:count], len(entries)
+    return [deserializer(entry) for entry in entries], size
+
+
+async def get_cached_roster_range(ctx, guild_id, start, stop):
+    entries = await ctx["redis_cache"].lrange(roster_key(guild_id), start, stop)
+    return [deserializer(entry) for entry in entries]
+
+
+async def clear_cached_roster(ctx, guild_ids):
+    tr = ctx["redis_cache"].multi_exec()
+    for guild_id in guild_ids:
+        tr.delete(roster_key(guild_id))
+    await tr.execute()
 
 
 def get_primary_membership(member_db, restrict_platform_id=None):
@@ -270,6 +510,7 @@ def get_primary_membership(member_db, restrict_platform_id=None):
     ]
     membership_id = member_db.primary_membership_id
     platform_id = None
+    username = None
     for membership in memberships:
         if membership_id and membership[1] == membership_id:
             platform_id = membership[0]
@@ -281,8 +522,9 @@ def get_primary_membership(member_db, restrict_platform_id=None):
             platform_id, membership_id, username = membership
             break
 
-    if not platform_id and not membership_id:
+    if not platform_id:
         log.error(f"Platform not found in membership list {memberships}")
+        return None, None, None
     return platform_id, membership_id, username
 
 
@@ -3,15 +3,15 @@ import logging
 
 from tortoise.expressions import Subquery
 
-from seraphsix.models.database import ClanMember, Guild, Role
+from seraphsix.models.database import ClanMember, Role
 
 
 log = logging.getLogger(__name__)
 
 
 async def convert_sherpas(bot, sherpas):
-    for sherpa in sherpas:
-        yield await bot.fetch_user(sherpa)
+    users = await bot.user_cache.resolve(sherpas)
+    return [user for user in users.values() if user]
 
 
 async def find_sherpas(bot, guild):
@@ -44,7 +44,7 @@ async def store_sherpas(bot, guild):
         members = ClanMember.filter(member__discord_id__in=sherpas_added)
         await ClanMember.filter(id__in=Subquery(members)).update(is_sherpa=True)
 
-        added = [sherpa async for sherpa in convert_sherpas(bot, sherpas_added)]
+        added = await convert_sherpas(bot, sherpas_added)
         message_added = [f"{str(sherpa)} {sherpa.id}" for sherpa in added]
         log.info(
             f"Sherpas added in {str(discord_guild)} ({guild.guild_id}): {message_added}"
@@ -54,7 +54,7 @@ async def store_sherpas(bot, guild):
         members = ClanMember.filter(member__discord_id__in=sherpas_removed)
         await ClanMember.filter(id__in=Subquery(members)).update(is_sherpa=False)
 
-        removed = [sherpa async for sherpa in convert_sherpas(bot, sherpas_removed)]
+        removed = await convert_sherpas(bot, sherpas_removed)
         message_removed = [f"{str(sherpa)} {sherpa.id}" for sherpa in removed]
         log.info(
             f"Sherpas removed in {str(discord_guild)} ({guild.guild_id}): {message_removed}"
@@ -70,42 +70,22 @@ async def update_sherpa(bot, before, after):
     if before_role_ids == after_role_ids:
         return
 
-    guild_db = await Guild.get(guild_id=after.guild.id)
+    guild_db = await bot.guild_cache.get(after.guild.id)
     if not guild_db.track_sherpas:
-        log.debug(
-            f"Cannot check for sherpa role updates on user {str(after)} ({after.id}) "
-            f"because sherpa tracking is disabled in {str(after.guild)} ({after.guild.id})"
-        )
         return
 
-    log.debug(
-        f"Checking for sherpa role updates on user {str(after)} ({after.id}) "
-        f"in {str(after.guild)} ({after.guild.id})"
-    )
-
-    roles_db = await Role.filter(guild__guild_id=after.guild.id, is_sherpa=True)
-    role_db_ids = set([role.role_id for role in roles_db])
-
-    member_db = await ClanMember.get_or_none(member__discord_id=after.id)
-    if not member_db:
-        log.info(
-            f"Clan member for user {str(after)} ({after.id}) "
-            f"in {str(after.guild)} ({after.guild.id}) not found"
-        )
+    role_ids, discord_ids = await bot.sherpa_index.get(after.guild.id)
+    if after.id not in discord_ids:
         return
 
-    if not after_role_ids:
-        member_is_sherpa = False
-    elif after_role_ids.intersection(role_db_ids):
-        member_is_sherpa = True
-    else:
-        member_is_sherpa = False
+    was_sherpa = bool(before_role_ids.intersection(role_ids))
+    member_is_sherpa = bool(after_role_ids.intersection(role_ids))
+    if member_is_sherpa == was_sherpa:
+        return
 
-    if member_is_sherpa != member_db.is_sherpa:
-        log.info(
-            f"Sherpa role changed from {member_db.is_sherpa} to {member_is_sherpa} "
-            f"for user {str(after)} ({after.id}) "
-            f"in {str(after.guild)} ({after.guild.id}) "
-        )
-        member_db.is_sherpa = member_is_sherpa
-        await member_db.save()
+    log.info(
+        f"Sherpa role changed from {was_sherpa} to {member_is_sherpa} "
+        f"for user {str(after)} ({after.id}) "
+        f"in {str(after.guild)} ({after.guild.id}) "
+    )
+    bot.sherpa_index.queue(after.guild.id, after.id, member_is_sherpa)
@@ -1,15 +1,23 @@
 from seraphsix import constants
 
+PLATFORM_NAMES = {v: k for k, v in constants.PLATFORM_MAP.items()}
+
 
 def member_hash(member):
     return f"{member.membership_type}-{member.membership_id}"
 
 
 def member_hash_db(member_db, platform_id):
-    membership_id, _ = parse_platform(member_db, platform_id)
+    membership_id = parse_platform_id(member_db, platform_id)
     return f"{platform_id}-{membership_id}"
 
 
+def parse_platform_id(member_db, platform_id):
+    """Membership id only, works on cached members which carry no usernames"""
+    platform_name = PLATFORM_NAMES[platform_id]
+    return getattr(member_db, f"{platform_name}_id")
+
+
 def parse_platform(member_db, platform_id):
     if platform_id == constants.PLATFORM_BUNGIE:
         member_id = member_db.bungie_id
@@ -0,0 +1,53 @@
+import logging
+
+from datetime import date
+
+from seraphsix import constants
+from seraphsix.database import add_months, month_start, retention_horizon
+from seraphsix.tasks.config import Config
+
+log = logging.getLogger(__name__)
+config = Config()
+
+
+async def maintain_game_partitions(ctx):
+    database = ctx["database"]
+    current_month = month_start(date.today())
+
+    # Always keep a few months of partitions ahead of the current date so new
+    # games never fall into the default partition
+    await database.create_game_partitions(
+        current_month, constants.GAME_PARTITION_MONTHS_AHEAD + 1
+    )
+
+    horizon = retention_horizon(config.game_retention_months)
+    partition_state = await database.get_game_partition_state()
+
+    full_list = list(constants.SUPPORTED_GAME_MODES.values())
+    mode_list = list(set([mode for sublist in full_list for mode in sublist]))
+
+    # Games for detached months, or from before the first partition, end up in
+    # the default partitions and are rolled up from there
+    partition_months = set(await database.get_game_partition_months())
+    default_months = set(await database.get_game_default_months())
+    months = partition_months | default_months
+
+    for month in sorted(months):
+        if month >= horizon:
+            continue
+
+        state = partition_state.get(month)
+        if month not in partition_months:
+            await database.rollup_game_default(month, mode_list)
+            continue
+
+        if not state or not state.rolled_up or state.dirty:
+            await database.rollup_game_partition(month, mode_list)
+
+        if config.game_partition_detach:
+            await database.detach_game_partition(month)
+
+    log.info(
+        f"Game partitions maintained through {add_months(current_month, constants.GAME_PARTITION_MONTHS_AHEAD)} "
+        f"with a retention horizon of {horizon}"
+    )
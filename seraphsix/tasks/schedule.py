@@ -0,0 +1,65 @@
+import logging
+
+from seraphsix import constants
+from seraphsix.cache import get_guild_names
+from seraphsix.models.database import Guild
+from seraphsix.tasks.core import enqueue_guild_jobs
+
+log = logging.getLogger(__name__)
+
+
+async def acquire_leader(ctx, name, ttl):
+    """Claim a schedule for `ttl` seconds, only one replica gets it per period"""
+    key = f"leader-{name}"
+    acquired = await ctx["redis_cache"].set(
+        key, ctx["instance_id"], expire=ttl, exist="SET_IF_NOT_EXIST"
+    )
+    if not acquired:
+        log.debug(f"Skipping {name}, another instance holds the leader lock")
+    return bool(acquired)
+
+
+async def get_guilds(ctx):
+    guild_names = await get_guild_names(ctx["redis_cache"])
+    return [
+        (guild_db.guild_id, guild_names.get(guild_db.guild_id, str(guild_db.guild_id)))
+        for guild_db in await Guild.all()
+    ]
+
+
+async def schedule_member_updates(ctx):
+    # Held a little short of the interval so the next run isn't locked out
+    if not await acquire_leader(
+        ctx, "update-members", constants.UPDATE_MEMBERS_SECONDS - 30
+    ):
+        return
+
+    guilds = await get_guilds(ctx)
+    log.info(
+        f"Queueing tasks to find last active dates and recent games for {len(guilds)} guilds"
+    )
+    await enqueue_guild_jobs(
+        ctx,
+        "store_last_active",
+        [(f"store_last_active-{guild[0]}", guild) for guild in guilds],
+    )
+    await enqueue_guild_jobs(
+        ctx,
+        "store_all_games",
+        [(f"store_all_games-{guild[0]}", guild) for guild in guilds],
+    )
+
+
+async def schedule_member_caches(ctx):
+    if not await acquire_leader(
+        ctx, "cache-clan-members", constants.TIME_HOUR_SECONDS - 60
+    ):
+        return
+
+    guilds = await get_guilds(ctx)
+    log.info(f"Queueing tasks to update cached members of {len(guilds)} guilds")
+    await enqueue_guild_jobs(
+        ctx,
+        "set_cached_members",
+        [(f"set_cached_members-{guild[0]}", guild) for guild in guilds],
+    )